@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed reuse of finished YamboCalculations.
+
+The fingerprint of a calculation covers everything that determines its results: the input
+parameters, the settings (without the ones that only change how the outputs are parsed
+or how the parent is staged, see _ignored_settings), the codes, the precode parameters
+and the parent remote folder.
+
+The reuse is on by default. The REUSE_CALCULATIONS setting (boolean, default True)
+controls it:
+    True    the fingerprint is written on every YamboCalculation as the extra
+            yambo_fingerprint, by YamboCalculation._prepare_for_submission (that is when
+            the calculation is submitted, not when it is created), and YamboRestartWf
+            returns a finished calculation with the same fingerprint (find_cached_calculation)
+            instead of submitting a new one
+    False   the extra is still written, but the workflow always submits a new calculation
+Calculations submitted before this extra existed have no fingerprint and are never reused.
+"""
+import hashlib
+import json
+from aiida.common.datastructures import calc_states
+from aiida_quantumespresso.calculations import _uppercase_dict
+
+_fingerprint_extra = 'yambo_fingerprint'
+# settings that do not change the results of the calculation
+_ignored_settings = ['PARSER_PROCESSES', 'PARSER_CACHE', 'PARSER_ISOLATE', 'PARSER_TIMEOUT',
+                     'PARSER_MEMORY_LIMIT', 'PARSER_SIZE_BUDGETS', 'PARSER_MAX_WARNINGS',
+                     'QP_STORAGE', 'QP_PRECISION', 'QP_WINDOW', 'SAVE_STAGING', 'SAVE_POOL',
+                     'REUSE_SCREENING', 'REUSE_CALCULATIONS', 'RESTART_INCOMPLETE_QP']
+
+def input_fingerprint(parameters, settings, code, parent_folder, preprocessing_code=None, precode_parameters=None):
+    """
+    SHA-256 of the inputs of a YamboCalculation: parameters, settings and precode_parameters
+    as dictionaries, the codes and the parent_folder as nodes
+    """
+    settings = _uppercase_dict(settings or {}, dict_name='settings')
+    identity = {'parameters': parameters or {},
+                'settings': dict((k, v) for k, v in settings.items() if k not in _ignored_settings),
+                'code': code.uuid,
+                'preprocessing_code': preprocessing_code.uuid if preprocessing_code is not None else None,
+                'precode_parameters': precode_parameters or {},
+                'parent_folder': parent_folder.uuid}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+def find_cached_calculation(fingerprint):
+    """
+    Newest finished YamboCalculation with the given fingerprint, None if there is none
+    """
+    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_yambo.calculations.gw import YamboCalculation
+    qb = QueryBuilder()
+    qb.append(YamboCalculation, filters={'extras.' + _fingerprint_extra: fingerprint})
+    qb.order_by({YamboCalculation: {'ctime': 'desc'}})
+    for row in qb.all():
+        if row[0].get_state() == calc_states.FINISHED:
+            return row[0]
+    return None
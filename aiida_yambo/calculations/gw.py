@@ -16,13 +16,17 @@ from aiida.orm.utils import DataFactory, CalculationFactory
 from aiida.orm.code import Code
 from aiida.common import aiidalogger
 from aiida.common.links import LinkType
+from aiida_yambo.calculations.savepool import inputs_pool_key, _pool_extra
+from aiida_yambo.calculations.fingerprint import input_fingerprint, _fingerprint_extra
+from aiida_yambo.calculations.yamboinput import yambo_input
+from aiida_yambo.calculations.screening import screening_compatible, reuse_screening, _screening_extra
 PwCalculation = CalculationFactory('quantumespresso.pw')
 
 __copyright__ = u"Copyright (c), 2014-2015, École Polytechnique Fédérale de Lausanne (EPFL), Switzerland, Laboratory of Theory and Simulation of Materials (THEOS). All rights reserved."
 __license__ = "Non-Commercial, End-User Software License Agreement, see LICENSE.txt file"
 __version__ = "0.4.1"
 __authors__ = "Gianluca Prandini, Antimo Marrazzo, Michael Atambo and the AiiDA team."
-    
+
 class YamboCalculation(JobCalculation):
     """
     Yambo code.
@@ -45,6 +49,13 @@ class YamboCalculation(JobCalculation):
         self._DEFAULT_OUTPUT_FILE = 'aiida.out'
 
         self._SCRATCH_FOLDER = 'SAVE'
+        # SAVE of a yambo parent with the SAVE_STAGING: 'link' setting: the databases written
+        # by p2y are only read and are symlinked, the ndb.* ones yambo may rewrite are copied
+        self._SAVE_LINKED = ['ns.*']
+        self._SAVE_COPIED = ['ndb.*']
+        # link to the job folder of a parent with compatible screening databases, chained
+        # after the job folder of the calculation:  -J aiida,screening
+        self._SCREENING_LINK = 'screening'
 
         self._LOGOSTRING = """#                                                           
 # Y88b    /   e           e    e      888~~\    ,88~-_      
@@ -141,7 +152,7 @@ class YamboCalculation(JobCalculation):
             if not initialise:
                 raise InputValidationError("No parameters specified for this calculation")
             else:    
-                pass
+                parameters = None
         if not initialise:
             if not isinstance(parameters, ParameterData):
                 raise InputValidationError("parameters is not of type ParameterData")
@@ -212,117 +223,10 @@ class YamboCalculation(JobCalculation):
 
         
         if not initialise:
-        ###################################################
-        # Prepare yambo input file
-        ###################################################
-        
-            params_dict = parameters.get_dict()
-            
-            # extract boolean keys
-            boolean_dict = { k:v for k,v in params_dict.iteritems() if isinstance(v,bool) }
-            params_dict = { k:v for k,v in params_dict.iteritems() if k not in boolean_dict.keys() }
-            
-            # reorganize the dictionary and create a list of dictionaries with key, value and units
-            parameters_list = []
-            for k,v in params_dict.iteritems():
-                
-                if "_units" in k:
-                    continue
-                
-                units_key = "{}_units".format(k)
-                try:
-                    units = params_dict[units_key]
-                except KeyError:
-                    units = None
-                
-                this_dict = {}
-                this_dict['key'] = k
-                this_dict['value'] = v
-                this_dict['units'] = units
-                
-                parameters_list.append( this_dict )
-            
+            # the input file is rendered in canonical order in one buffer (see yamboinput)
             input_filename = tempfolder.get_abs_path(self._INPUT_FILE_NAME)
-            
-            ## create an empty folder for the Yambo scratch
-            #tempfolder.get_subfolder(self._SCRATCH_FOLDER, create=True)
-            
             with open(input_filename,'w') as infile:
-                infile.write( self._LOGOSTRING)
-                
-                for k,v in boolean_dict.iteritems():
-                    if v:
-                        infile.write( "{}\n".format(k) )
-                
-    #         .format(key.lower(), value_string)   
-                
-                for this_dict in parameters_list:
-                    key = this_dict['key']
-                    value = this_dict['value']
-                    units = this_dict['units']
-                
-                    if isinstance(value,(tuple,list)):
-                        print("instance key: {}, val{}".format(key, value))        
-                        # write the input flags for the Drude term and for the parallelization options of vers. 4 
-                        # (it can be implemented in a better way)
-                        if key.startswith('DrudeW'):
-                            value_string = " ( " + ",".join([str(_) for _ in value]) + " )"
-                            the_string = "{} = {}".format(key, value_string)
-                            the_string += " {}".format(units)
-                            infile.write( the_string + "\n" )
-                            continue
-                        
-                        if key == 'SE_CPU':
-                            value_string = " \" " + " ".join([str(_) for _ in value]) + " \" "
-                            the_string = "{} = {}".format(key, value_string)
-                            infile.write( "SE_ROLEs = \" q qp b  \" " + "\n" )
-                            infile.write( the_string + "\n" )
-                            continue
-                        
-                        if key == 'X_all_q_CPU':
-                            value_string = " \" " + " ".join([str(_) for _ in value]) + " \" "
-                            the_string = "{} = {}".format(key, value_string)
-                            infile.write( "X_all_q_ROLEs = \" q k c v  \" " + "\n" )
-                            infile.write( the_string + "\n" )
-                            continue
-                        
-                        if key == 'X_finite_q_CPU':
-                            value_string = " \" " + " ".join([str(_) for _ in value]) + " \" "
-                            the_string = "{} = {}".format(key, value_string)
-                            infile.write( "X_finite_q_ROLEs = \" q k c v  \" " + "\n" )
-                            infile.write( the_string + "\n" )
-                            continue
-                        
-                        if key == 'X_q_0_CPU':
-                            value_string = " \" " + " ".join([str(_) for _ in value]) + " \" "
-                            the_string = "{} = {}".format(key, value_string)
-                            infile.write( "X_q_0_ROLEs = \" k c v  \" " + "\n" )
-                            infile.write( the_string + "\n" )
-                            continue
-                        
-                        if key == 'QPkrange' or key == 'QPerange':
-                            value_string = ''
-                            for v in value:
-                                value_string += " | ".join([str(_) for _ in v]) + " |\n"    
-                            the_string = "% {}\n {}".format(key, value_string)    
-                            the_string += "%"  
-                            infile.write( the_string + "\n" )
-                            continue    
-                                                             
-                        value_string = " | ".join([str(_) for _ in value]) + " |"
-                        the_string = "% {}\n {}".format(key, value_string)
-                        if units is not None:
-                            the_string += " {}".format(units)
-                        the_string += "\n%"
-                            
-                    else:
-                        print("else key: {}, val{}".format(key, value))        
-                        the_value = '"{}"'.format(value) if isinstance(value,basestring) else '{}'.format(value)
-                        the_string = "{} = {}".format(key, the_value)
-                        if units is not None:
-                            the_string += " {}".format(units)
-    
-                    infile.write( the_string + "\n" )
+                infile.write(yambo_input(parameters.get_dict(), header=self._LOGOSTRING))
 
 
         ############################################
@@ -330,7 +234,6 @@ class YamboCalculation(JobCalculation):
         ############################################
         
         parent_calcs = parent_calc_folder.get_inputs(link_type=LinkType.CREATE)
-        print("parent_calcs {}  folder {}".format(parent_calcs, parent_calc_folder))
         if len(parent_calcs)>1:
             raise UniquenessError("More than one parent totalenergy calculation" 
                                   "has been found for parent_calc_folder {}".format(parent_calc_folder))
@@ -346,7 +249,41 @@ class YamboCalculation(JobCalculation):
             except KeyError:
                 parent_initialise = False
         
-        if yambo_parent:
+        # share the SAVE of a p2y initialisation with the calculations starting from the
+        # same NSCF (see aiida_yambo.calculations.savepool)
+        save_pool = settings_dict.pop('SAVE_POOL', False)
+        if not isinstance(save_pool, bool):
+            raise InputValidationError("SAVE_POOL must be a boolean")
+        if save_pool and initialise and self.is_stored:
+            self.set_extra(_pool_extra, inputs_pool_key(parent_calc_folder, preproc_code,
+                                                        precode_parameters, settings))
+
+        # how the SAVE of a yambo parent is staged: copied whole, or linked (see _SAVE_LINKED)
+        save_staging = settings_dict.pop('SAVE_STAGING', 'link' if save_pool else 'copy')
+        if save_staging not in ('copy', 'link'):
+            raise InputValidationError("SAVE_STAGING must be 'copy' or 'link'")
+
+        if yambo_parent and save_staging == 'link':
+            # the links and copies go into an empty SAVE uploaded with the input file;
+            # the parent remote folder must then be kept as long as this calculation is used
+            tempfolder.get_subfolder(self._SCRATCH_FOLDER, create=True)
+            for pattern in self._SAVE_LINKED:
+                remote_symlink_list.append(
+                                    (
+                                     parent_calc_folder.get_computer().uuid,
+                                     os.path.join(parent_calc_folder.get_remote_path(),"SAVE",pattern),
+                                     "SAVE/"
+                                     )
+                                    )
+            for pattern in self._SAVE_COPIED:
+                remote_copy_list.append(
+                                    (
+                                     parent_calc_folder.get_computer().uuid,
+                                     os.path.join(parent_calc_folder.get_remote_path(),"SAVE",pattern),
+                                     "SAVE/"
+                                     )
+                                    )
+        elif yambo_parent:
             remote_copy_list.append(
                                     (
                                      parent_calc_folder.get_computer().uuid,
@@ -354,6 +291,28 @@ class YamboCalculation(JobCalculation):
                                      "SAVE/"
                                      )
                                     )
+
+        # reuse the screening of a compatible yambo parent (opt-out, see screening)
+        reuse = reuse_screening(settings_dict)
+        settings_dict.pop('REUSE_SCREENING', None)
+        job_string = self._OUTPUT_FILE_NAME
+
+        # record the fingerprint of the inputs, finished calculations with the same one are
+        # reused by YamboRestartWf unless REUSE_CALCULATIONS is False (see fingerprint)
+        reuse_calculations = settings_dict.pop('REUSE_CALCULATIONS', True)
+        if not isinstance(reuse_calculations, bool):
+            raise InputValidationError("REUSE_CALCULATIONS must be a boolean")
+        # and restarts a finished GW calculation whose QP results miss states of QPkrange (opt-in)
+        restart_incomplete_qp = settings_dict.pop('RESTART_INCOMPLETE_QP', False)
+        if not isinstance(restart_incomplete_qp, bool):
+            raise InputValidationError("RESTART_INCOMPLETE_QP must be a boolean")
+        if self.is_stored:
+            self.set_extra(_fingerprint_extra, input_fingerprint(
+                               parameters.get_dict() if parameters is not None else None,
+                               settings.get_dict() if settings is not None else None,
+                               main_code, parent_calc_folder, preproc_code, precode_param_dict))
+
+        if yambo_parent:
             if not parent_initialise:
                 cancopy = False
                 if parent_calc.get_state() == calc_states.FINISHED:
@@ -363,7 +322,25 @@ class YamboCalculation(JobCalculation):
                         cancopy = True 
                     if parent_calc.get_outputs_dict()['output_parameters'].get_dict()['yambo_wrote'] == False: 
                         cancopy = False 
-                if cancopy:
+                if cancopy and reuse and not initialise and \
+                        parent_calc.get_state() == calc_states.FINISHED and \
+                        screening_compatible(parent_calc.inp.parameters.get_dict(), parameters.get_dict()):
+                    # the screening databases are read in place from the job folder that holds them,
+                    # the one of the parent or of the calculation whose screening it reused: the
+                    # remote folder of that calculation must not be cleaned (see screening)
+                    screening_folder = parent_calc.get_extra(_screening_extra,
+                                          os.path.join(parent_calc_folder.get_remote_path(),"aiida"))
+                    remote_symlink_list.append(
+                                       (
+                                         parent_calc_folder.get_computer().uuid,
+                                         screening_folder,
+                                         self._SCREENING_LINK
+                                         )
+                                        )
+                    job_string = ",".join([self._OUTPUT_FILE_NAME, self._SCREENING_LINK])
+                    if self.is_stored:
+                        self.set_extra(_screening_extra, screening_folder)
+                elif cancopy:
                     remote_copy_list.append(
                                        (
                                          parent_calc_folder.get_computer().uuid,
@@ -391,7 +368,7 @@ class YamboCalculation(JobCalculation):
         
         calcinfo.local_copy_list = []
         calcinfo.remote_copy_list = remote_copy_list
-        calcinfo.remote_symlink_list = []# remote_symlink_list
+        calcinfo.remote_symlink_list = remote_symlink_list
         #calcinfo.stdout_name = None # self._OUTPUT_FILE_NAME
         
         # Retrieve by default the output file and the xml file
@@ -400,11 +377,66 @@ class YamboCalculation(JobCalculation):
         calcinfo.retrieve_list.append('r*')
         calcinfo.retrieve_list.append('l*')
         calcinfo.retrieve_list.append('o*')        
-        calcinfo.retrieve_list.append('LOG/l-*_CPU_1')        
+        # the logs of all the MPI ranks only on request, they are one file per CPU
+        rank_logs = settings_dict.pop('RANK_LOGS', False)
+        if not isinstance(rank_logs, bool):
+            raise InputValidationError("RANK_LOGS must be a boolean")
+        if rank_logs:
+            calcinfo.retrieve_list.append('LOG/l-*_CPU_*')
+        else:
+            calcinfo.retrieve_list.append('LOG/l-*_CPU_1')        
         extra_retrieved = settings_dict.pop('ADDITIONAL_RETRIEVE_LIST', ['aiida/ndb.QP','aiida/ndb.HF_and_locXC'])
         for extra in extra_retrieved:
             calcinfo.retrieve_list.append( extra )
-        
+
+        # settings read by the parser only: number of workers parsing the retrieved files
+        parser_processes = settings_dict.pop('PARSER_PROCESSES', None)
+        if parser_processes is not None and (not isinstance(parser_processes, int) or parser_processes < 1):
+            raise InputValidationError("PARSER_PROCESSES must be a positive integer")
+        # and whether parsed files are cached on disk by content (see aiida_yambo.parsers.cache)
+        parser_cache = settings_dict.pop('PARSER_CACHE', False)
+        if not isinstance(parser_cache, bool):
+            raise InputValidationError("PARSER_CACHE must be a boolean")
+        # and whether the large files are parsed in worker processes, with a timeout (s)
+        # and a limit of the resident memory (MB) per file (see aiida_yambo.parsers.worker)
+        parser_isolate = settings_dict.pop('PARSER_ISOLATE', False)
+        if not isinstance(parser_isolate, bool):
+            raise InputValidationError("PARSER_ISOLATE must be a boolean")
+        for key in ('PARSER_TIMEOUT', 'PARSER_MEMORY_LIMIT'):
+            value = settings_dict.pop(key, None)
+            if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+                raise InputValidationError("{} must be a positive number".format(key))
+        # and how the QP results are stored: one compressed node, single precision
+        qp_storage = settings_dict.pop('QP_STORAGE', 'full')
+        if qp_storage not in ('full', 'compact'):
+            raise InputValidationError("QP_STORAGE must be 'full' or 'compact'")
+        qp_precision = settings_dict.pop('QP_PRECISION', 'double')
+        if qp_precision not in ('double', 'single'):
+            raise InputValidationError("QP_PRECISION must be 'double' or 'single'")
+        # and the window of QP states read from the ndb.* databases: True for the
+        # QPkrange/QPerange of the parameters, or a list of [k1, k2, b1, b2] ranges
+        qp_window = settings_dict.pop('QP_WINDOW', None)
+        if qp_window is not None and not isinstance(qp_window, bool):
+            if not isinstance(qp_window, (list, tuple)) or not all(
+                    isinstance(r, (list, tuple)) and len(r) == 4 and all(isinstance(i, int) for i in r)
+                    for r in qp_window):
+                raise InputValidationError("QP_WINDOW must be a boolean or a list of [k1, k2, b1, b2] ranges")
+        # and the size budgets (bytes, None for no sampling) of the logs that are sampled
+        # when larger, {'log': , 'p2y_log': } (see YamboFile.read_lines)
+        size_budgets = settings_dict.pop('PARSER_SIZE_BUDGETS', None)
+        if size_budgets is not None:
+            if not isinstance(size_budgets, dict) or not all(
+                    kind in ('log', 'p2y_log') and (budget is None or (isinstance(budget, (int, long))
+                                                    and not isinstance(budget, bool) and budget > 0))
+                    for kind, budget in size_budgets.items()):
+                raise InputValidationError("PARSER_SIZE_BUDGETS must be a dictionary of positive sizes (bytes) "
+                                           "of the 'log' and 'p2y_log' files")
+        # and the number of warnings stored per log, the others are only counted
+        max_warnings = settings_dict.pop('PARSER_MAX_WARNINGS', None)
+        if max_warnings is not None and (not isinstance(max_warnings, (int, long)) or
+                                         isinstance(max_warnings, bool) or max_warnings < 0):
+            raise InputValidationError("PARSER_MAX_WARNINGS must be a non negative integer")
+
 #        # Empty command line by default
 #        cmdline_params = settings_dict.pop('CMDLINE', [])
 #        calcinfo.cmdline_params = (list(cmdline_params)
@@ -435,7 +467,7 @@ class YamboCalculation(JobCalculation):
         # c3 = yambo calculation
         c3 = CodeInfo()
         c3.withmpi = self.get_withmpi()
-        c3.cmdline_params = ["-F", self._INPUT_FILE_NAME, '-J', self._OUTPUT_FILE_NAME]
+        c3.cmdline_params = ["-F", self._INPUT_FILE_NAME, '-J', job_string]
         c3.code_uuid = main_code.uuid
         
         if initialise:
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of SAVE databases shared by the yambo calculations of a computer.
+
+With the SAVE_POOL setting the SAVE written by a p2y initialisation (INITIALISE) is
+identified by pool_key: the remote folder of the NSCF calculation (and so its computer),
+the p2y code, its parameters and command line, taken from the input nodes of the
+calculation by inputs_pool_key. Later calculations with the same key
+start from the existing initialisation instead of running p2y again (see find_pool,
+used by YamboRestartWf) and link its databases (SAVE_STAGING link), so all of them
+share one SAVE on the computer.
+
+A pool is referenced by the yambo calculations that descend from it, running or not:
+their SAVE links (or copies of the links) point to the pool, and a finished or failed
+calculation can still be the parent of a restart or of a later calculation, so it
+references the pool as long as its remote folder exists (see pool_references); a pool is
+released once the remote folders of its descendants are cleaned (e.g. with verdi
+calculation cleanworkdir). The SAVE of unreferenced pools is removed with
+
+    python -m aiida_yambo.calculations.savepool [--computer NAME] [--delete]
+
+(without --delete the pools that would be removed are only listed).
+"""
+import argparse
+import hashlib
+import json
+import os
+from aiida.common.datastructures import calc_states
+from aiida_quantumespresso.calculations import _uppercase_dict
+
+_pool_extra = 'yambo_save_pool' # extra of the p2y calculation: its pool key
+_cleaned_extra = 'yambo_save_pool_cleaned' # extra set once the SAVE of a pool is removed
+_final_states = [calc_states.FINISHED, calc_states.FAILED, calc_states.SUBMISSIONFAILED,
+                 calc_states.RETRIEVALFAILED, calc_states.PARSINGFAILED]
+
+def pool_key(parent_folder, precode, precode_parameters=None, cmdline=None):
+    """
+    Key of the SAVE produced by p2y from the NSCF remote folder parent_folder
+    with the code precode, its parameters (dict) and command line (list)
+    """
+    identity = [parent_folder.uuid, parent_folder.get_computer().uuid, precode.uuid,
+                precode_parameters or {}, cmdline or []]
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+def inputs_pool_key(parent_folder, preprocessing_code, precode_parameters=None, settings=None):
+    """
+    pool_key of the p2y initialisation of a YamboCalculation with these inputs: the
+    parent_folder, the preprocessing_code and the precode_parameters and settings
+    (ParameterData, or None), of which only CMDLINE enters the key
+    """
+    settings = _uppercase_dict(settings.get_dict(), dict_name='settings') if settings is not None else {}
+    return pool_key(parent_folder, preprocessing_code,
+                    precode_parameters.get_dict() if precode_parameters is not None else {},
+                    settings.get('CMDLINE'))
+
+def pool_calculations(key=None):
+    """
+    p2y calculations registered in a pool (with the given key, or all), newest first
+    """
+    from aiida.orm.querybuilder import QueryBuilder
+    from aiida_yambo.calculations.gw import YamboCalculation
+    qb = QueryBuilder()
+    if key is None:
+        filters = {'extras.' + _pool_extra: {'like': '%'}}
+    else:
+        filters = {'extras.' + _pool_extra: key}
+    qb.append(YamboCalculation, filters=filters)
+    qb.order_by({YamboCalculation: {'ctime': 'desc'}})
+    return [row[0] for row in qb.all()]
+
+def find_pool(key):
+    """
+    Remote folder of the newest finished, not cleaned, p2y calculation of the pool key,
+    None if there is none
+    """
+    for calc in pool_calculations(key):
+        if calc.get_state() == calc_states.FINISHED and not calc.get_extra(_cleaned_extra, False):
+            return calc.out.remote_folder
+    return None
+
+def _remote_exists(calc, transport):
+    """
+    True if the remote folder of calc exists, checked with the open transport (assumed
+    without it), False for calculations that were never submitted
+    """
+    try:
+        remote_path = calc.out.remote_folder.get_remote_path()
+    except AttributeError: # not yet submitted
+        return False
+    if transport is None:
+        return True
+    return transport.isdir(remote_path)
+
+def pool_references(calc, transport=None):
+    """
+    Yambo calculations that can use the SAVE of the p2y calculation calc: its children and,
+    recursively, the children of those (which copy or link their SAVE), when they are not
+    in a final state or their remote folder still exists (checked with the open transport
+    to their computer, assumed without it)
+    """
+    from aiida_yambo.calculations.gw import YamboCalculation
+    references = []
+    todo = [calc]
+    while todo:
+        parent = todo.pop()
+        try:
+            remote_folder = parent.out.remote_folder
+        except AttributeError: # not yet submitted
+            continue
+        for child in remote_folder.get_outputs(type=YamboCalculation):
+            todo.append(child)
+            if child.get_state() not in _final_states or _remote_exists(child, transport):
+                references.append(child)
+    return references
+
+def clean_pools(computer=None, delete=False):
+    """
+    p2y calculations of the pools without references (on the given computer, or all),
+    with delete their SAVE is removed from the computer and they are marked as cleaned
+    """
+    unreferenced = []
+    for calc in pool_calculations():
+        if calc.get_extra(_cleaned_extra, False):
+            continue
+        if computer is not None and calc.get_computer().uuid != computer.uuid:
+            continue
+        transport = calc._get_transport()
+        with transport:
+            if pool_references(calc, transport):
+                continue
+            unreferenced.append(calc)
+            if delete:
+                transport.rmtree(os.path.join(calc.out.remote_folder.get_remote_path(), 'SAVE'))
+        if delete:
+            calc.set_extra(_cleaned_extra, True)
+    return unreferenced
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove the SAVE of the unreferenced yambo SAVE pools')
+    parser.add_argument('--computer', default=None, help='only the pools on this computer')
+    parser.add_argument('--delete', action='store_true', help='remove them, otherwise only list them')
+    args = parser.parse_args()
+
+    from aiida.backends.utils import load_dbenv, is_dbenv_loaded
+    if not is_dbenv_loaded():
+        load_dbenv()
+    from aiida.orm import Computer
+    computer = Computer.get(args.computer) if args.computer else None
+    for calc in clean_pools(computer, delete=args.delete):
+        print("{} pool of calculation {} on {}: {}".format('removed' if args.delete else 'unreferenced',
+              calc.pk, calc.get_computer().name, calc.out.remote_folder.get_remote_path()))
+
+if __name__ == "__main__":
+    main()
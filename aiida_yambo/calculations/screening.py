@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Reuse of the screening databases (ndb.em1d, ndb.pp) of a yambo parent.
+
+A YamboCalculation whose parent is a FINISHED yambo calculation with a compatible
+screening (see screening_compatible) does not copy the aiida/ job folder of the parent:
+the job folder that holds the screening is symlinked as screening/ and yambo runs with
+-J aiida,screening, reading the databases in place and writing its own to aiida/.
+The linked folder is recorded in the yambo_screening_folder extra, so a chain of reuses
+links the folder of the calculation that actually computed the screening, which can be
+an ancestor several calculations back. The remote folders of these calculations are read
+by every descendant still to run and must not be cleaned (or their aiida/ removed) until
+those have finished.
+
+The reuse is on by default, in YamboCalculation and in YamboConvergenceWorkflow, and is
+turned off by a false REUSE_SCREENING setting (see reuse_screening).
+"""
+
+# parameters that define the screening databases (ndb.em1d, ndb.pp): cutoff and bands of the
+# response function, PPA pole, FFT, q-points; the k-mesh is the one of the shared SAVE
+_screening_keys = ['NGsBlkXp', 'BndsRnXp', 'PPAPntXp', 'FFTGvecs', 'QpntsRXp', 'LongDrXp',
+                   'Chimod', 'EhEngyXp', 'XTermKind', 'XTermEn']
+_screening_runlevels = ['ppa', 'em1d']
+_screening_extra = 'yambo_screening_folder'
+_reuse_default = True # REUSE_SCREENING when it is not in the settings
+
+def reuse_screening(settings):
+    """
+    True if the settings (dict, keys in any case) reuse compatible screening databases:
+    REUSE_SCREENING, any true value, on by default
+    """
+    for key, value in settings.items():
+        if key.upper() == 'REUSE_SCREENING':
+            return bool(value)
+    return _reuse_default
+
+def screening_compatible(parent_parameters, parameters):
+    """
+    True if the screening computed with the parent_parameters (dict of the input parameters
+    of a yambo calculation) can be reused with parameters: both run the same screening
+    and all the screening parameters (see _screening_keys) and their units are equal
+    """
+    def normalized(value):
+        if isinstance(value, (list, tuple)):
+            return [normalized(v) for v in value]
+        return value
+    if not any(parent_parameters.get(key) is True for key in _screening_runlevels):
+        return False
+    if any(parameters.get(key) is not parent_parameters.get(key) for key in _screening_runlevels):
+        return False
+    for key in _screening_keys:
+        for name in (key, key + '_units'):
+            if normalized(parent_parameters.get(name)) != normalized(parameters.get(name)):
+                return False
+    return True
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Writer of the yambo input file from the dictionary of the input parameters.
+"""
+try:
+    _string_types = basestring
+except NameError: # python 3
+    _string_types = str
+
+# roles written before the CPU string (given as a list) of a parallelization key, unless
+# the parameters have their own <prefix>_ROLEs
+_default_roles = {'SE_CPU': 'q qp b', 'X_all_q_CPU': 'q k c v', 'X_finite_q_CPU': 'q k c v',
+                  'X_q_0_CPU': 'k c v'}
+
+def _value(value):
+    if isinstance(value, _string_types):
+        return '"{}"'.format(value)
+    return '{}'.format(value)
+
+def _with_units(line, units):
+    if units is None:
+        return line
+    return '{} {}'.format(line, units)
+
+def _format_scalar(key, value, units, parameters):
+    """ key = value [units], strings quoted """
+    return _with_units('{} = {}'.format(key, _value(value)), units)
+
+def _format_range(key, value, units, parameters):
+    """ % key
+         v1 | v2 | ... | [units]
+        % """
+    return _with_units('% {}\n {} |'.format(key, ' | '.join('{}'.format(v) for v in value)), units) + '\n%'
+
+def _format_qp_ranges(key, value, units, parameters):
+    """ % key
+         k1 | k2 | b1 | b2 |
+         ...
+        %  one row per range """
+    rows = ''.join(' {} |\n'.format(' | '.join('{}'.format(v) for v in row)) for row in value)
+    return '% {}\n{}%'.format(key, rows)
+
+def _format_tuple(key, value, units, parameters):
+    """ key = ( v1,v2 ) [units] """
+    return _with_units('{} = ( {} )'.format(key, ','.join('{}'.format(v) for v in value)), units)
+
+def _roles_key(key):
+    return key[:-len('CPU')] + 'ROLEs'
+
+def _format_cpu(key, value, units, parameters):
+    """ <prefix>_ROLEs = "roles"
+        <prefix>_CPU = "cpus"  ROLE/CPU pair of a parallelization key """
+    roles = parameters.get(_roles_key(key))
+    if isinstance(value, (list, tuple)):
+        value = ' '.join('{}'.format(v) for v in value)
+        if roles is None:
+            roles = _default_roles.get(key)
+    line = '{} = "{}"'.format(key, value)
+    if roles is None:
+        return line
+    return '{} = "{}"\n{}'.format(_roles_key(key), roles, line)
+
+# formats of the keys that are not written according to the type of their value
+_key_formats = {'QPkrange': _format_qp_ranges, 'QPerange': _format_qp_ranges}
+_prefix_formats = [('DrudeW', _format_tuple)]
+# every <prefix>_CPU parallelization key is written with its <prefix>_ROLEs
+_suffix_formats = [('_CPU', _format_cpu)]
+
+def key_format(key, value):
+    """ Function writing the line(s) of key: from the registry of the key, of its prefix
+        or of its suffix, else a range for lists and tuples and a scalar otherwise
+    """
+    if key in _key_formats:
+        return _key_formats[key]
+    for prefix, function in _prefix_formats:
+        if key.startswith(prefix):
+            return function
+    for suffix, function in _suffix_formats:
+        if key.endswith(suffix):
+            return function
+    if isinstance(value, (list, tuple)):
+        return _format_range
+    return _format_scalar
+
+def yambo_input(parameters, header=''):
+    """
+    Text of a yambo input file, built in a single buffer and in canonical order: the header,
+    the runlevels (boolean parameters that are True) and then the variables, each sorted by
+    name, so that equal parameters always give the same file.
+    The units of a variable are given by the <key>_units parameter.
+    """
+    keys = sorted(parameters)
+    lines = [key for key in keys if parameters[key] is True]
+    for key in keys:
+        value = parameters[key]
+        if isinstance(value, bool) or key.endswith('_units'):
+            continue
+        if key.endswith('_ROLEs') and key_format(key[:-len('ROLEs')] + 'CPU', None) is _format_cpu \
+                and key[:-len('ROLEs')] + 'CPU' in parameters:
+            continue # written with its CPU key
+        lines.append(key_format(key, value)(key, value, parameters.get(key + '_units'), parameters))
+    lines.append('')
+    return header + '\n'.join(lines)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+ArrayData with deflate compressed arrays.
+"""
+import re
+import tempfile
+import numpy
+from aiida.orm.data.array import ArrayData
+
+class CompressedArrayData(ArrayData):
+    """
+    ArrayData that stores each array in the repository as a compressed  <name>.npz  file
+    (numpy.savez_compressed) instead of a plain  <name>.npy, with the same interface
+    (set_array, get_array, get_arraynames, ...). Used for the QP results of large
+    calculations, whose tables compress well (see the QP_STORAGE setting of the parser).
+    """
+    _suffix = '.npz'
+
+    def _arraynames_from_files(self):
+        return [i[:-len(self._suffix)] for i in self.get_folder_list() if i.endswith(self._suffix)]
+
+    def set_array(self, name, array):
+        """ Store a numpy array under name, compressed
+        """
+        if not isinstance(array, numpy.ndarray):
+            raise TypeError("ArrayData can only store numpy arrays. Convert "
+                            "the object to an array first")
+        if not name or re.sub('[0-9a-zA-Z_]', '', name):
+            raise ValueError("The name assigned to the array ({}) is not valid, "
+                             "it can only contain digits, letters or underscores".format(name))
+        with tempfile.NamedTemporaryFile() as f:
+            numpy.savez_compressed(f, array=array)
+            f.flush()
+            self.add_path(f.name, name + self._suffix)
+        self._set_attr("{}{}".format(self.array_prefix, name), list(array.shape))
+
+    def get_array(self, name):
+        """ Array stored under name
+        """
+        if name not in self.get_arraynames():
+            raise KeyError("Array with name '{}' not found in node pk={}".format(name, self.pk))
+        with numpy.load(self.get_abs_path(name + self._suffix)) as npz:
+            return npz['array']
+
+    def delete_array(self, name):
+        """ Remove the array stored under name
+        """
+        fname = name + self._suffix
+        if fname not in self.get_folder_list():
+            raise KeyError("Array with name '{}' not found in node pk={}".format(name, self.pk))
+        self.remove_path(fname)
+        try:
+            self._del_attr("{}{}".format(self.array_prefix, name))
+        except AttributeError:
+            pass
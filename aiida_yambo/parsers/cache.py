@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache of parsed yambo files.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import numpy
+
+class ParseCache(object):
+    """
+    Cache of parsed YamboFile instances, stored under the AiiDA configuration folder.
+
+    An entry is addressed by the SHA-256 of the file name, the file content and the
+    version of the parser (YamboFile._cache_version), so a file is parsed again only if
+    its content or the parsing code changed. Each entry is an npz file with the arrays
+    and a JSON sidecar with everything else. When the cache grows over max_bytes the
+    least recently used entries are removed.
+    """
+    _folder_name = 'yambo_parse_cache'
+    _chunk_size = 1024*1024
+
+    def __init__(self, folder=None, max_bytes=512*1024*1024):
+        if folder is None:
+            folder = os.path.join(self._aiida_config_folder(), self._folder_name)
+        self.folder = folder
+        self.max_bytes = max_bytes
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+    @staticmethod
+    def _aiida_config_folder():
+        try:
+            from aiida.common.setup import AIIDA_CONFIG_FOLDER
+        except ImportError:
+            AIIDA_CONFIG_FOLDER = '~/.aiida'
+        return os.path.expanduser(AIIDA_CONFIG_FOLDER)
+
+    def key(self, filename, folder, version):
+        """ Digest of a file: name, content and parser version
+        """
+        digest = hashlib.sha256()
+        digest.update(('%s\0%s\0'%(version, filename)).encode('utf-8'))
+        with open(os.path.join(folder, filename), 'rb') as fl:
+            for chunk in iter(lambda: fl.read(self._chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.folder, key)
+        return base + '.json', base + '.npz'
+
+    def get(self, key):
+        """ Parsed state stored under key (see YamboFile.get_state), None if not cached
+        """
+        json_path, npz_path = self._paths(key)
+        try:
+            with open(json_path) as fl:
+                encoded = json.load(fl)
+            arrays = {}
+            if os.path.exists(npz_path):
+                with numpy.load(npz_path) as npz:
+                    arrays = dict((name, npz[name]) for name in npz.files)
+            os.utime(json_path, None) # mark as recently used
+        except (IOError, OSError, ValueError):
+            return None
+        return _decode(encoded, arrays)
+
+    def put(self, key, state):
+        """ Store a parsed state under key and evict old entries if over the size cap
+        """
+        arrays = {}
+        encoded = _encode(state, arrays)
+        json_path, npz_path = self._paths(key)
+        if arrays:
+            with self._temporary('.tmp.npz') as (fl, tmp):
+                numpy.savez(fl, **arrays)
+            os.rename(tmp, npz_path)
+        # the sidecar is written last: an entry exists once its JSON file does
+        with self._temporary('.tmp') as (fl, tmp):
+            fl.write(json.dumps(encoded).encode('utf-8'))
+        os.rename(tmp, json_path)
+        self.evict()
+
+    @contextlib.contextmanager
+    def _temporary(self, suffix):
+        """ (file, path) of a new binary file with a unique name in the cache folder, so
+            that concurrent writers (processes or threads) never share it; removed if
+            writing it fails
+        """
+        handle, path = tempfile.mkstemp(suffix=suffix, dir=self.folder)
+        try:
+            with os.fdopen(handle, 'wb') as fl:
+                yield fl, path
+        except BaseException:
+            os.remove(path)
+            raise
+
+    def evict(self):
+        """ Remove the least recently used entries until the cache is below max_bytes
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith('.json'):
+                continue
+            json_path, npz_path = self._paths(name[:-5])
+            try:
+                size = os.path.getsize(json_path)
+                if os.path.exists(npz_path):
+                    size += os.path.getsize(npz_path)
+                entries.append((os.path.getmtime(json_path), size, json_path, npz_path))
+            except OSError: # removed by another process
+                continue
+            total += size
+        entries.sort()
+        while total > self.max_bytes and entries:
+            mtime, size, json_path, npz_path = entries.pop(0)
+            for path in (json_path, npz_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+def _encode(obj, arrays):
+    """ JSON compatible form of obj, with the arrays moved to the arrays dictionary
+    """
+    if isinstance(obj, numpy.ndarray):
+        name = 'a%d'%len(arrays)
+        arrays[name] = obj
+        return {'__array__': name}
+    if isinstance(obj, dict):
+        return {'__dict__': [[_encode(k, arrays), _encode(v, arrays)] for k, v in obj.items()]}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(item, arrays) for item in obj]
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+    return obj
+
+def _decode(obj, arrays):
+    """ Inverse of _encode
+    """
+    if isinstance(obj, dict):
+        if '__array__' in obj:
+            return arrays[obj['__array__']]
+        return dict((_decode(k, arrays), _decode(v, arrays)) for k, v in obj['__dict__'])
+    if isinstance(obj, list):
+        return [_decode(item, arrays) for item in obj]
+    return obj
@@ -4,5 +4,5 @@
 # This file is part of yambopy
 #
 #
-from yambofile import *
-from yambofolder import *
+from .yambofile import *
+from .yambofolder import *
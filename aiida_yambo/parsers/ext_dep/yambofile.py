@@ -6,6 +6,7 @@
 #
 import os
 import re
+from array import array
 import numpy as np
 
 #we try to use netcdf
@@ -16,7 +17,430 @@ except ImportError:
 else:
     _has_netcdf = True
 
-class YamboFile():
+#classic netcdf files can be memory mapped with scipy
+try:
+    from scipy.io import netcdf_file
+except ImportError:
+    _has_scipy_netcdf = False
+else:
+    _has_scipy_netcdf = True
+
+def _open_netcdf(filename):
+    """ Open a netcdf file for reading.
+        Classic (netCDF3) files are memory mapped with scipy when available: the
+        variables are then views of the file, read on demand from the page cache.
+        Other files are opened with netCDF4, returning plain (not masked) arrays.
+    """
+    if _has_scipy_netcdf:
+        try:
+            return netcdf_file(filename, 'r', mmap=True)
+        except TypeError: # not a netCDF3 file
+            pass
+    f = Dataset(filename)
+    if hasattr(f, 'set_auto_mask'):
+        f.set_auto_mask(False)
+    return f
+
+def _close_netcdf(f):
+    """ Close a file opened with _open_netcdf.
+        The memory map of a scipy file stays alive as long as arrays refer to it.
+    """
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        f.close()
+
+def _as_complex(pairs):
+    """ Complex array from an array whose last axis holds (real, imaginary).
+        It is a view of the same memory when the layout allows it, otherwise
+        the result is filled in place without temporaries.
+    """
+    pairs = np.asarray(pairs)
+    if pairs.flags.c_contiguous and pairs.dtype.kind == 'f' and pairs.dtype.itemsize in (4, 8):
+        byteorder = pairs.dtype.byteorder if pairs.dtype.byteorder in '<>' else '='
+        return pairs.view(np.dtype('%sc%d'%(byteorder, 2*pairs.dtype.itemsize)))[...,0]
+    return _complex_from(pairs[...,0], pairs[...,1])
+
+def _complex_from(real, imag):
+    """ Complex array with the given real and imaginary parts, one allocation
+    """
+    values = np.empty(np.shape(real), dtype=np.complex128)
+    values.real = real
+    values.imag = imag
+    return values
+
+# report files (r-*)
+_report_error = re.compile('^\s+?\[ERROR\]\s+?(.*)$')
+_report_kpoint = re.compile('^  [A-X*]+\sK\s\[([0-9]+)\]\s[:](?:\s+)?([0-9.E-]+\s+[0-9.E-]+\s+[0-9.E-]+)\s[A-Za-z()\s*.]+[0-9]+[A-Za-z()\s*.]+([0-9.]+)')
+_report_timing = re.compile('\s+?[A-Za-z]+iming\s+?[A-Za-z/\[\]]+[:]\s+?([a-z0-9-]+)[/]([a-z0-9-]+)[/]([a-z0-9-]+)')
+_report_game_over = re.compile('^\s+?\[\d+\]\s+?G\w+\s+?O\w+\s+?\&\s+?G\w+\s+?\w+') # Game over & Game summary
+_report_p2y_complete = re.compile('^(\s+)?[-<>\d\w]+\s+?P\d+[:]\s+?==\s+?P2Y\s+?\w+\s+?==(\s+)?') # P2Y Complete
+_report_p2y_complete_v2 = re.compile('(\s+)?[-<>\w\d]+(\s+)?==(\s+)?P2Y(\s+)?\w+(\s+)?==') # P2Y Complete
+_report_yambo_wrote = re.compile('(?:\s+)?[[]WR[./\w]+[]](?:[-])+')
+_report_qp_header = re.compile('^\s+?QP\s\[eV\]\s@\sK\s\[(\d+)\][a-z0-9E:()\s.-]+$')
+_report_qp_data = re.compile('B[=](\d+)\sEo[=](?:\s+)?([E0-9.-]+)\sE[=](?:\s+)?([E0-9.-]+)\sE[-]Eo[=](?:\s+)?([E0-9.-]+)\sRe[(]Z[)][=](?:\s+)?([E0-9.-]+)\sIm[(]Z[)][=](?:\s+)?[E0-9.-]+\snlXC[=](?:\s+)?([E0-9.-]+)\slXC[=](?:\s+)?([E0-9.-]+)\sSo[=](?:\s+)?([E0-9.-]+)')
+_report_section = re.compile('^\s+?\[(\d+(?:\.\d+)*)\]\s+(.+?)\s*$') # [05] Dynamic Dielectric Matrix (PPA)
+_report_clock_entry = re.compile('^\s+(\S[^:]*?)\s*:\s+([0-9.]+s\s.*)$') # io_fragment :  0.0030s CPU (  78 calls, ...)
+_report_clock_time = re.compile('([0-9.]+)s\s')
+_report_clock_calls = re.compile('[(]\s*(\d+)\s+calls?')
+_report_qp_keys = ['bindex','dft_energy','qp_energy','qp_correction','z_factor','non_local_xc','local_xc','selfenergy_c']
+
+class YamboReportScanner():
+    """
+    Single pass, line by line state machine for r-* report files.
+    Each line is dispatched on a cheap keyword test before any regex is tried,
+    and the QP [eV] @ K [..] blocks are accumulated as they are read, so the
+    report is never held in memory as a whole.
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.kpoints = {}
+        self.timing = []
+        self.profile = [] # (kind, name, calls, min, mean, max time in seconds), kind 'section' or 'routine'
+        self.game_over = False
+        self.p2y_complete = False
+        self.yambo_wrote = None
+        self.data = {}
+        self.stopped = False # a STOP error was found, the rest of the report is ignored
+        self._section = None # title of the current [NN] section
+        self._clock = False # inside the Clock: tables of the timing overview
+        self._clock_rows = {} # routine -> row of the profile, a later clock table replaces the row
+        self._qp = None # results of the QP block being read, None outside of a block
+        self._qp_started = False # the first B=.. line of the current block was read
+
+    def feed(self, line):
+        """ Process a single line of the report
+        """
+        if self.stopped:
+            return
+        if self._qp is not None:
+            if self._feed_qp(line):
+                return
+        if '[ERROR]' in line:
+            match = _report_error.match(line)
+            if match and 'STOP' in match.groups()[0]:
+                # stop parsing, this is a failed calc.
+                self.errors.append(match.groups()[0])
+                self.data = {}
+                self._qp = None
+                self.stopped = True
+                return
+        if 'iming' in line:
+            match = _report_timing.match(line)
+            if match:
+                self.timing.append(match.groups()[0])
+                self._feed_timing(match.groups())
+        if '[' in line:
+            match = _report_section.match(line)
+            if match:
+                self._section = match.groups()[1]
+                self._clock = False
+        if self._clock and ':' in line:
+            self._feed_clock(line)
+        elif 'Clock:' in line:
+            self._clock = True
+        if ' K [' in line:
+            match = _report_kpoint.match(line)
+            if match:
+                kindx, kpt, wgt = match.groups()
+                self.kpoints[str(int(kindx))] = [ float(i.strip()) for i in kpt.split()]
+                return
+        if 'QP [eV]' in line:
+            match = _report_qp_header.match(line)
+            if match:
+                self._qp = dict((key,[]) for key in _report_qp_keys)
+                self._qp_started = False
+                self.data[str(int(match.groups()[0]))] = self._qp
+                return
+        if '&' in line and _report_game_over.match(line):
+            self.game_over = True
+        if 'P2Y' in line and (_report_p2y_complete.match(line) or _report_p2y_complete_v2.match(line)):
+            self.p2y_complete = True
+            self.game_over = True
+        if '[WR' in line and _report_yambo_wrote.match(line):
+            self.yambo_wrote = True
+
+    def _feed_timing(self, times):
+        """ Timing [Min/Max/Average] line closing a section of the report
+        """
+        try:
+            tmin, tmax, tmean = [get_seconds(time) for time in times]
+        except ValueError:
+            return
+        self.profile.append(('section', self._section or 'unknown', 1, tmin, tmean, tmax))
+
+    def _feed_clock(self, line):
+        """ Line of a Clock: table of the timing overview, with the total time of a routine
+            (one value, or MIN - MAX - AVERAGE over the MPI tasks) and the number of calls
+        """
+        match = _report_clock_entry.match(line)
+        if not match:
+            return
+        name, rest = match.groups()
+        times = [float(time) for time in _report_clock_time.findall(rest)]
+        if len(times) >= 3:
+            tmin, tmax, tmean = times[:3]
+        else:
+            tmin = tmax = tmean = times[0]
+        calls = _report_clock_calls.search(rest)
+        row = ('routine', name, int(calls.groups()[0]) if calls else 1, tmin, tmean, tmax)
+        if name in self._clock_rows:
+            self.profile[self._clock_rows[name]] = row
+        else:
+            self._clock_rows[name] = len(self.profile)
+            self.profile.append(row)
+
+    def _feed_qp(self, line):
+        """ Process a line inside a QP block, returns True if the line was consumed.
+            The block starts after the header, and ends at the first empty line
+            following the B=.. lines.
+        """
+        if not line.strip():
+            if self._qp_started and not line.strip('\r\n'):
+                self._qp = None
+            return True
+        if 'B=' not in line:
+            self._qp = None
+            return False
+        self._qp_started = True
+        for match in _report_qp_data.finditer(line):
+            for key, value in zip(_report_qp_keys, match.groups()):
+                self._qp[key].append(float(value))
+        return True
+
+# log files (l-*)
+_log_time = re.compile('^\s+?<([0-9a-z-]+)>')
+_log_warning = re.compile('^\s+?<([0-9a-z-]+)> ([A-Z0-9]+)[:] \[(WARNING)\]? ([a-zA-Z0-9\s.()\[\]]+)?')
+_log_error = re.compile('^\s+?<([0-9a-z-]+)> ([A-Z0-9]+)[:] \[(ERROR)\]? ([a-zA-Z0-9\s.()\[\]]+)?')
+_log_memory = re.compile('^\s+?<([0-9a-z-]+)> ([A-Z0-9]+)[:] \[M  ([0-9.]+) Gb\]? ([a-zA-Z0-9\s.()\[\]]+)?')
+_log_generic_error = re.compile('^(?=\s+)?([A-Z0-9]+)[:] \[(ERROR)\](?=\s+)?([a-zA-Z0-9\s.()\[\]]+)?')
+_log_paralle = re.compile('^(?=\s+)?([A-Z0-9]+)[:] \[ERROR\](?=\s+)?Impossible(?=\s+)?(?=[a-zA-Z0-9\s.()\[\]]+)?')
+_log_unphysical = re.compile('^(?=\s+)?([A-Z0-9]+)[:] \[ERROR\](?=\s+)?\[NetCDF\]\s*NetCDF[:]\s*NC_UNLIMITED\s*in\s*the\s*wrong\s*index')
+_time_units = {'d':86400, 'h':3600, 'm':60, 's':1}
+
+def get_seconds(time_string):
+    """ Convert a yambo time stamp (e.g. 01h-02m-03s) in seconds
+    """
+    seconds = 0
+    for field in time_string.split('-'):
+        if not field:
+            continue
+        try:
+            seconds += int(field[:-1]) * _time_units[field[-1]]
+        except (KeyError, ValueError):
+            raise ValueError("unknown time format: {}".format(time_string))
+    return seconds
+
+class YamboLogScanner():
+    """
+    Single pass, line by line classifier for l-* log files.
+    Each line is classified once; memory and time are kept as running
+    max/last aggregates, so the memory used does not grow with the log size
+    (apart from the warning and error lines, which are kept).
+    Lines can be fed incrementally, e.g. while the log is still being written.
+    The memory timeline is kept in compact int32/float32 buffers (memory_time, memory).
+    """
+
+    def __init__(self, max_warnings=None):
+        self.errors = []
+        self.warnings = []
+        self.warnings_count = 0 # all the warnings, also the ones not stored
+        self.max_warnings = max_warnings # warnings stored, None for all
+        self.max_memory = None # max memory allocated or freed (Gb)
+        self.last_memory = None # last memory allocated or freed (Gb)
+        self.last_memory_time = None # time of the last memory allocated or freed (seconds)
+        self.last_time = None # last reported time (seconds)
+        self.para_error = False
+        self.unphysical_input = False
+        self.partial = False # the trailing state was not found in the part of the log read, see scan_log_tail
+        self.memory_time = array('i') # time of each memory allocation or release (seconds)
+        self.memory = array('f') # memory allocated after it (Gb)
+
+    def memory_timeline(self):
+        """ (seconds int32, Gb float32) NumPy arrays of the memory timeline, copies of the
+            buffers of the scanner
+        """
+        return np.array(self.memory_time, dtype=np.int32), np.array(self.memory, dtype=np.float32)
+
+    def feed(self, line):
+        """ Process a single line of the log
+        """
+        if line[:1].isspace():
+            match = _log_time.match(line)
+            if not match:
+                return
+            seconds = get_seconds(match.groups()[0])
+            self.last_time = seconds
+            if '[WARNING' in line:
+                if _log_warning.match(line):
+                    self.warnings_count += 1
+                    if self.max_warnings is None or len(self.warnings) < self.max_warnings:
+                        self.warnings.append(line)
+            elif '[ERROR' in line:
+                if _log_error.match(line):
+                    self.errors.append(line)
+            elif '[M  ' in line:
+                match = _log_memory.match(line)
+                if match:
+                    memory = float(match.groups()[2])
+                    if self.max_memory is None or memory > self.max_memory:
+                        self.max_memory = memory
+                    self.last_memory = memory
+                    self.last_memory_time = seconds
+                    self.memory_time.append(seconds)
+                    self.memory.append(memory)
+        elif '[ERROR]' in line and _log_generic_error.match(line):
+            if _log_paralle.match(line):
+                self.para_error = True
+                self.errors.append(line)
+            if _log_unphysical.match(line):
+                self.unphysical_input = True
+
+def _read_tail_lines(fl, size, tail_bytes, block_size):
+    """ Complete lines (bytes, without the newline) of the last (at most) tail_bytes
+        of an open binary file, read backwards in blocks from the end and yielded
+        from the last to the first.
+    """
+    position = size
+    limit = max(size - tail_bytes, 0)
+    remainder = b''
+    while position > limit:
+        step = min(block_size, position - limit)
+        position -= step
+        fl.seek(position)
+        lines = (fl.read(step) + remainder).split(b'\n')
+        # the first piece may be the end of a line that starts in the previous block
+        remainder = lines.pop(0)
+        for line in reversed(lines):
+            yield line
+    if position == 0:
+        yield remainder
+
+def scan_log_tail(filename, tail_bytes=4*1024*1024, head_bytes=1024*1024, block_size=64*1024):
+    """ Trailing state of a (possibly huge) l-* log without reading all of it.
+        The file is read backwards from its end in blocks of block_size bytes until the
+        last time stamp and the last memory line are found (at most tail_bytes),
+        giving last_time, last_memory and last_memory_time.
+        If the tail read holds no time stamp (or no memory line) and the log is longer than it,
+        last_time (or last_memory and last_memory_time) are left None and partial is set:
+        the head of the file would only give an older value.
+        Errors, warnings and the para_error/unphysical_input flags come from a forward
+        scan of the first head_bytes and of the tail that was read, so they are bounded too.
+        Returns a YamboLogScanner; its max_memory only covers the scanned parts.
+    """
+    scanner = YamboLogScanner()
+    with open(filename, 'rb') as fl:
+        fl.seek(0, os.SEEK_END)
+        size = fl.tell()
+        tail = []
+        tail_start = size
+        last_time = last_memory = None
+        for raw in _read_tail_lines(fl, size, tail_bytes, block_size):
+            tail_start = max(tail_start - len(raw) - 1, 0)
+            # only the last line of the file has no newline
+            line = raw.decode('utf-8', 'replace') + ('\n' if tail_start + len(raw) + 1 < size else '')
+            tail.append(line)
+            if last_time is None or last_memory is None:
+                probe = YamboLogScanner()
+                probe.feed(line)
+                if last_time is None and probe.last_time is not None:
+                    last_time = probe
+                if last_memory is None and probe.last_memory is not None:
+                    last_memory = probe
+            if last_time is not None and last_memory is not None:
+                break
+        tail.reverse()
+
+        fl.seek(0)
+        head = fl.read(min(head_bytes, tail_start)).split(b'\n')
+        if tail_start > head_bytes:
+            head.pop() # incomplete line
+        for line in head:
+            if line:
+                scanner.feed(line.decode('utf-8', 'replace') + '\n')
+    for line in tail:
+        scanner.feed(line)
+    # the whole log was read if the tail reached its beginning
+    scanner.partial = tail_start > 0 and (last_time is None or last_memory is None)
+    scanner.last_time = last_time.last_time if last_time is not None else None
+    if last_memory is not None:
+        scanner.last_memory = last_memory.last_memory
+        scanner.last_memory_time = last_memory.last_memory_time
+    else:
+        scanner.last_memory = scanner.last_memory_time = None
+    return scanner
+
+def _sampled_lines(filename, head_bytes, tail_bytes, block_size=1024*1024):
+    """ Complete lines of the first head_bytes and of the last tail_bytes of a file,
+        read in blocks so that at most block_size bytes are held at a time.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as fl:
+        remainder = b''
+        read = 0
+        while read < head_bytes:
+            block = fl.read(min(block_size, head_bytes - read))
+            if not block:
+                break
+            read += len(block)
+            lines = (remainder + block).split(b'\n')
+            remainder = lines.pop() # incomplete line, dropped at the end of the head
+            for line in lines:
+                yield line.decode('utf-8', 'replace') + '\n'
+        fl.seek(max(size - tail_bytes, read))
+        if fl.tell() > 0:
+            fl.readline() # incomplete line
+        for line in fl:
+            yield line.decode('utf-8', 'replace')
+
+# o-*.qp output files: (tag in the header, column name, type)
+_qp_output_columns = [('K-point','kpoint',np.int32), ('Band','band',np.int32), ('Spin_Pol','spin',np.int32),
+                      ('Eo','Eo',np.float64), ('E-Eo','E_minus_Eo',np.float64), ('Sc|Eo','So',np.float64),
+                      ('Z','Z',np.float64)]
+
+def qp_output_dtype(tags):
+    """ Structured dtype of an o-*.qp table with the given column tags.
+        k-point, band and spin (0 if not spin polarized) are always present, the
+        observables only if present in the file; unknown tags are kept with their name.
+    """
+    names = dict((tag, name) for tag, name, typ in _qp_output_columns)
+    fields = [(name, typ) for tag, name, typ in _qp_output_columns if typ is np.int32]
+    fields += [(name, typ) for tag, name, typ in _qp_output_columns if typ is not np.int32 and tag in tags]
+    fields += [(tag, np.float64) for tag in tags if tag not in names]
+    return np.dtype(fields)
+
+def qp_output_records(tags, table):
+    """ Fill a structured array (see qp_output_dtype) from the numerical table of an o-*.qp file
+    """
+    names = dict((tag, name) for tag, name, typ in _qp_output_columns)
+    records = np.zeros(table.shape[0], dtype=qp_output_dtype(tags))
+    for itag, tag in enumerate(tags[:table.shape[1]]):
+        records[names.get(tag, tag)] = table[:,itag]
+    return records
+
+def qp_window_rows(kpoint, band, window):
+    """ Sorted indices of the rows whose (k-point, band) falls in one of the
+        (k1, k2, b1, b2) ranges of window (inclusive, as in QPkrange)
+    """
+    selected = np.zeros(len(kpoint), dtype=bool)
+    for k1, k2, b1, b2 in window:
+        selected |= (kpoint >= k1) & (kpoint <= k2) & (band >= b1) & (band <= b2)
+    return np.flatnonzero(selected)
+
+def _read_rows(variable, rows, axis=0):
+    """ Rows of a netcdf variable along axis, reading only the hyperslab between the
+        first and the last row (the whole variable if rows is None)
+    """
+    if rows is None:
+        return variable[:]
+    start = int(rows[0]) if len(rows) else 0
+    stop = int(rows[-1]) + 1 if len(rows) else 0
+    index = [slice(None)]*len(variable.shape)
+    index[axis] = slice(start, stop)
+    return np.take(np.asarray(variable[tuple(index)]), rows - start, axis=axis)
+
+class YamboFile(object):
     """
     This is the Yambo file class.
     It takes as input a filename produced by yambo.
@@ -28,6 +452,17 @@ class YamboFile():
     List of supported text files:
         -> r-*_em?1_*_gw0
         -> o-*.qp
+
+    With a qp_window, list of (k1, k2, b1, b2) ranges as in QPkrange, only the QP states
+    in the window are read from the netcdf databases (see parse_netcdf_gw).
+
+    With size_budgets, {type: bytes}, the files of those types larger than their budget are
+    sampled (see read_lines); the types not given keep the default_size_budgets and a budget
+    of None reads the whole file. The reports are never sampled, their QP and timing tables
+    would be incomplete.
+
+    With max_warnings only that many warnings of a log are stored, the others are only
+    counted (warnings_count); None keeps the default of the class.
     """
     _output_prefixes = ['o-']
     _report_prefixes = ['r-','r.']
@@ -35,29 +470,55 @@ class YamboFile():
     _p2y_log_prefixes = ['l_']
     _netcdf_prefixes = ['ns','ndb']
     _netcdf_sufixes  = {'QP':'gw','HF_and_locXC':'hf'}
+    # prefix -> kind of file, looked up with the first 3 and then 2 characters of the name
+    _prefix_types = dict([(prefix,'output')  for prefix in _output_prefixes] +
+                         [(prefix,'report')  for prefix in _report_prefixes] +
+                         [(prefix,'log')     for prefix in _log_prefixes] +
+                         [(prefix,'p2y_log') for prefix in _p2y_log_prefixes] +
+                         [(prefix,'netcdf')  for prefix in _netcdf_prefixes])
+
+    # bump when the parsed attributes change, invalidates the cached results (see get_state)
+    _cache_version = '5'
+    # files larger than the budget of their type (bytes) are sampled: only the first and the
+    # last half of the budget are read, see read_lines
+    default_size_budgets = {'log': 256*1024*1024, 'p2y_log': 64*1024*1024}
+    _sampled_types = ['log', 'p2y_log']
+    max_warnings = 1000 # default of the warnings stored per file, the others are only counted
+    _state_attributes = ['type', 'errors', 'warnings', 'max_memory', 'last_memory', 'last_memory_time',
+                         'last_time', 'yambo_wrote', 'data', 'kpoints', 'timing', 'timing_profile', 'memory_timeline', 'wall_time',
+                         'game_over', 'p2y_complete', 'para_error', 'unphysical_input',
+                         'warnings_count', 'truncated']
 
-    def __init__(self,filename,folder='.'):
+    def __init__(self,filename,folder='.',qp_window=None,size_budgets=None,max_warnings=None):
         self.filename = filename
         self.folder   = folder
+        self.qp_window = qp_window
+        self.size_budgets = dict(self.default_size_budgets)
+        self.size_budgets.update(size_budgets or {})
+        if max_warnings is not None:
+            self.max_warnings = max_warnings
         self.type     = None   
         self.errors   = [] #list of errors
         self.warnings   = [] #list of warnings
-        self.memstats   = [] #list of memory allocation statistics
+        self.warnings_count = 0 # number of warnings, also the ones not stored (see max_warnings)
+        self.truncated = None # {'size': , 'read': } bytes if only the head and tail of the file were read
         self.max_memory = None # max memory allocated or freed (Gb)
         self.last_memory = None # last memory allocated or freed (Gb)
-        self.last_memory_time = None # last memory allocated or freed (Gb)
-        self.timestats   = [] #list of reported times 
+        self.last_memory_time = None # time of the last memory allocated or freed (seconds)
         self.last_time = None # last reported time 
         self.yambo_wrote = None #  yambo performed a write to disk
         self.data     = {} #dictionary containing all the important data from the file
         self.kpoints = {}
         self.timing = []
+        self.timing_profile = [] # (kind, name, calls, min, mean, max time in seconds), see YamboReportScanner
+        self.memory_timeline = None # (seconds int32, Gb float32) arrays of the memory allocated along the run
         self.wall_time = None
         self.game_over = False  # check yambo run completed successfully
         self.p2y_complete = False  # check yambo initialization completed successfully
         self.para_error = False 
         self.unphysical_input = False 
-        if any(filename.startswith(prefix) for prefix in self._output_prefixes):
+        kind = self.guess_type(filename)
+        if kind == 'output':
             #read lines from file
             f = open("%s/%s"%(folder,filename),'r')
             self.lines = f.readlines()
@@ -71,24 +532,73 @@ class YamboFile():
                 return
             if 'GW' in title:
                  self.type = 'output_gw'
-
-        elif any(filename.startswith(prefix) for prefix in self._report_prefixes):
-            self.type = 'report'
-        elif any(filename.startswith(prefix) for prefix in self._log_prefixes):
-            self.type = 'log'
-        elif any(filename.startswith(prefix) for prefix in self._p2y_log_prefixes):
-            self.type = 'p2y_log'
-        elif any(filename.startswith(prefix) for prefix in self._netcdf_prefixes) and _has_netcdf:
-            for sufix in self._netcdf_sufixes:
-                if filename.endswith(sufix): 
-                    self.type = 'netcdf_%s'%self._netcdf_sufixes[sufix]
-                    break
+        elif kind != 'unknown':
+            self.type = kind
 
         if self.type is None: self.type = 'unknown'
         
         #parse the file
         self.parse()
 
+    def read_lines(self):
+        """ Iterate over the lines of the file.
+            Above the size budget of its type only the head and the tail of the file are read
+            (half of the budget each) and self.truncated records the file size and the bytes read.
+            Only the logs are sampled (see _sampled_types).
+        """
+        path = '%s/%s'%(self.folder,self.filename)
+        budget = self.size_budgets.get(self.type) if self.type in self._sampled_types else None
+        size = os.path.getsize(path)
+        if budget is None or size <= budget:
+            with open(path) as fl:
+                for line in fl:
+                    yield line
+            return
+        self.truncated = {'size': size, 'read': budget}
+        for line in _sampled_lines(path, budget//2, budget - budget//2):
+            yield line
+
+    def get_state(self):
+        """ Parsed attributes of the file, without the raw text
+        """
+        return dict((name, getattr(self, name)) for name in self._state_attributes)
+
+    @classmethod
+    def from_state(cls,filename,state,folder='.'):
+        """ YamboFile with the parsed attributes from get_state, without reading the file
+        """
+        yambofile = cls.__new__(cls)
+        yambofile.filename = filename
+        yambofile.folder = folder
+        for name in cls._state_attributes:
+            setattr(yambofile, name, state[name])
+        return yambofile
+
+    def release(self):
+        """ Drop the raw text of the file, keeping only the parsed data
+        """
+        if hasattr(self, 'lines'):
+            del self.lines
+        return self
+
+    @classmethod
+    def guess_type(cls,filename):
+        """ Type of a file from its name only, without opening it:
+            report, log, p2y_log, netcdf_gw, netcdf_hf, output (the kind of output
+            is only known from its title) or unknown.
+        """
+        kind = cls._prefix_types.get(filename[:3]) or cls._prefix_types.get(filename[:2])
+        if kind is None:
+            return 'unknown'
+        if kind == 'netcdf':
+            if not _has_netcdf:
+                return 'unknown'
+            for sufix in cls._netcdf_sufixes:
+                if filename.endswith(sufix):
+                    return 'netcdf_%s'%cls._netcdf_sufixes[sufix]
+            return 'unknown'
+        return kind
+
     def parse(self):
         """ Parse the file
             Add here things to read log and report files...
@@ -102,6 +612,8 @@ class YamboFile():
 
     def parse_output(self):
         """ Parse an output file from yambo,
+            the table of an o-*.qp file is loaded in a single NumPy structured array,
+            one row per (k-point, band, spin), see qp_output_dtype.
         """
         #get the tags of the columns
         if self.type == "output_absorption":
@@ -109,29 +621,24 @@ class YamboFile():
         if self.type == "output_gw":
             tags = [line.replace('(meV)','').replace('Sc(Eo)','Sc|Eo') for line in self.lines if all(tag in line for tag in ['K-point','Band','Eo'])][0]
             tags = tags[2:].strip().split()
-        table = np.genfromtxt(self.lines)
-        _kdata ={}
-        k_index =[ str(int(i)) for i in table[:,0]] # first column  has kpoints
-        for ind in range(len(k_index)):
-            for itag in range(len(tags)):
-                 if k_index[ind] not in _kdata.keys():
-                     _kdata[k_index[ind]] = {}
-                 try:
-                     _kdata[k_index[ind]][tags[itag]].append(table[ind,itag])
-                 except KeyError:
-                     _kdata[k_index[ind]][tags[itag]]  = [ table[ind,itag] ]
-
-        self.data = _kdata 
-        #self.data = dict(zip(tags,table.T))
+        table = np.loadtxt(self.lines, ndmin=2)
+        if self.type == "output_gw":
+            self.data = qp_output_records(tags, table)
+        else:
+            self.data = dict(zip(tags,table.T))
 
     def parse_netcdf_gw(self):
         """ Parse the netcdf gw file
         """
         if _has_netcdf:
             data = {}
-            f = Dataset('%s/%s'%(self.folder,self.filename))
-            #quasiparticles table
+            f = _open_netcdf('%s/%s'%(self.folder,self.filename))
+            #quasiparticles table, the indices are always read in full
             qp_table  = f.variables['QP_table'][:].T
+            rows = None
+            if self.qp_window:
+                rows = qp_window_rows(qp_table[:,2], qp_table[:,0], self.qp_window)
+                qp_table = qp_table[rows]
             data['Kpoint_index'] = qp_table[:,2]
             data['Band'] = qp_table[:,0]
             if qp_table.shape[1] == 4: # spin polarized
@@ -143,42 +650,53 @@ class YamboFile():
             #quasi-particles
             #old format
             if 'QP_E_Eo_Z' in f.variables:
-                qp = f.variables['QP_E_Eo_Z'][:]
-                qp = qp[0]+qp[1]*1j
+                qp = _read_rows(f.variables['QP_E_Eo_Z'], rows, axis=1)
+                qp = _complex_from(qp[0], qp[1])
                 data['E'],  data['Eo'], data['Z'] = qp.T
                 data['E-Eo'] = data['E']  -  data['Eo'] 
                 self.data=data
-                f.close()
+                _close_netcdf(f)
             #new format
             else:
-                E  = f.variables['QP_E'][:]
-                data['E'] = E[:,0] + E[:,1]*1j
-                Eo = f.variables['QP_Eo'][:]
-                data['Eo']= Eo
-                Z  = f.variables['QP_Z'][:]
-                data['Z'] = Z[:,0] + Z[:,1]*1j
+                data['E'] = _as_complex(_read_rows(f.variables['QP_E'], rows))
+                data['Eo']= _read_rows(f.variables['QP_Eo'], rows)
+                data['Z'] = _as_complex(_read_rows(f.variables['QP_Z'], rows))
                 data['E-Eo'] = data['E']  -  data['Eo'] 
                 self.data=data
-                f.close()
+                _close_netcdf(f)
        
     def parse_netcdf_hf(self):
         """ Parse the netcdf hf file (ndb.HF_and_locXC)
         """
         if _has_netcdf:
             data = {}
-            f = Dataset('%s/%s'%(self.folder,self.filename))
-            hf =  f.variables['Sx_Vxc'][:]
-            if hf.shape[0]%8 ==0 :
+            f = _open_netcdf('%s/%s'%(self.folder,self.filename))
+            variable = f.variables['Sx_Vxc']
+            ncolumns = 8 if variable.shape[0]%8 == 0 else 7
+            if self.qp_window and len(variable.shape) == 1:
+                # rows [ib, ibp, ik, (isp,) ...] are flattened: read the band and k-point
+                # columns, then only the span of the rows in the window
+                rows = qp_window_rows(variable[2::ncolumns], variable[0::ncolumns], self.qp_window)
+                start = int(rows[0]) if len(rows) else 0
+                stop = int(rows[-1]) + 1 if len(rows) else 0
+                hf = np.asarray(variable[start*ncolumns:stop*ncolumns]).reshape(-1, ncolumns)[rows - start]
+            else:
+                hf =  variable[:]
+            if ncolumns == 8:
                 qp =  hf.reshape(-1,8)
                 ib, ibp, ik, isp, rsx, isx, revx, imvx = qp.T
+                data['Spin_pol'] = isp
             else:
                 qp =  hf.reshape(-1,7)
                 ib, ibp, ik, rsx, isx, revx, imvx = qp.T
-            data['Sx'] = rsx + isx*1j 
-            data['Vxc'] = revx + imvx*1j
+            data['Band'] = ib
+            data['Band_p'] = ibp
+            data['Kpoint_index'] = ik
+            data['Sx'] = _complex_from(rsx, isx)
+            data['Vxc'] = _complex_from(revx, imvx)
 
             self.data=data
-            f.close()
+            _close_netcdf(f)
  
     def parse_report(self):
         """ Parse the report files.
@@ -188,66 +706,26 @@ class YamboFile():
             }
             k-index is the kpoint at which the yambo calculation was
             done.
+            The file is streamed once through a YamboReportScanner.
         """
-        if not hasattr(self, 'lines'):
-            with open('%s/%s'%(self.folder,self.filename)) as fl:
-                self.lines = fl.readlines()
-        # start with check for  failure due to error:
-        err = re.compile('^\s+?\[ERROR\]\s+?(.*)$')
-        kpoints = re.compile('^  [A-X*]+\sK\s\[([0-9]+)\]\s[:](?:\s+)?([0-9.E-]+\s+[0-9.E-]+\s+[0-9.E-]+)\s[A-Za-z()\s*.]+[0-9]+[A-Za-z()\s*.]+([0-9.]+)')
-        timing = re.compile('\s+?[A-Za-z]+iming\s+?[A-Za-z/\[\]]+[:]\s+?([a-z0-9-]+)[/]([a-z0-9-]+)[/]([a-z0-9-]+)')
-        game_over = re.compile('^\s+?\[\d+\]\s+?G\w+\s+?O\w+\s+?\&\s+?G\w+\s+?\w+') # Game over & Game summary
-        p2y_complete = re.compile('^(\s+)?[-<>\d\w]+\s+?P\d+[:]\s+?==\s+?P2Y\s+?\w+\s+?==(\s+)?') # P2Y Complete
-        p2y_complete_v2 = re.compile('(\s+)?[-<>\w\d]+(\s+)?==(\s+)?P2Y(\s+)?\w+(\s+)?==') # P2Y Complete
-        yambo_wrote =  re.compile('(?:\s+)?[[]WR[./\w]+[]](?:[-])+')
-        for line in self.lines:
-            if err.match(line):
-                if 'STOP' in err.match(line).groups()[0]:
-                    # stop parsing, this is a failed calc.
-                    self.errors.append(err.match(line).groups()[0])
-                    return 
-            if timing.match(line):
-                self.timing.append(timing.match(line).groups()[0] )
-            if kpoints.match(line):
-                kindx, kpt, wgt = kpoints.match(line).groups()
-                self.kpoints[str(int(kindx))] =  [ float(i.strip()) for i in kpt.split()]
-            if game_over.match(line):
-                self.game_over = True
-            if p2y_complete.match(line) or p2y_complete_v2.match(line):
-                self.p2y_complete = True
-                self.game_over = True
-            if yambo_wrote.match(line):
-                self.yambo_wrote = True
-    
-        full_lines = ''.join(self.lines)
-        qp_regx = re.compile('(^\s+?QP\s\[eV\]\s@\sK\s\[\d+\][a-z0-9E:()\s.-]+)(.*?)(?=^$)',re.M|re.DOTALL)
-        kp_regex = re.compile('^\s+?QP\s\[eV\]\s@\sK\s\[(\d+)\][a-z0-9E:()\s.-]+$')
-        spliter = re.compile('^(B[=]\d+\sEo[=]\s+?[E0-9.-]+\sE[=]\s+?[E0-9.-]+\sE[-]Eo[=]\s+?[E0-9.-]+\sRe[(]Z[)][=]\s+?[E0-9.-]+\sIm[(]Z[)][=]\s?[E0-9.-]+\snlXC[=]\s+?[E0-9.-]+\slXC[=]\s+?[E0-9.-]+\sSo[=]\s+?[E0-9.-]+)')
-        extract = re.compile('B[=](\d+)\sEo[=](?:\s+)?([E0-9.-]+)\sE[=](?:\s+)?([E0-9.-]+)\sE[-]Eo[=](?:\s+)?([E0-9.-]+)\sRe[(]Z[)][=](?:\s+)?([E0-9.-]+)\sIm[(]Z[)][=](?:\s+)?[E0-9.-]+\snlXC[=](?:\s+)?([E0-9.-]+)\slXC[=](?:\s+)?([E0-9.-]+)\sSo[=](?:\s+)?([E0-9.-]+)')
-        qp_lines = qp_regx.findall(full_lines)
-        qp_results ={}
-        for each in qp_lines: # first group of qp data, shares k-point index
-            kp_index = None
-            kp_results={'bindex':[],'dft_energy':[],'qp_energy':[],'qp_correction':[],
-                        'z_factor':[],'non_local_xc':[],'local_xc':[],'selfenergy_c':[]}
-            for line in each: # different band indexes =B
-                if kp_regex.match(line):
-                    kp_index = str(int(kp_regex.match(line).groups()[0]))
-                else: #  data line B=x Eo = y ..
-                    data_lines = [ i for i in spliter.split(line) if i.strip()]
-                    for qp_data in data_lines:
-                        bindex, dft_energy, qp_energy, qp_correction, z_factor, \
-                        non_local_xc, local_xc, selfenergy_c = [float (i) for i in extract.match(qp_data).groups()]
-                        kp_results['bindex'].append(bindex) 
-                        kp_results['dft_energy'].append(dft_energy) 
-                        kp_results['qp_energy'].append(qp_energy) 
-                        kp_results['qp_correction'].append(qp_correction) 
-                        kp_results['z_factor'].append(z_factor) 
-                        kp_results['non_local_xc'].append(non_local_xc) 
-                        kp_results['local_xc'].append(local_xc) 
-                        kp_results['selfenergy_c'].append(selfenergy_c) 
-            qp_results[kp_index] = kp_results
-        self.data = qp_results 
+        scanner = YamboReportScanner()
+        lines = self.read_lines()
+        for line in lines:
+            scanner.feed(line)
+            if scanner.stopped:
+                lines.close()
+                break
+        self.errors.extend(scanner.errors)
+        self.kpoints.update(scanner.kpoints)
+        self.timing.extend(scanner.timing)
+        self.timing_profile.extend(scanner.profile)
+        self.data = scanner.data
+        if scanner.game_over:
+            self.game_over = True
+        if scanner.p2y_complete:
+            self.p2y_complete = True
+        if scanner.yambo_wrote:
+            self.yambo_wrote = True
 
     def get_type(self):
         """ Get the type of file        
@@ -272,61 +750,30 @@ class YamboFile():
 
     def parse_log(self):
         """ Get ERRORS and WARNINGS from  l-*  file, useful for debugging
+            The file is streamed once through a YamboLogScanner.
         """
-        if not hasattr(self, 'lines'):
-            with open('%s/%s'%(self.folder,self.filename)) as fl:
-                self.lines = fl.readlines()
-        warning = re.compile('^\s+?<([0-9a-z-]+)> ([A-Z0-9]+)[:] \[(WARNING)\]? ([a-zA-Z0-9\s.()\[\]]+)?')
-        error = re.compile('^\s+?<([0-9a-z-]+)> ([A-Z0-9]+)[:] \[(ERROR)\]? ([a-zA-Z0-9\s.()\[\]]+)?')
-        self.warnings.extend([ line for line in self.lines if warning.match(line)])
-        self.errors.extend([ line for line in self.lines if error.match(line)])
-        memory = re.compile('^\s+?<([0-9a-z-]+)> ([A-Z0-9]+)[:] \[M  ([0-9.]+) Gb\]? ([a-zA-Z0-9\s.()\[\]]+)?')
-        self.memstats.extend([ line for line in self.lines if memory.match(line)])
-        if len(self.memstats)>0:
-            self.max_memory = max([float(memory.match(line).groups()[2]) for line in self.memstats])
-            self.last_memory = [float(memory.match(line).groups()[2]) for line in self.memstats][-1]
-        # Function to convert time in seconds
-        def get_seconds(time_string):
-            time = time_string.split('-')
-            if time[0]=='' and time[1]=='' and time[2]=='':
-                time= ['0h','0m','0s']
-            if time[0].endswith('h'):
-                return int(time[0].replace("h","")) * 3600 + int(time[1].replace("m","")) * 60 + int(time[2].replace("s",""))
-            elif time[0].endswith('m'):
-                return int(time[0].replace("m","")) * 60 + int(time[1].replace("s",""))
-            elif time[0].endswith('s'):
-                return int(time[0].replace("s",""))
-            else:
-                raise Exception
-
-        times = re.compile('^\s+?<([0-9a-z-]+)>')   
-        self.timestats.extend([ get_seconds(times.match(line).groups()[0]) for line in self.lines if times.match(line)]) 
-        self.last_time = self.timestats[-1]
-        if len(self.memstats)>0:
-            self.last_memory_time = [ get_seconds(memory.match(line).groups()[0]) for line in self.memstats][-1]
-
-        generic_error = re.compile('^(?=\s+)?([A-Z0-9]+)[:] \[(ERROR)\](?=\s+)?([a-zA-Z0-9\s.()\[\]]+)?')
-        paralle = re.compile('^(?=\s+)?([A-Z0-9]+)[:] \[ERROR\](?=\s+)?Impossible(?=\s+)?(?=[a-zA-Z0-9\s.()\[\]]+)?')
-        unphysical = re.compile('^(?=\s+)?([A-Z0-9]+)[:] \[ERROR\](?=\s+)?\[NetCDF\]\s*NetCDF[:]\s*NC_UNLIMITED\s*in\s*the\s*wrong\s*index')
-        self.errors.extend ([ line for line in self.lines if ( para_error.match(line) and paralle.match(line))  ])
-        for line in self.lines:
-            if generic_error.match(line):
-                if paralle.match(line):
-                    self.para_error = True
-                if unphysical.match(line):
-                    self.unphysical_input = True
+        scanner = YamboLogScanner(max_warnings=self.max_warnings)
+        for line in self.read_lines():
+            scanner.feed(line)
+        self.warnings.extend(scanner.warnings)
+        self.warnings_count = scanner.warnings_count
+        self.errors.extend(scanner.errors)
+        self.max_memory = scanner.max_memory
+        self.last_memory = scanner.last_memory
+        self.last_memory_time = scanner.last_memory_time
+        self.last_time = scanner.last_time
+        self.para_error = scanner.para_error
+        self.unphysical_input = scanner.unphysical_input
+        self.memory_timeline = scanner.memory_timeline()
 
     def parse_p2y_log(self):
         """ Get ERRORS and WARNINGS from p2y l_*  file, useful for debugging
             Get *Writing* lines, useful to tell if 'aiida' directory was created.
         """
-        if not hasattr(self, 'lines'):
-            with open('%s/%s'%(self.folder,self.filename)) as fl:
-                self.lines = fl.readlines()
         p2y_complete = re.compile('^(\s+)?[-<>\d\w]+\s+?P\d+[:]\s+?==\s+?P2Y\s+?\w+\s+?==(\s+)?') # P2Y Complete
         p2y_complete_v2 = re.compile('(\s+)?[-<>\w\d]+(\s+)?==(\s+)?P2Y(\s+)?\w+(\s+)?==') # P2Y Complete
         yambo_wrote = re.compile('(?:\s+)?(?:[<>\w\d]+)(:?\s+)?(?:P\d+[:])(?:\s+)?(?:[[]\w+[]])?(?:\s+)?Writing(?:\s+)?\w+(?:\s+)?')
-        for line in self.lines:
+        for line in self.read_lines():
             if p2y_complete.match(line) or p2y_complete_v2.match(line):
                 self.p2y_complete = True
                 self.game_over = True 
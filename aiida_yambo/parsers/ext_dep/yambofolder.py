@@ -3,28 +3,199 @@
 #
 # This file is part of yamboparser
 # 
-from yambofile import *
+from __future__ import print_function
+from .yambofile import *
+import fnmatch
 import os
 import numpy as np
 
+def cache_version(qp_window=None, size_budgets=None, max_warnings=None):
+    """
+    Version under which the parsed files are cached: the parser version, the QP window,
+    the size budgets and the number of warnings stored
+    """
+    version = YamboFile._cache_version
+    if qp_window:
+        version = '%s:%s'%(version, ','.join('%d-%d-%d-%d'%tuple(r) for r in qp_window))
+    if size_budgets:
+        version = '%s;%s'%(version, ','.join('%s=%s'%item for item in sorted(size_budgets.items())))
+    if max_warnings is not None:
+        version = '%s|%d'%(version, max_warnings)
+    return version
+
+def _parse_file(args):
+    """
+    Build the YamboFile of (filename, dirname, release, cache, qp_window, size_budgets, max_warnings),
+    module level so that it can be sent to a process pool.
+    With release the raw text is dropped as soon as the file is parsed.
+    With a cache (get(key)/put(key, state)/key(filename, folder, version)) the parsed state
+    is looked up by content and stored after parsing.
+    """
+    filename, dirname, release, cache, qp_window, size_budgets, max_warnings = args
+    if cache is not None:
+        key = cache.key(filename, dirname, cache_version(qp_window, size_budgets, max_warnings))
+        state = cache.get(key)
+        if state is not None:
+            return YamboFile.from_state(filename, state, folder=dirname)
+    yambofile = YamboFile(filename, folder=dirname, qp_window=qp_window, size_budgets=size_budgets,
+                          max_warnings=max_warnings)
+    if cache is not None and yambofile.type != 'unknown':
+        cache.put(key, yambofile.get_state())
+    if release:
+        yambofile.release()
+    return yambofile
+
 class YamboFolder():
     """
     Takes as input a folder name that is the folder where yambo saved r-* o-* l-* and netcdf files
+
+    With patterns (e.g. the retrieve list of the calculation: 'r*', 'l*', 'LOG/l-*_CPU_1',
+    'aiida/ndb.QP', ...) only the files matching them are considered and only the folders
+    named in the patterns are listed, instead of walking the whole tree.
+    Files are selected from their name (see YamboFile.guess_type) before being opened.
+
+    With processes > 1 the files are parsed in parallel by a pool of that many processes
+    (threads=True for a thread pool, also used when the current process cannot fork
+    workers, e.g. a daemonic process). The files are independent and the results are
+    gathered in the same order as in the serial case.
+
+    With a cache (e.g. aiida_yambo.parsers.cache.ParseCache) files already parsed with the
+    same content are loaded from it instead of being parsed again.
+
+    With a qp_window, list of (k1, k2, b1, b2) ranges as in QPkrange, only the QP states in
+    the window are read from the netcdf databases.
+
+    With size_budgets, {type: bytes}, the large logs are sampled with these budgets instead
+    of the default ones, and with max_warnings only that many warnings are stored per log
+    (see YamboFile).
+
+    An executor, called with the list of (filename, dirname, release, cache, qp_window,
+    size_budgets, max_warnings) tasks, can
+    replace the pools: it yields the YamboFile of each task in order, or None for the files
+    it could not parse (e.g. aiida_yambo.parsers.worker.ParseWorkerPool).
+
+    With lazy=True nothing is parsed on construction and the files are consumed one at
+    a time with iter_results, so that only one parsed file is held in memory.
     """
 
-    def __init__(self,path):
+    def __init__(self,path,processes=None,threads=False,patterns=None,lazy=False,cache=None,executor=None,
+                 qp_window=None,size_budgets=None,max_warnings=None):
         """
         List all the files in the folder and to each of them call YamboFile class
         """
         self.path = path
+        self.processes = processes
+        self.threads = threads
+        self.cache = cache
+        self.executor = executor
+        self.qp_window = qp_window
+        self.size_budgets = size_budgets
+        self.max_warnings = max_warnings
         self.yambofiles = [] #list of YamboFile instances
 
+        if patterns is None:
+            tasks = self._walk(path)
+        else:
+            tasks = self._discover(path, patterns)
+        # only the files with a known prefix are opened
+        self.tasks = [task for task in tasks if YamboFile.guess_type(task[0]) != 'unknown']
+
+        if not lazy:
+            self.yambofiles = list(self._parse_all(release=False))
+
+    def iter_results(self):
+        """
+        Yield the YamboFile of each file of known type, one at a time and in the same order
+        as yambofiles, without its raw text (see YamboFile.release).
+        The results are not kept by the folder.
+        """
+        for yambofile in self._parse_all(release=True):
+            yield yambofile
+
+    def _parse_all(self, release):
+        """
+        Generator of the parsed files of known type, in the order of the tasks
+        """
+        tasks = [(filename, dirname, release, self.cache, self.qp_window, self.size_budgets, self.max_warnings)
+                 for filename, dirname in self.tasks]
+        if self.executor is not None:
+            yambofiles = (y for y in self.executor(tasks) if y is not None)
+        elif self.processes and self.processes > 1 and len(tasks) > 1:
+            yambofiles = self._parallel_imap(tasks, min(self.processes, len(tasks)), self.threads)
+        else:
+            yambofiles = (_parse_file(task) for task in tasks)
+
+        for y in yambofiles:
+            if y.type !='unknown': #checks if the file is of a known type
+                yield y
+
+    @staticmethod
+    def _walk(path):
+        """
+        (filename, dirname) of all the files in the tree, in a reproducible order
+        """
+        tasks = []
         for dirname, dirnames, filenames in os.walk(path):
+            dirnames.sort()
             # iterate over all the files in the folder
+            for filename in sorted(filenames):
+                tasks.append((filename, dirname))
+        return tasks
+
+    @staticmethod
+    def _discover(path, patterns):
+        """
+        (filename, dirname) of the files matching the patterns.
+        AiiDA flattens the retrieved paths (LOG/l-*_CPU_1 is stored as l-*_CPU_1),
+        so the name part of every pattern is matched in the top folder and, if it
+        exists, in the folder of the pattern.
+        """
+        by_folder = {} # folder -> name patterns
+        for pattern in patterns:
+            if isinstance(pattern, (list, tuple)): # [remote, local, depth] retrieve items
+                pattern = pattern[0]
+            dirpart, name = os.path.split(pattern)
+            by_folder.setdefault(path, []).append(name)
+            if dirpart:
+                by_folder.setdefault(os.path.join(path, dirpart), []).append(name)
+
+        tasks = []
+        for dirname in sorted(by_folder):
+            try:
+                filenames = sorted(os.listdir(dirname))
+            except OSError: # the folder of the pattern was not retrieved
+                continue
+            names = by_folder[dirname]
             for filename in filenames:
-                y = YamboFile(filename, folder=dirname)
-                if y.type !='unknown': #checks if the file is of a known type
-                    self.yambofiles.append(y)
+                if any(fnmatch.fnmatchcase(filename, name) for name in names) and \
+                   YamboFile.guess_type(filename) != 'unknown' and \
+                   os.path.isfile(os.path.join(dirname, filename)):
+                    tasks.append((filename, dirname))
+        return tasks
+
+    @staticmethod
+    def _parallel_imap(tasks, processes, threads):
+        """
+        Parse the files with a bounded pool, yielding them in the order of tasks
+        """
+        from multiprocessing.pool import Pool, ThreadPool
+        pool = None
+        if not threads:
+            try:
+                pool = Pool(processes)
+            except (AssertionError, OSError):
+                # daemonic processes are not allowed to have children
+                pool = None
+        if pool is None:
+            pool = ThreadPool(processes)
+        try:
+            for yambofile in pool.imap(_parse_file, tasks, chunksize=1):
+                yield yambofile
+            pool.close()
+        finally:
+            # stop the workers also when the consumer does not exhaust the results
+            pool.terminate()
+            pool.join()
 
     def get_data(self):
         """
@@ -32,10 +203,13 @@ class YamboFolder():
         """
         data = {}
         for yambofile in self.yambofiles:
-            print yambofile.filename
-            print "data:",yambofile.data.keys()
-            print "memo:",yambofile.memstats
-            print "warn:",yambofile.warnings
+            print(yambofile.filename)
+            if isinstance(yambofile.data, np.ndarray): # o-*.qp table, one column per observable
+                print("data:",yambofile.data.dtype.names)
+            else:
+                print("data:",list(yambofile.data.keys()))
+            print("memo:",yambofile.max_memory)
+            print("warn:",yambofile.warnings)
  
     def __str__(self):
         s = ''
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Live monitoring of the log and report of a running YamboCalculation.
+"""
+import os
+from aiida_yambo.parsers.ext_dep.yambofile import YamboLogScanner, YamboReportScanner
+
+class YamboMonitor(object):
+    """
+    Follows the remote  LOG/l-*_CPU_1  (or l-*) and  r-*  files of a running YamboCalculation
+    over the AiiDA transport of its computer.
+
+    Each poll only transfers the bytes written since the previous poll: a byte offset is
+    kept for every remote file and the new complete lines are fed to a YamboLogScanner or
+    YamboReportScanner, so memory, time and error status are updated incrementally and
+    the cost of a poll is proportional to the new output.
+
+        monitor = YamboMonitor(calc)
+        while calc.get_state() == calc_states.WITHSCHEDULER:
+            monitor.poll()
+            print monitor.get_state()
+            time.sleep(60)
+    """
+    _log_patterns = ['LOG/l-*_CPU_1', 'l-*']
+    _report_patterns = ['r-*']
+
+    def __init__(self, calc):
+        self.calc = calc
+        self.offsets = {} # remote path -> bytes already read
+        self._partial = {} # remote path -> incomplete last line
+        self.log = None # scanner of the log being followed
+        self.report = None # scanner of the report being followed
+        self._log_path = None
+        self._report_path = None
+
+    def poll(self, transport=None):
+        """ Read the new bytes of the remote files and update the state.
+            A transport is opened for the computer of the calculation if none is given.
+        """
+        if transport is None:
+            transport = self.calc._get_transport()
+            with transport:
+                return self.poll(transport)
+        workdir = self.calc._get_remote_workdir()
+        if self._log_path is None:
+            self._log_path = self._find(transport, workdir, self._log_patterns)
+        if self._report_path is None:
+            self._report_path = self._find(transport, workdir, self._report_patterns)
+        if self._log_path:
+            self.log = self._follow(transport, self._log_path, self.log, YamboLogScanner)
+        if self._report_path:
+            self.report = self._follow(transport, self._report_path, self.report, YamboReportScanner)
+        return self.get_state()
+
+    @staticmethod
+    def _find(transport, workdir, patterns):
+        """ First remote file matching one of the patterns (in order of preference), None if none yet
+        """
+        for pattern in patterns:
+            paths = sorted(transport.glob(os.path.join(workdir, pattern)))
+            if paths:
+                return paths[0]
+        return None
+
+    def _follow(self, transport, path, scanner, scanner_class):
+        """ Feed the lines appended to path since the last poll to scanner
+        """
+        size = transport.get_attribute(path).st_size
+        offset = self.offsets.get(path, 0)
+        if scanner is None or size < offset: # new or rewritten file
+            scanner = scanner_class()
+            offset = 0
+            self._partial[path] = ''
+        if size == offset:
+            return scanner
+        # tail counts bytes from 1; head bounds the read to what was there at stat time
+        retval, stdout, stderr = transport.exec_command_wait(
+            "tail -c +{} '{}' | head -c {}".format(offset + 1, path, size - offset))
+        if retval != 0:
+            return scanner
+        self.offsets[path] = offset + len(stdout)
+        lines = (self._partial[path] + stdout).split('\n')
+        self._partial[path] = lines.pop() # the last line may still be being written
+        for line in lines:
+            if getattr(scanner, 'stopped', False): # STOP found in the report
+                break
+            scanner.feed(line + '\n')
+        return scanner
+
+    def get_state(self):
+        """ Dictionary with the current state, with the keys of output_parameters
+        """
+        state = {'errors': [], 'warnings': [], 'game_over': False}
+        if self.log is not None:
+            for name in ('max_memory', 'last_memory', 'last_memory_time', 'last_time'):
+                if getattr(self.log, name) is not None:
+                    state[name] = getattr(self.log, name)
+            state['errors'].extend(self.log.errors)
+            state['warnings'].extend(self.log.warnings)
+            state['para_error'] = self.log.para_error
+            state['unphysical_input'] = self.log.unphysical_input
+        if self.report is not None:
+            state['errors'].extend(self.report.errors)
+            state['game_over'] = self.report.game_over
+            state['timing'] = self.report.timing
+        return state
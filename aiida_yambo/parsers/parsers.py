@@ -7,7 +7,6 @@ from aiida.parsers.exceptions import OutputParsingError
 from aiida.common.exceptions import UniquenessError
 from aiida.common.exceptions import ValidationError, ParsingError
 import numpy
-import copy
 from aiida.orm.data.array import ArrayData
 from aiida.orm.data.array.bands import BandsData
 from aiida.orm.data.array.kpoints import KpointsData
@@ -15,8 +14,13 @@ from aiida.orm.data.parameter import ParameterData
 from aiida.orm.data.structure import StructureData
 from aiida.orm.utils import DataFactory, CalculationFactory
 import glob, os, re
+import multiprocessing
 from aiida_yambo.parsers.ext_dep.yambofile  import  YamboFile
 from aiida_yambo.parsers.ext_dep.yambofolder  import  YamboFolder
+from aiida_yambo.parsers.qpdataset import QPDataset
+from aiida_yambo.parsers.cache import ParseCache
+from aiida_yambo.parsers.worker import ParseWorkerPool
+from aiida_yambo.data.compressed import CompressedArrayData
 from aiida_yambo.calculations.gw import YamboCalculation
 #PwCalculation = CalculationFactory('quantumespresso.pw')
 from aiida_quantumespresso.calculations.pw import PwCalculation
@@ -27,19 +31,23 @@ __license__ = "Non-Commercial, End-User Software License Agreement, see LICENSE.
 __version__ = "0.4.1"
 __authors__ = "Michael Atambo, Antimo Marrazzo, Gianluca Prandini and the AiiDA team. The parser relies on the yamboparser module by Henrique Pereira Coutada Miranda."
 
+_rank_log = re.compile('_CPU_(\d+)$') # LOG/l-*_CPU_N, retrieved as l-*_CPU_N
+
 class YamboParser(Parser):
     """
     This class is a wrapper class for the Parser class for Yambo calculators
     from yambopy.
     *IMPORTANT: This plugin can parse netcdf files produced by yambo if the 
      python netcdf libraries are installed, otherwise they are ignored.
-    Accepts data from yambopy's YamboFolder  as a list of YamboFile instances. 
+    Accepts data from yambopy's YamboFolder  as a stream of YamboFile instances (YamboFolder.iter_results),
+    one parsed file at a time and without their raw text.
     The instances of YamboFile have the following attributes:
       .data: A Dict, with k-points as keys and  in each futher a dict with obeservalbe:value pairs ie.
             { '1' : {'Eo': 5, 'B':1,..}, '15':{'Eo':5.55,'B': 30}... }
+            for o-*.qp files it is a NumPy structured array with one row per (k-point, band, spin)
+            and columns kpoint, band, spin, Eo, E_minus_Eo, So, Z (when present in the file).
       .warnings:     list of strings, one warning  per string.
       .errors:       list of errors, one error per string.
-      .memory        list of string, info on memory allocated and freed
       .max_memory    maximum memory allocated or freed during the run
       .last_memory   last memory allocated or freed during the run
       .last_memory_time   last point in time at which  memory was  allocated or freed
@@ -63,6 +71,24 @@ class YamboParser(Parser):
              and spin index if spin polarized else 0. BandsData can not be used as the k-point triplets
              are not available in the o-*.qp file.
     r-*    : BandsData is stored with the proper list of K-points, bands_labels. 
+    ndb.*  : ArrayData with the same layout as o-*.qp (see QPDataset), with Sx, Vxc and Sc
+             added when ndb.HF_and_locXC is available too.
+    r-*    : ArrayData with the timing profile, time spent in each section/routine (see _aiida_timing).
+    l-*    : ArrayData with the memory timeline, time (seconds, int32) and memory allocated (Gb, float32)
+             at each allocation or release.
+    l-*_CPU_N : with the RANK_LOGS setting, ArrayData with wall time, peak memory and time of the
+             last memory event of each rank, and the imbalance metrics in output_parameters;
+             the errors and para_error of all the ranks are reported in output_parameters.
+
+    With the QP_WINDOW setting only the QP states in a window of k-points and bands are read
+    from the ndb.* databases (see _qp_window).
+    The logs larger than their size budget are sampled (see YamboFile.read_lines), the
+    PARSER_SIZE_BUDGETS setting, {'log': bytes, 'p2y_log': bytes}, replaces the default budgets.
+    At most YamboFile.max_warnings warnings are stored per log, or PARSER_MAX_WARNINGS if given;
+    the others are counted in warnings_not_stored.
+    With the QP_STORAGE: 'compact' setting the QP results are stored once, in a single
+    array_qp CompressedArrayData node from the richest source available (see _canonical_qp),
+    and with QP_PRECISION: 'single' their observables are stored as float32/complex64.
     """
     
     def __init__(self,calculation):
@@ -87,6 +113,11 @@ class YamboParser(Parser):
         self._lifetime_bands_linkname = 'bands_lifetime'
         self._quasiparticle_bands_linkname = 'bands_quasiparticle'
         self._parameter_linkname = 'output_parameters'
+        self._ranks_array_linkname = 'array_ranks'
+        self._timing_array_linkname = 'array_timing'
+        self._memory_array_linkname = 'array_memory'
+        self._qp_compact = False # QP_STORAGE setting
+        self._qp_single = False # QP_PRECISION setting
         super(YamboParser, self).__init__(calculation)
         
     def parse_from_calc(self):
@@ -112,6 +143,30 @@ class YamboParser(Parser):
             settings_dict = {}
  
         initialise = settings_dict.pop('INITIALISE', None)
+        # parse the retrieved files with a pool of workers (opt-in)
+        parser_processes = settings_dict.pop('PARSER_PROCESSES', None)
+        # reuse the results of files already parsed with the same content (opt-in)
+        parser_cache = None
+        if settings_dict.pop('PARSER_CACHE', False):
+            parser_cache = ParseCache()
+        # the logs of all the MPI ranks were retrieved, they are parsed serially unless
+        # PARSER_PROCESSES is given
+        settings_dict.pop('RANK_LOGS', False)
+        # parse the large files in worker processes, out of the daemon (opt-in)
+        parser_workers = None
+        parser_timeout = settings_dict.pop('PARSER_TIMEOUT', None) # seconds
+        memory_limit = settings_dict.pop('PARSER_MEMORY_LIMIT', None) # MB
+        if settings_dict.pop('PARSER_ISOLATE', False):
+            parser_workers = ParseWorkerPool(processes=parser_processes or multiprocessing.cpu_count(),
+                                             timeout=parser_timeout,
+                                             memory_limit=int(memory_limit*1024*1024) if memory_limit else None)
+        elif parser_timeout is not None or memory_limit is not None:
+            parserlogger.warning("PARSER_TIMEOUT and PARSER_MEMORY_LIMIT are ignored without PARSER_ISOLATE",
+                                 extra=logger_extra)
+
+        # storage of the QP results: one compressed node and/or single precision (opt-in)
+        self._qp_compact = settings_dict.pop('QP_STORAGE', 'full') == 'compact'
+        self._qp_single = settings_dict.pop('QP_PRECISION', 'double') == 'single'
 
         # select the folder object
         out_folder = self._calc.get_retrieved_node()
@@ -145,15 +200,42 @@ class YamboParser(Parser):
         new_nodes_list= []
         ndbqp = {}
         ndbhf = {}
+        timing_profile = [] # (kind, name, calls, min, mean, max) from the reports
+        memory_timeline = ([], []) # (seconds, Gb) from the longest log
+        ranks = [] # (rank, last_time, max_memory, last_memory_time) of each LOG/l-*_CPU_N
+        qp_results = [] # parsed files with QP results, with QP_STORAGE compact
+        # look only for the files that the calculation asked to retrieve
+        try:
+            retrieve_list = self._calc._get_retrieve_list()
+        except AttributeError:
+            retrieve_list = None
+        # read only a window of QP states from the ndb.* databases (opt-in)
+        qp_window = self._qp_window(settings_dict.pop('QP_WINDOW', None), input_params)
+        # size budgets of the sampled logs, instead of YamboFile.default_size_budgets
+        size_budgets = settings_dict.pop('PARSER_SIZE_BUDGETS', None)
+        # warnings stored per log, instead of YamboFile.max_warnings
+        max_warnings = settings_dict.pop('PARSER_MAX_WARNINGS', None)
         try:                          
-            results = YamboFolder(out_folder.get_abs_path())
+            results = YamboFolder(out_folder.get_abs_path(), processes=parser_processes,
+                                  patterns=retrieve_list, lazy=True, cache=parser_cache,
+                                  executor=parser_workers, qp_window=qp_window,
+                                  size_budgets=size_budgets, max_warnings=max_warnings)
         except Exception, e:
             success = False 
             raise ParsingError("Unexpected behavior of YamboFolder: %s"%e)
   
-        for result in results.yambofiles:
+        # the files are parsed and consumed one at a time
+        for result in self._iter_results(results):
             if results is None:
                 continue
+            rank = self._log_rank(result)
+            if rank is not None:
+                # the wall time of a rank is the last time stamp of its log
+                ranks.append((rank, result.last_time, result.max_memory, result.last_memory_time))
+                if rank != 1: # the other ranks only enter the load balance profile and the errors
+                    output_params['errors'].extend(result.errors)
+                    output_params['para_error'] = output_params.get('para_error', False) or bool(result.para_error)
+                    continue
             if result.max_memory:
                 output_params['max_memory'] = result.max_memory    # Gb
                 output_params['max_memory_units'] = 'Gb'    # Gb
@@ -173,8 +255,17 @@ class YamboParser(Parser):
                 output_params['yambo_wrote'] = True # boolean
             if result.timing:
                 output_params['timing'] = result.timing
+            if result.timing_profile:
+                timing_profile.extend(result.timing_profile)
+            if result.memory_timeline is not None and len(result.memory_timeline[0]) > len(memory_timeline[0]):
+                memory_timeline = result.memory_timeline
             if result.warnings:
                 output_params['warnings'].extend(result.warnings)
+            if result.warnings_count > len(result.warnings): # only counted, see PARSER_MAX_WARNINGS
+                output_params['warnings_not_stored'] = output_params.get('warnings_not_stored', 0) + \
+                                                       result.warnings_count - len(result.warnings)
+            if result.truncated: # only the head and the tail were read, see YamboFile.read_lines
+                output_params.setdefault('truncated_files', {})[result.filename] = result.truncated
             if result.errors:
                 for err in result.errors:
                    if 'STOP' in err:
@@ -182,11 +273,8 @@ class YamboParser(Parser):
                        break
                    else:
                        output_params['errors'].extend(result.errors)
-            if  hasattr(result, 'para_error'):
-                if result.para_error == True:
-                    output_params['para_error'] = True
-                else:
-                    output_params['para_error'] = False
+            if  hasattr(result, 'para_error'): # of any of the logs
+                output_params['para_error'] = output_params.get('para_error', False) or bool(result.para_error)
             if  hasattr(result, 'game_over'):
                 if result.game_over == True:
                     successful = True 
@@ -207,25 +295,28 @@ class YamboParser(Parser):
                 new_nodes_list.append( (self._alpha_array_linkname, alpha_array) )
 
             elif 'ndb.QP' == result.filename:
-                 ndbqp = copy.deepcopy( result.data)
+                 ndbqp = result.data
 
             elif 'ndb.HF_and_locXC' == result.filename:
-                 ndbhf = copy.deepcopy(result.data)
+                 ndbhf = result.data
 
             elif 'gw0' in input_params:
-                if self._aiida_bands_data(result.data,cell,result.kpoints):
-                    arr = self._aiida_bands_data(result.data, cell,result.kpoints)
+                if self._qp_compact: # stored after the ndb.* files are known, see _canonical_qp
+                    qp_results.append(result)
+                    continue
+                arr = self._aiida_bands_data(result.data, cell, result.kpoints)
+                if arr is not False:
                     if  type(arr)==BandsData: # ArrayData is not BandsData, but BandsData is ArrayData
                         new_nodes_list.append((self._quasiparticle_bands_linkname, arr ))
                     if type(arr) == ArrayData: # 
                         new_nodes_list.append((self._qp_array_linkname,arr ))
 
             elif 'life' in input_params:
-                if self._aiida_bands_data(result.data,cell,result.kpoints):
-                    arr = self._aiida_bands_data(result.data, cell,result.kpoints)
+                arr = self._aiida_bands_data(result.data, cell, result.kpoints)
+                if arr is not False:
                     if type(arr) == BandsData:
                          new_nodes_list.append( (self._alpha_array_linkname, arr ))
-                    elif type(arr)==ArrayData:
+                    elif isinstance(arr, ArrayData): # ArrayData or CompressedArrayData
                         new_nodes_list.append((self._alpha_array_linkname+'_', arr ))
 
             else: 
@@ -235,7 +326,9 @@ class YamboParser(Parser):
                     pass
         # we store  all the information from the ndb.* files rather than in separate files
         # if possible, else we default to separate files.
-        if ndbqp and ndbhf:# 
+        if self._qp_compact:
+            new_nodes_list.extend(self._canonical_qp(ndbqp, ndbhf, qp_results, cell))
+        elif ndbqp and ndbhf:# 
             new_nodes_list.append((self._ndb_linkname, self._sigma_c(ndbqp,ndbhf)))
         else:
             if ndbqp:
@@ -243,12 +336,120 @@ class YamboParser(Parser):
             if ndbhf:
                  new_nodes_list.append((self._ndb_HF_linkname,self._aiida_ndb_hf(ndbhf)))
              
+        if parser_workers is not None and parser_workers.failures:
+            output_params['parser_failures'] = ['{}: {}'.format(filename, reason)
+                                                for filename, reason in parser_workers.failures]
+            output_params['warnings'].extend('could not parse ' + failure for failure in output_params['parser_failures'])
+        if timing_profile:
+            new_nodes_list.append((self._timing_array_linkname, self._aiida_timing(timing_profile)))
+        if len(memory_timeline[0]):
+            memory_array = ArrayData()
+            memory_array.set_array('time', memory_timeline[0]) # seconds, int32
+            memory_array.set_array('memory', memory_timeline[1]) # Gb, float32
+            new_nodes_list.append((self._memory_array_linkname, memory_array))
+        if len(ranks) > 1:
+            ranks_array, imbalance = self._aiida_ranks(ranks)
+            new_nodes_list.append((self._ranks_array_linkname, ranks_array))
+            output_params.update(imbalance)
+
         param = ParameterData(dict=output_params)
         new_nodes_list.append( (self._parameter_linkname, param) ) # output_parameters
 
         # successful=False -> Calc state = FAILED
         return successful, new_nodes_list
 
+    def _iter_results(self, results):
+        """
+        Parsed files of a (lazy) YamboFolder, one at a time
+        """
+        results = results.iter_results()
+        while True:
+            try:
+                result = next(results)
+            except StopIteration:
+                return
+            except Exception, e:
+                raise ParsingError("Unexpected behavior of YamboFolder: %s"%e)
+            yield result
+
+    def _qp_window(self, window, input_params):
+        """
+        QP window of the QP_WINDOW setting, list of (k1, k2, b1, b2) ranges:
+        given explicitly, or with True the QPkrange of the input parameters and the
+        k-points of QPerange (all bands, the energy bounds are not applied). None for no window.
+        """
+        if not window:
+            return None
+        if window is True:
+            window = [tuple(r) for r in input_params.get('QPkrange', [])]
+            window += [(r[0], r[1], 1, 2**31-1) for r in input_params.get('QPerange', [])]
+            if not window:
+                return None
+        return [tuple(int(i) for i in r) for r in window]
+
+    def _log_rank(self, result):
+        """
+        MPI rank of a LOG/l-*_CPU_N log, None for other files
+        """
+        if result.type != 'log':
+            return None
+        match = _rank_log.search(result.filename)
+        if match:
+            return int(match.group(1))
+        return None
+
+    def _aiida_ranks(self, ranks):
+        """
+        ArrayData with the per-rank wall time (last time stamp of the log, seconds), peak
+        memory (Gb) and time of the last memory allocation or release (seconds) from the
+        LOG/l-*_CPU_N logs, and the load imbalance metrics for output_parameters:
+        max/mean - 1 of wall time and peak memory, and the slowest rank, the one with the
+        longest wall time. The time of the last memory event (last_memory_event_time) is
+        only stored in its own array, it does not measure the activity of a rank and enters
+        no metric.
+        """
+        ranks = sorted(ranks)
+        rank = numpy.array([r[0] for r in ranks], dtype=numpy.int32)
+        # missing values (e.g. a rank that never allocated) are NaN
+        wall_time = numpy.array([r[1] for r in ranks], dtype=float)
+        peak_memory = numpy.array([r[2] for r in ranks], dtype=float)
+        last_memory_event_time = numpy.array([r[3] for r in ranks], dtype=float) # not a wall time
+        arraydata = ArrayData()
+        arraydata.set_array('rank', rank)
+        arraydata.set_array('wall_time', wall_time)
+        arraydata.set_array('peak_memory', peak_memory)
+        arraydata.set_array('last_memory_event_time', last_memory_event_time)
+
+        imbalance = {'ranks_parsed': len(rank)}
+        if numpy.any(numpy.isfinite(wall_time)):
+            imbalance['rank_wall_time_max'] = float(numpy.nanmax(wall_time))
+            imbalance['rank_wall_time_mean'] = float(numpy.nanmean(wall_time))
+            imbalance['rank_wall_time_imbalance'] = imbalance['rank_wall_time_max']/max(imbalance['rank_wall_time_mean'], 1e-12) - 1
+            imbalance['rank_wall_time_units'] = 'seconds'
+            imbalance['slowest_rank'] = int(rank[numpy.nanargmax(wall_time)])
+        if numpy.any(numpy.isfinite(peak_memory)):
+            imbalance['rank_memory_max'] = float(numpy.nanmax(peak_memory))
+            imbalance['rank_memory_mean'] = float(numpy.nanmean(peak_memory))
+            imbalance['rank_memory_imbalance'] = imbalance['rank_memory_max']/max(imbalance['rank_memory_mean'], 1e-12) - 1
+            imbalance['rank_memory_units'] = 'Gb'
+        return arraydata, imbalance
+
+    def _aiida_timing(self, profile):
+        """
+        ArrayData with the timing profile of the report: one row per section
+        (Timing [Min/Max/Average] lines) or routine (Clock: tables of the timing overview)
+          kind    : 'section' or 'routine', the sections overlap the routines they call
+          name    : names
+          calls   : number of calls (int32)
+          time    : [[min, mean, max],...] seconds (float32)
+        """
+        arraydata = ArrayData()
+        arraydata.set_array('kind', numpy.array([str(row[0]) for row in profile]))
+        arraydata.set_array('name', numpy.array([str(row[1]) for row in profile]))
+        arraydata.set_array('calls', numpy.array([row[2] for row in profile], dtype=numpy.int32))
+        arraydata.set_array('time', numpy.array([row[3:] for row in profile], dtype=numpy.float32))
+        return arraydata
+
     def _aiida_array(self, data):
         arraydata = ArrayData()
         for ky in data.keys():
@@ -256,64 +457,31 @@ class YamboParser(Parser):
         return arraydata 
 
     def _aiida_bands_data(self, data,cell,kpoints_dict):
-        if not data :
+        if not len(data):
             return False 
-        kpt_idx = sorted(data.keys()) #  list of kpoint indices 
-        try:
-            k_list = [ kpoints_dict[i] for i in kpt_idx ] # list of k-point triplet
-        except KeyError: 
-            # kpoint triplets are not present (true  for .qp and so on, can not use BandsData)
+        if isinstance(data, numpy.ndarray):
+            # o-*.qp table (structured array), kpoint triplets are not present, can not use BandsData.
             # We use the internal Yambo Format  [ [Eo_1, Eo_2,... ], ...[So_1,So_2,] ] 
-            #                                  QP_TABLE  [[ib_1,ik_1,isp_1]      ,[ib_n,ik_n,isp_n]]
+            #                                  QP_TABLE  [[ik_1,ib_1,isp_1]      ,[ik_n,ib_n,isp_n]]
             # Each entry in DATA has corresponding legend in QP_TABLE that defines its details
-            # like   ib= Band index,  ik= kpoint index,  isp= spin polarization index. 
-            #  Eo_1 =>  at ib_1, ik_1 isp_1.
-            pdata  = ArrayData()
-            QP_TABLE=[]
-            ORD= []
-            Eo =[] ; E_minus_Eo =[] ; So=[]; Z=[] ;  
-            for ky in data.keys(): # kp == kpoint index as a string  1,2,..
-                for ind in range(len( data[ky]['Band'])):
-                    try:
-                        Eo.append(data[ky]['Eo'][ind])
-                    except KeyError:
-                        pass
-                    try:
-                        E_minus_Eo.append(data[ky]['E-Eo'][ind])
-                    except KeyError:
-                        pass
-                    try:
-                        So.append(data[ky]['Sc|Eo'][ind])
-                    except KeyError:
-                        pass
-                    try:
-                        Z.append(data[ky]['Z'][ind])
-                    except KeyError:
-                        pass
-                    ik = int(ky)
-                    ib = data[ky]['Band'][ind]
-                    isp=0
-                    if 'Spin_Pol' in data[ky].keys():
-                        isp = data[ky]['Spin_Pol'][ind]
-                    QP_TABLE.append([ik, ib, isp])
-            pdata.set_array('Eo', numpy.array(Eo))
-            pdata.set_array('E_minus_Eo', numpy.array(E_minus_Eo))
-            pdata.set_array('So', numpy.array(So))
-            pdata.set_array('Z', numpy.array(Z))
-            pdata.set_array('qp_table', numpy.array(QP_TABLE))
-            return  pdata 
+            # like   ik= kpoint index,  ib= Band index,  isp= spin polarization index. 
+            #  Eo_1 =>  at ik_1, ib_1 isp_1.
+            return self._qp_arraydata(QPDataset.from_output(data))
+        kpt_idx = sorted(data.keys(), key=int) #  list of kpoint indices 
+        missing = [i for i in kpt_idx if i not in kpoints_dict]
+        if missing:
+            raise ParsingError("QP results for k-points {} that are not listed in the report".format(
+                               ', '.join('{}'.format(i) for i in missing)))
+        k_list = [ kpoints_dict[i] for i in kpt_idx ] # list of k-point triplet
         quasiparticle_bands = BandsData()
         quasiparticle_bands.set_cell(cell)
         quasiparticle_bands.set_kpoints(k_list, cartesian=True)
         # labels will come from any of the keys in the nested  kp_point data,
         # there is a uniform set of observables for each k-point, ie Band, Eo, ...
         # ***FIXME BUG does not seem to handle spin polarizes at all when constructing bandsdata***
-        bands_labels = [ legend for legend in sorted(data[data.keys()[0]].keys())]
-        append_list =[[] for i in bands_labels]
-        for kp in kpt_idx:
-            for i in range(len(bands_labels)):
-                append_list[i].append( data[kp][bands_labels[i]] )   
-        generalised_bands = [ numpy.array(it) for it in append_list  ]
+        bands_labels = sorted(data[kpt_idx[0]].keys())
+        # one (nkpoints, nbands) array per label
+        generalised_bands = [ numpy.array([data[kp][label] for kp in kpt_idx]) for label in bands_labels ]
         quasiparticle_bands.set_bands(bands=generalised_bands,
               units='eV', labels=bands_labels)
         return quasiparticle_bands 
@@ -322,24 +490,18 @@ class YamboParser(Parser):
         """
         Save the data from ndb.QP to the db
         """
-        pdata  = ArrayData()
-        pdata.set_array('Eo', numpy.array(data['Eo']))
-        pdata.set_array('E_minus_Eo', numpy.array(data['E-Eo']))
-        pdata.set_array('Z', numpy.array(data['Z']))
-        pdata.set_array('qp_table', numpy.array(data['qp_table']))
-        try:
-            pdata.set_array('So', numpy.array(data['So']))
-        except KeyError:
-            pass
-        return pdata
+        return self._qp_arraydata(QPDataset.from_ndb(data))
 
     def _aiida_ndb_hf(self, data ):
         """
         Save the data from ndb.HF_and_locXC  
         """
-        pdata  = ArrayData()
-        pdata.set_array('Sx', numpy.array(data['Sx']))
-        pdata.set_array('Vxc', numpy.array(data['Vxc']))
+        pdata = CompressedArrayData() if self._qp_compact else ArrayData()
+        for name in ('Sx', 'Vxc'):
+            values = data[name]
+            if self._qp_single:
+                values = values.astype(numpy.complex64 if values.dtype.kind == 'c' else numpy.float32)
+            pdata.set_array(name, values)
         return pdata
 
     def _sigma_c(self, ndbqp, ndbhf):
@@ -347,21 +509,40 @@ class YamboParser(Parser):
         Calculate S_c if missing from  information parsed from the  ndb.*
          Sc = 1/Z[ E-Eo] -S_x + Vxc
         """
-        Eo = numpy.array(ndbqp['E-Eo'])
-        Z =   numpy.array(ndbqp['Z'])
-        E_minus_Eo = numpy.array(ndbqp['E-Eo'])
-        Sx =  numpy.array(ndbhf['Sx'])
-        Vxc = numpy.array(ndbhf['Vxc'])
-        try:
-            Sc =  numpy.array(ndbqp['So'])
-        except KeyError:   
-            Sc = 1/Z*E_minus_Eo -Sx + Vxc 
-        pdata = ArrayData()
-        pdata.set_array('Eo', Eo)
-        pdata.set_array('E_minus_Eo', E_minus_Eo)
-        pdata.set_array('Z', Z)
-        pdata.set_array('Sx', Sx)
-        pdata.set_array('Sc', Sc)
-        pdata.set_array('Vxc', Vxc)
-        pdata.set_array('qp_table', numpy.array(ndbqp['qp_table']))
-        return pdata     
+        return self._qp_arraydata(QPDataset.from_ndb(ndbqp, ndbhf))
+
+    def _qp_arraydata(self, dataset):
+        """
+        Node of a QPDataset: int32 qp_table, observables in single precision with
+        QP_PRECISION single, CompressedArrayData with QP_STORAGE compact
+        """
+        arraydata = CompressedArrayData() if self._qp_compact else ArrayData()
+        return dataset.to_arraydata(arraydata, single_precision=self._qp_single)
+
+    def _canonical_qp(self, ndbqp, ndbhf, results, cell):
+        """
+        Output nodes of the QP results with QP_STORAGE compact: a single  array_qp  node
+        built from the richest source, in order ndb.QP with ndb.HF_and_locXC (adds Sx, Vxc, Sc),
+        ndb.QP, o-*.qp. The BandsData of the report is stored only if there is none of them,
+        ndb.HF_and_locXC without ndb.QP as array_ndb_HFlocXC.
+        """
+        nodes = []
+        dataset = None
+        if ndbqp:
+            dataset = QPDataset.from_ndb(ndbqp, ndbhf)
+        else:
+            if ndbhf:
+                nodes.append((self._ndb_HF_linkname, self._aiida_ndb_hf(ndbhf)))
+            for result in results:
+                if isinstance(result.data, numpy.ndarray) and len(result.data): # o-*.qp
+                    dataset = QPDataset.from_output(result.data)
+                    break
+        if dataset is not None:
+            nodes.append((self._qp_array_linkname, self._qp_arraydata(dataset)))
+            return nodes
+        for result in results:
+            arr = self._aiida_bands_data(result.data, cell, result.kpoints)
+            if isinstance(arr, BandsData):
+                nodes.append((self._quasiparticle_bands_linkname, arr))
+                break
+        return nodes
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Array backed container for the quasiparticle results of a yambo calculation,
+shared by the parser and the workflows.
+"""
+import numpy
+
+class QPDataset(object):
+    """
+    Quasiparticle results stored as contiguous NumPy arrays, one row per
+    (k-point, band, spin) state:
+      .kpoint, .band, .spin : int32 indices (spin is 0 if not spin polarized)
+      .observables          : dict name: array with one value per row
+                              (Eo, E_minus_Eo, Z, So, Sx, Vxc, Sc, ...)
+    A dense (kpoint, band, spin) -> row index is built once, so lookups are O(1)
+    and can be vectorised over arrays of states.
+
+    In ArrayData nodes the indices are stored as the  qp_table  int32 array [[ik,ib,isp],...]
+    and each observable as an array with the same name, optionally in single precision.
+    The layout is marked by the qp_layout attribute of the node; the nodes written before
+    have none and their columns are given by the output link (see from_calculation).
+    """
+    _qp_table_name = 'qp_table'
+    _layout_attribute = 'qp_layout'
+    _layout_version = 1 # qp_table columns kpoint, band, spin
+    # (kpoint, band, spin) columns of the qp_table of the nodes without layout marker, by output
+    # link: the ndb.* nodes stored the QP_table of the database without its first column
+    _legacy_columns = {'array_qp': (0, 1, 2), 'array_ndb': (1, 0, 2), 'array_ndb_QP': (1, 0, 2)}
+    # output links holding QP results, in order of preference
+    _qp_linknames = ['array_qp', 'array_ndb', 'array_ndb_QP']
+    # storage type of the observables in single precision
+    _single_precision = {'f': numpy.float32, 'c': numpy.complex64}
+
+    def __init__(self, kpoint, band, spin=None, **observables):
+        self.kpoint = numpy.ascontiguousarray(kpoint, dtype=numpy.int32)
+        self.band = numpy.ascontiguousarray(band, dtype=numpy.int32)
+        if spin is None:
+            self.spin = numpy.zeros(len(self.kpoint), dtype=numpy.int32)
+        else:
+            self.spin = numpy.ascontiguousarray(spin, dtype=numpy.int32)
+        if not len(self.kpoint) == len(self.band) == len(self.spin):
+            raise ValueError("kpoint, band and spin indices must have the same length")
+        self.observables = {}
+        for name, values in observables.items():
+            self.set_observable(name, values)
+        self._build_index()
+
+    def __len__(self):
+        return len(self.kpoint)
+
+    def _build_index(self):
+        """ Dense lookup table (kpoint, band, spin) -> row, -1 for missing states
+        """
+        if not len(self):
+            self._offset = numpy.zeros(3, dtype=numpy.int64)
+            self._index = numpy.zeros((0, 0, 0), dtype=numpy.int32)
+            return
+        indices = (self.kpoint, self.band, self.spin)
+        self._offset = numpy.array([idx.min() for idx in indices], dtype=numpy.int64)
+        shape = [int(idx.max() - low + 1) for idx, low in zip(indices, self._offset)]
+        self._index = numpy.full(shape, -1, dtype=numpy.int32)
+        self._index[self.kpoint - self._offset[0], self.band - self._offset[1],
+                    self.spin - self._offset[2]] = numpy.arange(len(self), dtype=numpy.int32)
+
+    def set_observable(self, name, values):
+        """ Add (or replace) an observable, with one value per row
+        """
+        values = numpy.ascontiguousarray(values)
+        if len(values) != len(self):
+            raise ValueError("observable {} has {} values for {} states".format(name, len(values), len(self)))
+        self.observables[name] = values
+
+    @property
+    def kpoints(self):
+        """ Sorted k-point indices present in the dataset
+        """
+        return numpy.unique(self.kpoint)
+
+    @property
+    def bands(self):
+        """ Sorted band indices present in the dataset
+        """
+        return numpy.unique(self.band)
+
+    @property
+    def spins(self):
+        """ Sorted spin indices present in the dataset
+        """
+        return numpy.unique(self.spin)
+
+    def row(self, kpoint, band, spin=None):
+        """ Row(s) of the given state(s), -1 where the state is not present.
+            Arguments can be scalars or arrays, spin defaults to the first spin channel.
+        """
+        if spin is None:
+            spin = self._offset[2]
+        k, b, s = numpy.broadcast_arrays(numpy.asarray(kpoint, dtype=numpy.int64) - self._offset[0],
+                                         numpy.asarray(band, dtype=numpy.int64) - self._offset[1],
+                                         numpy.asarray(spin, dtype=numpy.int64) - self._offset[2])
+        rows = numpy.full(k.shape, -1, dtype=numpy.int32)
+        valid = (k >= 0) & (b >= 0) & (s >= 0)
+        shape = self._index.shape
+        valid &= (k < shape[0]) & (b < shape[1]) & (s < shape[2])
+        rows[valid] = self._index[k[valid], b[valid], s[valid]]
+        if rows.ndim == 0:
+            return int(rows)
+        return rows
+
+    def get(self, name, kpoint, band, spin=None):
+        """ Value(s) of an observable at the given state(s)
+        """
+        rows = self.row(kpoint, band, spin)
+        if numpy.any(numpy.asarray(rows) < 0):
+            raise KeyError("state (k={}, b={}, spin={}) not found".format(kpoint, band, spin))
+        return self[name][rows]
+
+    def __getitem__(self, name):
+        if name == 'E' and name not in self.observables:
+            return self.qp_energies()
+        return self.observables[name]
+
+    def qp_energies(self):
+        """ Quasiparticle energies, E = Eo + (E-Eo)
+        """
+        return self.observables['Eo'] + self.observables['E_minus_Eo']
+
+    def band_energies(self, band, spin=None, name='E'):
+        """ k-point indices and values of an observable (QP energies by default) for one band
+        """
+        if spin is None:
+            spin = self._offset[2]
+        kpoints = numpy.arange(self._index.shape[0]) + self._offset[0]
+        rows = self.row(kpoints, band, spin)
+        present = rows >= 0
+        return kpoints[present], self[name][rows[present]]
+
+    def bandwidth(self, band, spin=None, name='E'):
+        """ Width (max - min over k-points) of a band
+        """
+        values = self.band_energies(band, spin, name)[1].real
+        return values.max() - values.min()
+
+    def gap(self, low_band, high_band, spin=None, direct=False, name='E'):
+        """ Gap between two bands: indirect (min of high_band - max of low_band)
+            or direct (smallest difference at the same k-point)
+        """
+        k_low, e_low = self.band_energies(low_band, spin, name)
+        k_high, e_high = self.band_energies(high_band, spin, name)
+        if not direct:
+            return e_high.real.min() - e_low.real.max()
+        common = numpy.intersect1d(k_low, k_high)
+        e_low = e_low[numpy.searchsorted(k_low, common)]
+        e_high = e_high[numpy.searchsorted(k_high, common)]
+        return (e_high - e_low).real.min()
+
+    def transition(self, kpoint_low, band_low, kpoint_high, band_high, name='E'):
+        """ Difference of an observable (QP energies by default) between two states,
+            one value for each spin channel present at both states.
+        """
+        values = []
+        for spin in self.spins:
+            low = self.row(kpoint_low, band_low, spin)
+            high = self.row(kpoint_high, band_high, spin)
+            if low >= 0 and high >= 0:
+                values.append(self[name][high] - self[name][low])
+        return numpy.array(values)
+
+    def missing_states(self, ranges):
+        """ Number of the states of the (k1, k2, b1, b2) ranges, as in QPkrange, that are not
+            in the dataset (in the first spin channel)
+        """
+        missing = 0
+        for k1, k2, b1, b2 in ranges:
+            kpoint, band = numpy.meshgrid(numpy.arange(int(k1), int(k2) + 1),
+                                          numpy.arange(int(b1), int(b2) + 1), indexing='ij')
+            missing += int(numpy.count_nonzero(self.row(kpoint.ravel(), band.ravel()) < 0))
+        return missing
+
+    def qp_table(self):
+        """ [[ik,ib,isp],...] table of the indices
+        """
+        return numpy.column_stack((self.kpoint, self.band, self.spin))
+
+    def to_arraydata(self, arraydata=None, single_precision=False):
+        """ Store the dataset in an (unstored) ArrayData node, with single_precision
+            the real observables as float32 and the complex ones as complex64
+        """
+        if arraydata is None:
+            from aiida.orm.data.array import ArrayData
+            arraydata = ArrayData()
+        arraydata.set_array(self._qp_table_name, self.qp_table())
+        arraydata._set_attr(self._layout_attribute, self._layout_version)
+        for name, values in self.observables.items():
+            if single_precision and values.dtype.kind in self._single_precision:
+                values = values.astype(self._single_precision[values.dtype.kind])
+            arraydata.set_array(name, values)
+        return arraydata
+
+    @classmethod
+    def from_arraydata(cls, arraydata, legacy_columns=None):
+        """ Read the dataset back from an ArrayData node written by to_arraydata.
+            A node without layout marker, stored before QPDataset, is read with the
+            (kpoint, band, spin) qp_table columns legacy_columns, ValueError without them.
+        """
+        version = arraydata.get_attr(cls._layout_attribute, None)
+        if version == cls._layout_version:
+            columns = (0, 1, 2)
+        elif version is not None:
+            raise ValueError("unknown layout {} of the QP results of node {}".format(version, arraydata.pk))
+        elif legacy_columns is None:
+            raise ValueError("the QP results of node {} were stored before QPDataset, the layout of "
+                             "their qp_table must be given".format(arraydata.pk))
+        else:
+            columns = legacy_columns
+        table = arraydata.get_array(cls._qp_table_name)
+        observables = {}
+        for name in arraydata.get_arraynames():
+            if name == cls._qp_table_name:
+                continue
+            values = arraydata.get_array(name)
+            if len(values) == len(table):
+                observables[name] = values
+        if table.shape[1] > columns[2]:
+            spin = table[:,columns[2]]
+        else: # not spin polarized
+            spin = None
+        return cls(table[:,columns[0]], table[:,columns[1]], spin, **observables)
+
+    @classmethod
+    def from_output(cls, records):
+        """ Build the dataset from the structured array of an o-*.qp file (YamboFile.data)
+        """
+        observables = dict((name, records[name]) for name in records.dtype.names
+                           if name not in ('kpoint', 'band', 'spin'))
+        return cls(records['kpoint'], records['band'], records['spin'], **observables)
+
+    @classmethod
+    def from_ndb(cls, ndbqp, ndbhf=None):
+        """ Build the dataset from the data of ndb.QP (and optionally ndb.HF_and_locXC),
+            as parsed by YamboFile. With the HF data Sx, Vxc and the correlation part
+            of the self energy  Sc = 1/Z[ E-Eo] -S_x + Vxc  (if not in ndb.QP) are added.
+        """
+        observables = {'Eo': ndbqp['Eo'], 'E_minus_Eo': ndbqp['E-Eo'], 'Z': ndbqp['Z']}
+        if 'So' in ndbqp:
+            observables['So'] = ndbqp['So']
+        dataset = cls(ndbqp['Kpoint_index'], ndbqp['Band'], ndbqp.get('Spin_pol'), **observables)
+        if ndbhf:
+            rows = None
+            if 'Kpoint_index' in ndbhf:
+                spin = ndbhf.get('Spin_pol') if 'Spin_pol' in ndbqp else None
+                rows = dataset.row(ndbhf['Kpoint_index'], ndbhf['Band'], spin)
+                rows = numpy.where(ndbhf['Band'] == ndbhf.get('Band_p', ndbhf['Band']), rows, -1)
+            for name in ('Sx', 'Vxc'):
+                if rows is None:
+                    dataset.set_observable(name, ndbhf[name])
+                else:
+                    values = numpy.zeros(len(dataset), dtype=ndbhf[name].dtype)
+                    values[rows[rows >= 0]] = ndbhf[name][rows >= 0]
+                    dataset.set_observable(name, values)
+            if 'So' in ndbqp:
+                dataset.set_observable('Sc', ndbqp['So'])
+            else:
+                dataset.set_observable('Sc', 1/dataset['Z']*dataset['E_minus_Eo'] - dataset['Sx'] + dataset['Vxc'])
+        return dataset
+
+    @classmethod
+    def from_calculation(cls, calc):
+        """ Dataset from the QP output node of a (parsed) YamboCalculation, None if there is none
+        """
+        outputs = calc.get_outputs_dict()
+        for linkname in cls._qp_linknames:
+            if linkname in outputs:
+                return cls.from_arraydata(outputs[linkname], cls._legacy_columns[linkname])
+        return None
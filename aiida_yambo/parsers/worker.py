@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Parsing of yambo files in separate worker processes, out of the AiiDA daemon.
+
+    python -m aiida_yambo.parsers.worker <folder> <filename> <output> [<qp_window> [<size_budgets> [<max_warnings>]]]
+
+parses one file and writes its parsed state (see YamboFile.get_state) pickled to <output>.
+The optional QP window, size budgets and number of warnings stored are given as JSON,
+e.g. [[1,4,8,9]], {"log": 1048576} and 100, null for none.
+"""
+import json
+import mmap
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from aiida_yambo.parsers.ext_dep.yambofile import YamboFile
+from aiida_yambo.parsers.ext_dep.yambofolder import _parse_file, cache_version
+
+class ParseWorkerPool(object):
+    """
+    Executor for YamboFolder that parses the large files in separate worker processes.
+
+    Every file bigger than min_size (bytes) is parsed by a new  python -m aiida_yambo.parsers.worker
+    subprocess, at most processes at a time. A worker is killed after timeout seconds or when
+    its resident memory (RSS) exceeds memory_limit bytes, so a pathological file can not stall
+    or exhaust the daemon; only the compact parsed state comes back. Smaller files, and the
+    ones found in the cache, are handled in the calling process.
+    The resident memory is read from /proc at every poll of the workers, so the limit does not
+    count the memory mapped netCDF databases that were not read, nor the address space reserved
+    by NumPy and the allocator. Where /proc is not available the limit is applied to the address
+    space of the worker instead (RLIMIT_AS), which does count them: it must then be larger than
+    the netCDF files parsed.
+    Subprocesses are used instead of multiprocessing, which can not fork from the daemonic
+    processes of the AiiDA daemon.
+
+    The files that could not be parsed are yielded as None and listed in failures as
+    (filename, reason).
+    """
+    _poll_interval = 0.02
+
+    def __init__(self, processes=1, timeout=None, memory_limit=None, min_size=1024*1024):
+        self.processes = max(1, processes or 1)
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.min_size = min_size
+        self.failures = []
+
+    def __call__(self, tasks):
+        """ Yield the YamboFile of each (filename, dirname, release, cache, qp_window, size_budgets,
+            max_warnings) task, in order
+        """
+        workdir = tempfile.mkdtemp()
+        running = {} # index -> (process, output file, start time, task)
+        done = {} # index -> YamboFile or None
+        pending = list(enumerate(tasks))
+        try:
+            for index in range(len(tasks)):
+                while index not in done:
+                    # start workers for the next tasks, parse inline what does not need one
+                    while pending and len(running) < self.processes:
+                        position, task = pending.pop(0)
+                        yambofile = self._inline(task)
+                        if yambofile is False:
+                            running[position] = self._start(task, position, workdir)
+                        else:
+                            done[position] = yambofile
+                        if position == index:
+                            break
+                    self._collect(running, done)
+                    if index not in done:
+                        time.sleep(self._poll_interval)
+                yield done.pop(index)
+        finally:
+            for process, output, start, task in running.values():
+                process.kill()
+                process.wait()
+            shutil.rmtree(workdir)
+
+    def _inline(self, task):
+        """ Parsed file if it does not need a worker (cached or small), else False
+        """
+        filename, dirname, release, cache, qp_window, size_budgets, max_warnings = task
+        if cache is not None:
+            state = cache.get(cache.key(filename, dirname, cache_version(qp_window, size_budgets, max_warnings)))
+            if state is not None:
+                return YamboFile.from_state(filename, state, folder=dirname)
+        if os.path.getsize(os.path.join(dirname, filename)) < self.min_size:
+            return _parse_file(task)
+        return False
+
+    def _start(self, task, position, workdir):
+        filename, dirname, release, cache, qp_window, size_budgets, max_warnings = task
+        output = os.path.join(workdir, '%d.pickle'%position)
+        options = [[list(r) for r in qp_window] if qp_window else None, size_budgets or None, max_warnings]
+        while options and options[-1] is None: # trailing nulls are left out
+            options.pop()
+        arguments = [dirname, filename, output] + [json.dumps(option) for option in options]
+        with open(output + '.err', 'w') as stderr:
+            process = subprocess.Popen([sys.executable, '-m', 'aiida_yambo.parsers.worker'] + arguments,
+                                       stdout=stderr, stderr=stderr, preexec_fn=self._limits)
+        return process, output, time.time(), task
+
+    def _limits(self):
+        """ Run in the worker before exec: limit its address space if its resident memory
+            can not be watched
+        """
+        if self.memory_limit and not _has_proc:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (self.memory_limit, self.memory_limit))
+
+    def _collect(self, running, done):
+        """ Move the finished (or timed out) workers from running to done
+        """
+        for position in list(running):
+            process, output, start, task = running[position]
+            filename, dirname, release, cache, qp_window, size_budgets, max_warnings = task
+            if process.poll() is None:
+                reason = None
+                if self.timeout and time.time() - start > self.timeout:
+                    reason = 'timeout after {} s'.format(self.timeout)
+                elif self.memory_limit and (_resident_memory(process.pid) or 0) > self.memory_limit:
+                    reason = 'resident memory above {:.1f} MB'.format(self.memory_limit/1024.0/1024.0)
+                if reason is not None:
+                    process.kill()
+                    process.wait()
+                    self.failures.append((filename, reason))
+                    done[position] = None
+                    del running[position]
+                continue
+            del running[position]
+            if process.returncode != 0:
+                with open(output + '.err') as fl:
+                    lines = fl.read().strip().splitlines()
+                reason = lines[-1] if lines else 'worker exited with code {}'.format(process.returncode)
+                self.failures.append((filename, reason))
+                done[position] = None
+                continue
+            with open(output, 'rb') as fl:
+                state = pickle.load(fl)
+            if cache is not None and state['type'] != 'unknown':
+                cache.put(cache.key(filename, dirname, cache_version(qp_window, size_budgets, max_warnings)), state)
+            done[position] = YamboFile.from_state(filename, state, folder=dirname)
+
+_has_proc = os.path.exists('/proc/self/statm')
+
+def _resident_memory(pid):
+    """ Resident memory (bytes) of a running process, None if it can not be read
+    """
+    try:
+        with open('/proc/%d/statm'%pid) as fl:
+            return int(fl.read().split()[1])*mmap.PAGESIZE
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+def main(folder, filename, output, qp_window=None, size_budgets=None, max_warnings=None):
+    """ Parse a file and write its pickled state to output
+    """
+    if qp_window is not None:
+        qp_window = json.loads(qp_window)
+        if qp_window is not None:
+            qp_window = [tuple(r) for r in qp_window]
+    if size_budgets is not None:
+        size_budgets = json.loads(size_budgets)
+    if max_warnings is not None:
+        max_warnings = json.loads(max_warnings)
+    yambofile = YamboFile(filename, folder=folder, qp_window=qp_window, size_budgets=size_budgets,
+                          max_warnings=max_warnings)
+    with open(output, 'wb') as fl:
+        pickle.dump(yambofile.get_state(), fl, 2)
+
+if __name__ == "__main__":
+    main(*sys.argv[1:7])
@@ -15,6 +15,8 @@ from aiida.orm.data.structure import StructureData
 from aiida.work.run import run, submit
 from aiida.work.workchain import WorkChain, while_, ToContext, Outputs
 from aiida_yambo.calculations.gw  import YamboCalculation
+from aiida_yambo.calculations.screening import screening_compatible, reuse_screening
+from aiida.common.datastructures import calc_states
 from aiida.common.links import LinkType
 from aiida_yambo.workflows.yambo_utils import default_step_size, update_parameter_field, set_default_qp_param,\
                default_pw_settings, set_default_pw_param, yambo_default_settings, default_qpkrange, p2y_default_settings
@@ -23,6 +25,7 @@ from aiida_yambo.workflows.yambowf  import YamboWorkflow
 from aiida.orm.data.remote import RemoteData
 from aiida_quantumespresso.calculations.pw import PwCalculation
 from aiida_yambo.calculations.gw  import YamboCalculation
+from aiida_yambo.parsers.qpdataset import QPDataset
 import numpy as np 
 from scipy.optimize import  curve_fit 
 
@@ -261,7 +264,7 @@ class YamboConvergenceWorkflow(WorkChain):
                             yambocode=self.inputs.yambocode.copy(),
                             parameters = self.inputs.parameters.copy(),
                             calculation_set= self.inputs.calculation_set.copy(),
-                            parent_folder = self.ctx.p2y_parent_folder, settings = self.inputs.settings.copy())
+                            parent_folder = self.screening_parent(self.inputs.parameters), settings = self.inputs.settings.copy())
                 outs[ 'r'+str(num) ] =  future
             self.report (" waiting  for result of YamboRestartWf ")
             return ToContext(**outs )
@@ -299,6 +302,24 @@ class YamboConvergenceWorkflow(WorkChain):
             return ToContext(**outs )  
         return outs 
 
+    def screening_parent(self, parameters):
+        """
+        Parent folder of the next calculation: a finished calculation of the previous
+        iteration whose screening databases can be reused with parameters (see
+        screening_compatible), else the p2y folder, always with a false REUSE_SCREENING
+        setting (see reuse_screening).
+        """
+        if reuse_screening(self.inputs.settings.get_dict()):
+            for name in ('r0', 'r1', 'r2', 'r3', 'r4'):
+                try:
+                    calc = load_node(getattr(self.ctx, name).out.gw.get_dict()['yambo_pk'])
+                except (AttributeError, KeyError):
+                    continue
+                if calc.get_state() == calc_states.FINISHED and \
+                        screening_compatible(calc.inp.parameters.get_dict(), parameters.get_dict()):
+                    return calc.out.remote_folder
+        return self.ctx.p2y_parent_folder
+
     def interstep(self):
         self.report("interstep() ", self.ctx.r0)
         return
@@ -383,7 +404,7 @@ class YamboConvergenceWorkflow(WorkChain):
         #         i.e. for 'QPkrange': [(1,16,30,31)] , will find width between 
         #         kpoint 1  band 30 and kpoint  1 band 31. 
         calc = load_node(node_id)
-        table=calc.out.array_qp.get_array('qp_table')
+        qp = QPDataset.from_calculation(calc)
         try:
             qprange = calc.inp.parameters.get_dict()['QPkrange']
         except KeyError: 
@@ -404,24 +425,15 @@ class YamboConvergenceWorkflow(WorkChain):
         lowest_k = qprange[0][0] # first kpoint listed, 
         lowest_b = qprange[0][-2] # first band on first kpoint listed,
         highest_b= qprange[0][-1]  # last band on first kpoint listed,
-        argwlk = np.argwhere(table[:,0]==float(lowest_k))  # indexes for lowest kpoint
-        argwlb = np.argwhere(table[:,1]==float(lowest_b))  # indexes for lowest band
-        argwhb = np.argwhere(table[:,1]==float(highest_b)) # indexes for highest band
-        if len(argwlk)< 1:
-            argwlk = np.array([0])
-        if len(argwhb) < 1:
-            argwhb = np.argwhere(table[:,1]== table[:,1][np.argmax(table[:,1])])
-            argwlb = np.argwhere(table[:,1]== table[:,1][np.argmax(table[:,1])]-1 )
-        arglb = np.intersect1d(argwlk,argwlb)              # index for lowest kpoints' lowest band
-        arghb = np.intersect1d(argwlk,argwhb)              # index for lowest kpoint's highest band
-        e_m_eo = calc.out.array_qp.get_array('E_minus_Eo') 
-        eo = calc.out.array_qp.get_array('Eo')
-        corrected = eo+e_m_eo
-        corrected_lb = corrected[arglb]
-        corrected_hb = corrected[arghb]
-        self.report(" corrected gap(s)   at K-point {}, between bands {} and {}".format(
-                    corrected_hb- corrected_lb, lowest_k, lowest_b, highest_b ))
-        return (corrected_hb- corrected_lb)[0]  # for spin polarized there will be two almost equivalent, else just one value.
+        if lowest_k not in qp.kpoints:
+            lowest_k = qp.kpoint[0]
+        if highest_b not in qp.bands:
+            highest_b = qp.bands[-1]
+            lowest_b = highest_b - 1
+        gaps = qp.transition(lowest_k, lowest_b, lowest_k, highest_b)
+        self.report(" corrected gap(s) {}  at K-point {}, between bands {} and {}".format(
+                    gaps, lowest_k, lowest_b, highest_b ))
+        return gaps[0]  # for spin polarized there will be two almost equivalent, else just one value.
 
     def report_wf(self):
         """
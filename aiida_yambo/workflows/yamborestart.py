@@ -1,3 +1,4 @@
+import os
 import sys
 from aiida.backends.utils import load_dbenv, is_dbenv_loaded
 
@@ -21,6 +22,10 @@ from aiida.orm.code import Code
 from aiida.orm.data.structure import StructureData
 from aiida_yambo.calculations.gw  import YamboCalculation
 from aiida_yambo.workflows.yambo_utils import generate_yambo_input_params, reduce_parallelism 
+from aiida_yambo.parsers.ext_dep.yambofile import scan_log_tail
+from aiida_yambo.calculations.savepool import inputs_pool_key, find_pool
+from aiida_yambo.calculations.fingerprint import input_fingerprint, find_cached_calculation
+from aiida_yambo.parsers.qpdataset import QPDataset
 from aiida_quantumespresso.calculations.pw import PwCalculation
 
 #PwCalculation = CalculationFactory('quantumespresso.pw')
@@ -72,22 +77,40 @@ class YamboRestartWf(WorkChain):
         self.ctx.last = ''
         parameters = self.inputs.parameters
         new_settings = self.inputs.settings.get_dict()
-        parent_calc = self.inputs.parent_folder.get_inputs_dict(link_type=LinkType.CREATE)['remote_folder']
+        parent_folder = self.inputs.parent_folder
+        parent_calc = parent_folder.get_inputs_dict(link_type=LinkType.CREATE)['remote_folder']
         yambo_parent = isinstance(parent_calc, YamboCalculation)
+        if not yambo_parent and new_settings.get('SAVE_POOL') and 'INITIALISE' not in new_settings.keys():
+            # start from the p2y initialisation of this NSCF already in the pool, if any: the
+            # key is the one of the inputs the initialisation would be submitted with
+            inputs = generate_yambo_input_params(
+                self.inputs.precode.copy(),self.inputs.yambocode.copy(),
+                parent_folder, parameters, self.inputs.calculation_set.copy(), ParameterData(dict=new_settings) )
+            pool = find_pool(inputs_pool_key(inputs.parent_folder, inputs.preprocessing_code,
+                                             inputs.precode_parameters if 'precode_parameters' in inputs else None,
+                                             inputs.settings))
+            if pool is not None:
+                self.report("using the SAVE pool of calculation {}".format(
+                            pool.get_inputs_dict(link_type=LinkType.CREATE)['remote_folder'].pk))
+                parent_folder = pool
+                yambo_parent = True
         if 'INITIALISE' not in new_settings.keys() and not yambo_parent:
             new_settings['INITIALISE'] = True
             self.ctx.last = 'INITIALISE'
         inputs = generate_yambo_input_params(
             self.inputs.precode.copy(),self.inputs.yambocode.copy(),
-            self.inputs.parent_folder, parameters, self.inputs.calculation_set.copy(), ParameterData(dict=new_settings) )
+            parent_folder, parameters, self.inputs.calculation_set.copy(), ParameterData(dict=new_settings) )
         future = self.run_yambo(inputs)
+        if isinstance(future, YamboCalculation): # reused a finished calculation
+            self.ctx.yambo = future
+            return
         return  ResultToContext(yambo= future)
 
     def interstep(self):
         # convenience function that stores output of resolved future  before the next loop if any, 
         # of no loop will run, it is still useful for the report_wf to find the resolved future's node
-        # in the context. 
-        self.yambo_nodes.append(self.ctx.yambo)
+        # in the context. It runs after yambo_restart, whose calculation is the latest one
+        self.ctx.yambo_nodes.append(self.ctx.yambo_restart)
 
     def yambo_should_restart(self):
         # should restart a calculation if it satisfies either
@@ -110,13 +133,24 @@ class YamboRestartWf(WorkChain):
             self.report("workflow  will not resubmit calk pk: {}, submission failed: {}, check the log or you settings ".format(calc.pk ,calc.get_state() ))
             return False
 
+        if calc.get_state() == calc_states.FINISHED and self.inputs.settings.get_dict().get('RESTART_INCOMPLETE_QP', False) \
+                and calc.inp.parameters.get_dict().get('gw0') is True:
+            missing = self.missing_qp_states(calc)
+            if missing:
+                self.report("Calculation {} finished without {} of the requested quasiparticle states, restarting".format(
+                            calc.pk, missing))
+                return True
+
         max_input_seconds = self.inputs.calculation_set.get_dict()['max_wallclock_seconds']
 
         last_time = 30 # seconds default value:
         try:
             last_time = calc.get_outputs_dict()['output_parameters'].get_dict()['last_time']  
         except Exception:
-            pass  # Likely no logs were produced 
+            # no parsed output: read the trailing state from the end of the retrieved log
+            log_state = self.log_tail_state(calc)
+            if log_state.get('last_time'):
+                last_time = log_state['last_time']
  
         if calc.get_state() == calc_states.FAILED and (float(max_input_seconds)-float(last_time))/float(max_input_seconds)*100.0 < 1:   
             max_input_seconds = int( max_input_seconds * 1.3) # 30% increase
@@ -131,6 +165,8 @@ class YamboRestartWf(WorkChain):
             output_p = {}
             if 'output_parameters'  in  calc.get_outputs_dict(): # calc.get_outputs_dict()['output_parameters'].get_dict().keys() 
                 output_p = calc.get_outputs_dict()['output_parameters'].get_dict()
+            else:
+                output_p = self.log_tail_state(calc)
             if 'para_error' in output_p.keys(): 
                 if output_p['para_error'] == True:  # Change parallelism or add missing parallelism inputs
                     params = self.inputs.parameters.get_dict() 
@@ -168,11 +204,11 @@ class YamboRestartWf(WorkChain):
                     return True 
                    
             if 'errors' in output_p.keys() and calc.get_state() == calc_states.FAILED:
-                if len(calc.get_outputs_dict()['output_parameters'].get_dict()['errors']) < 1:
+                if len(output_p['errors']) < 1:
                     # No errors, We  check for memory issues, indirectly
-                    if 'last_memory_time' in calc.get_outputs_dict()['output_parameters'].get_dict().keys():
+                    if 'last_memory_time' in output_p.keys():
                         # check if the last alloc happened close to the end:
-                        last_mem_time = calc.get_outputs_dict()['output_parameters'].get_dict()['last_memory_time']
+                        last_mem_time = output_p['last_memory_time']
                         if  abs(last_time - last_mem_time) < 3: # 3 seconds  selected arbitrarily,
                             # this is (based on a simple heuristic guess, a memory related problem)
                             # change the parallelization to account for this before continuing, warn user too.
@@ -202,6 +238,30 @@ class YamboRestartWf(WorkChain):
             return True
         return False
 
+    def log_tail_state(self, calc):
+        """
+        last_time, last_memory_time, errors and the para_error/unphysical_input flags
+        of the main log of a calculation, read only from the beginning and the end
+        of the retrieved l-* file (see scan_log_tail); {} if there is no log.
+        """
+        try:
+            retrieved = calc.get_retrieved_node()
+            logs = sorted(name for name in retrieved.get_folder_list() if name.startswith('l-'))
+        except Exception:
+            return {}
+        if not logs:
+            return {}
+        # the log of the master process if retrieved, else the one of the first CPU
+        main_logs = [name for name in logs if '_CPU_' not in name] or logs
+        scanner = scan_log_tail(os.path.join(retrieved.get_abs_path(), main_logs[0]))
+        state = {'errors': scanner.errors, 'para_error': scanner.para_error,
+                 'unphysical_input': scanner.unphysical_input}
+        if scanner.last_time is not None:
+            state['last_time'] = scanner.last_time
+        if scanner.last_memory_time is not None:
+            state['last_memory_time'] = scanner.last_memory_time
+        return state
+
     def yambo_restart(self):
         # restart if neccessary
         # get inputs from prior calculation ctx.yambo_pks
@@ -233,12 +293,22 @@ class YamboRestartWf(WorkChain):
              self.inputs.precode.copy(),self.inputs.yambocode.copy(),
              parent_folder, ParameterData(dict=parameters), self.inputs.calculation_set.copy(), ParameterData(dict=new_settings) )
         future = self.run_yambo(inputs)
-        self.ctx.yambo_pks.append(future.pid )
         self.ctx.restart += 1
+        if isinstance(future, YamboCalculation): # reused a finished calculation
+            self.ctx.yambo_restart = future
+            return
+        self.ctx.yambo_pks.append(future.pid )
         self.report(" restarting from:{}  ".format(future.pid )) 
         return ResultToContext(yambo_restart= future)
 
     def run_yambo(self,inputs):
+        # a finished calculation with the same inputs is reused instead of submitting a new one,
+        # it is returned in place of the future
+        cached = self.cached_calculation(inputs)
+        if cached is not None:
+            self.ctx.yambo_pks.append(cached.pk)
+            self.report(" reusing the finished calculation with pk: {}, same inputs".format(cached.pk))
+            return cached
         YamboProcess = YamboCalculation.process()
         future =  submit(YamboProcess, **inputs)
         self.ctx.yambo_pks.append( future.pid )
@@ -246,6 +316,35 @@ class YamboRestartWf(WorkChain):
         return future  # we can not  ReturnToContext since this fuction is not called from the outline 
 
 
+    def cached_calculation(self, inputs):
+        """
+        Finished YamboCalculation with the same input fingerprint as inputs (see
+        aiida_yambo.calculations.fingerprint), None if there is none or the
+        REUSE_CALCULATIONS setting is False
+        """
+        settings = inputs.settings.get_dict()
+        if not settings.get('REUSE_CALCULATIONS', True):
+            return None
+        parameters = inputs.parameters.get_dict() if 'parameters' in inputs else None
+        preprocessing_code = inputs.preprocessing_code if 'preprocessing_code' in inputs else None
+        precode_parameters = inputs.precode_parameters.get_dict() if 'precode_parameters' in inputs else None
+        return find_cached_calculation(input_fingerprint(parameters, settings, inputs.code,
+                                       inputs.parent_folder, preprocessing_code, precode_parameters))
+
+    def missing_qp_states(self, calc):
+        """
+        Number of the QPkrange states missing from the QP results of a finished calculation
+        (see QPDataset.missing_states), 0 if only the BandsData of the report is available,
+        at least 1 if there are no QP results at all
+        """
+        qprange = calc.inp.parameters.get_dict().get('QPkrange', [])
+        qp = QPDataset.from_calculation(calc)
+        if qp is not None:
+            return qp.missing_states(qprange)
+        if 'bands_quasiparticle' in calc.get_outputs_dict():
+            return 0
+        return max(1, sum((r[1] - r[0] + 1)*(r[3] - r[2] + 1) for r in qprange))
+
     def get_last_submitted(self, pk):
         submited = False
         depth = 0
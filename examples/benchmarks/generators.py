@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Generators of synthetic yambo outputs for the parser benchmarks:
+r-* reports, l-* logs (one per MPI rank), o-*.qp tables and the
+ndb.QP / ndb.HF_and_locXC netCDF databases, for a given number of
+k-points, bands, spins and ranks.
+"""
+import os
+import numpy as np
+
+# netcdf writer: scipy (classic files) or netCDF4
+try:
+    from scipy.io import netcdf_file
+except ImportError:
+    netcdf_file = None
+try:
+    from netCDF4 import Dataset
+except ImportError:
+    Dataset = None
+
+_report_header = """
+ [01] CPU structure, Files & I/O Directories
+ ===========================================
+
+  [WR./aiida//ndb.QP]--------------------------------------------------
+"""
+_report_kpoint = "  * K [%d] : 0.000000 0.100000 0.250000 ( cc) * Comp.ed 1 (iku) weight 0.0312\n"
+_report_qp_header = "  QP [eV] @ K [%d] (iku): 0.000000  0.000000  0.250000\n\n"
+_report_qp_line = "  B=%d Eo= -1.30 E= -1.41 E-Eo= -0.11 Re(Z)=0.81 Im(Z)=-.2400E-2 nlXC=-11.1 lXC=-10.0 So= 0.57\n"
+_report_footer = """
+  Timing   [Min/Max/Average]: 01m-02s/01m-03s/01m-02s
+
+ [07] Timing Overview
+ ====================
+
+ Clock: global (MIN - MAX - AVERAGE)
+                             io_fragment :      0.0020s P2 [MEM=   0.000 Gb]      0.0040s P6 [MEM=   0.000 Gb]      0.0030s [MEM=   0.000 Gb] (  78 calls,   0.018 msec avg)
+
+ [08] Game Over & Game summary
+ =============================
+"""
+
+def report_block(ik, nbands):
+    """ k-point line and QP [eV] block of one k-point
+    """
+    return _report_kpoint%ik + _report_qp_header%ik + \
+           ''.join(_report_qp_line%ib for ib in range(1, nbands+1)) + "\n"
+
+def write_report(path, nkpoints, nbands, size_mb=None):
+    """ r-* report with the QP results of nkpoints k-points and nbands bands,
+        or with as many k-points as needed to reach size_mb megabytes if given.
+        Returns the number of k-points written.
+    """
+    target = size_mb*1024*1024 if size_mb else None
+    with open(path, 'w') as fl:
+        fl.write(_report_header)
+        written = len(_report_header)
+        ik = 0
+        while (written < target) if target else (ik < nkpoints):
+            ik += 1
+            block = report_block(ik, nbands)
+            fl.write(block)
+            written += len(block)
+        fl.write(_report_footer)
+    return ik
+
+def _time_stamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return "%02dh-%02dm-%02ds"%(hours, minutes, seconds)
+    if minutes:
+        return "%02dm-%02ds"%(minutes, seconds)
+    return "%02ds"%seconds
+
+def write_log(path, nlines, rank=1, warning_every=50, memory_every=10):
+    """ l-* log of one rank with nlines time stamped lines, a memory line every
+        memory_every lines and a warning every warning_every lines
+    """
+    with open(path, 'w') as fl:
+        for line in range(nlines):
+            stamp = " <%s> P%d: "%(_time_stamp(line//4 + rank), rank)
+            if line % warning_every == warning_every-1:
+                fl.write(stamp + "[WARNING] Empty workload\n")
+            elif line % memory_every == memory_every-1:
+                fl.write(stamp + "[M  %.3f Gb] Alloc X (%.3f)\n"%(0.1 + (line % 997)*1e-3*rank, 0.05))
+            else:
+                fl.write(stamp + "[06] Dynamic Dielectric Matrix (PPA) %d\n"%line)
+
+def write_qp_output(path, nkpoints, nbands, nspin=1):
+    """ o-*.qp table with one row per (k-point, band, spin)
+    """
+    spin_tag = '    Spin_Pol' if nspin > 1 else ''
+    with open(path, 'w') as fl:
+        fl.write("#\n"*14)
+        fl.write("# GW solver : Newton\n#\n")
+        fl.write("#  K-point    Band       Eo         E-Eo       Sc|Eo%s\n#\n"%spin_tag)
+        for ik in range(1, nkpoints+1):
+            for ib in range(1, nbands+1):
+                for isp in range(1, nspin+1):
+                    fl.write("%9d %9d %15.6f %15.6f %15.6f"%(ik, ib, ib-1.3, 0.2, 0.5))
+                    fl.write(" %9d\n"%isp if nspin > 1 else "\n")
+
+def _qp_indices(nkpoints, nbands, nspin):
+    """ band, k-point and spin index of each QP state
+    """
+    ik, ib, isp = np.meshgrid(np.arange(1, nkpoints+1), np.arange(1, nbands+1),
+                              np.arange(1, nspin+1), indexing='ij')
+    return ib.ravel(), ik.ravel(), isp.ravel()
+
+def _create_netcdf(path):
+    if netcdf_file is not None:
+        return netcdf_file(path, 'w', version=2)
+    if Dataset is not None:
+        return Dataset(path, 'w', format='NETCDF3_64BIT')
+    raise ImportError("scipy or netCDF4 is needed to write netcdf files")
+
+def write_ndb_qp(path, nkpoints, nbands, nspin=1):
+    """ ndb.QP database (new format, QP_E / QP_Eo / QP_Z)
+    """
+    ib, ik, isp = _qp_indices(nkpoints, nbands, nspin)
+    nqp = len(ib)
+    table = np.array([ib, ib, ik] + ([isp] if nspin > 1 else []), dtype=np.float64)
+    f = _create_netcdf(path)
+    f.createDimension('D_table', table.shape[0])
+    f.createDimension('D_nqp', nqp)
+    f.createDimension('D_reim', 2)
+    f.createDimension('D_xyz', 3)
+    f.createDimension('D_nk', nkpoints)
+    f.createVariable('QP_table', 'd', ('D_table', 'D_nqp'))[:] = table
+    f.createVariable('QP_kpts', 'd', ('D_xyz', 'D_nk'))[:] = np.random.rand(3, nkpoints)
+    E = np.zeros((nqp, 2))
+    E[:,0] = ib - 1.41
+    E[:,1] = -1e-3
+    f.createVariable('QP_E', 'd', ('D_nqp', 'D_reim'))[:] = E
+    f.createVariable('QP_Eo', 'd', ('D_nqp',))[:] = ib - 1.3
+    Z = np.zeros((nqp, 2))
+    Z[:,0] = 0.81
+    f.createVariable('QP_Z', 'd', ('D_nqp', 'D_reim'))[:] = Z
+    f.close()
+
+def write_ndb_hf(path, nkpoints, nbands, nspin=1):
+    """ ndb.HF_and_locXC database, Sx_Vxc rows [ib, ib, ik, (isp,) Re Sx, Im Sx, Re Vxc, Im Vxc]
+    """
+    ib, ik, isp = _qp_indices(nkpoints, nbands, nspin)
+    columns = [ib, ib, ik] + ([isp] if nspin > 1 else [])
+    columns += [np.full(len(ib), -11.1), np.zeros(len(ib)), np.full(len(ib), -10.0), np.zeros(len(ib))]
+    hf = np.array(columns, dtype=np.float64).T.ravel()
+    f = _create_netcdf(path)
+    f.createDimension('D_hf', len(hf))
+    f.createVariable('Sx_Vxc', 'd', ('D_hf',))[:] = hf
+    f.close()
+
+def write_folder(folder, nkpoints, nbands, nspin=1, nranks=1, log_lines=10000, netcdf=True):
+    """ Retrieved folder of a GW calculation, as AiiDA stores it (flattened paths):
+        r-aiida_gw0, o-aiida.qp, one l-aiida_gw0_CPU_N log per rank and, with netcdf,
+        ndb.QP and ndb.HF_and_locXC. Returns the list of the written files.
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    write_report(os.path.join(folder, 'r-aiida_gw0'), nkpoints, nbands)
+    write_qp_output(os.path.join(folder, 'o-aiida.qp'), nkpoints, nbands, nspin)
+    for rank in range(1, nranks+1):
+        write_log(os.path.join(folder, 'l-aiida_gw0_CPU_%d'%rank), log_lines, rank)
+    if netcdf and (netcdf_file is not None or Dataset is not None):
+        write_ndb_qp(os.path.join(folder, 'ndb.QP'), nkpoints, nbands, nspin)
+        write_ndb_hf(os.path.join(folder, 'ndb.HF_and_locXC'), nkpoints, nbands, nspin)
+    return sorted(os.listdir(folder))
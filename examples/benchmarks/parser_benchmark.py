@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the yambo parser on synthetic retrieved folders (see generators.py).
+
+For every size (k-points x bands x spins x ranks) it times, and records the peak
+memory of, the stages of the parser:
+  YamboFile        each file of the folder on its own
+  YamboFolder      the whole folder, serial and with --processes workers
+  parse_from_calc  YamboParser on a stand-in calculation (needs aiida and a
+                   configured profile, no daemon; skipped otherwise)
+Each stage runs in a fresh process, so that its peak memory (max RSS above the
+one of the idle process) is not hidden by the previous stages.
+The results are written as JSON, to be compared across releases:
+
+    python parser_benchmark.py --kpoints 10 100 --bands 50 --spins 1 2 --ranks 4 --output results.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from aiida_yambo.parsers.ext_dep.yambofile import YamboFile
+from aiida_yambo.parsers.ext_dep.yambofolder import YamboFolder
+import generators
+
+# retrieve list of a GW calculation with the logs of all the ranks
+_retrieve_list = ['r*', 'l*', 'o*', 'LOG/l-*_CPU_*', 'aiida/ndb.QP', 'aiida/ndb.HF_and_locXC']
+
+def _max_rss_mb():
+    """ Peak resident memory of the current process in MB
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': # bytes on macOS, kB on linux
+        return rss/1024.0/1024.0
+    return rss/1024.0
+
+def _yambofile(folder, filename):
+    YamboFile(filename, folder=folder)
+
+def _yambofolder(folder, processes):
+    YamboFolder(folder, processes=processes, patterns=_retrieve_list)
+
+class _Node(object):
+    """ Stand-in for the AiiDA nodes that YamboParser reads
+    """
+    def __init__(self, cls=object, **attributes):
+        self._cls = cls
+        self.__dict__.update(attributes)
+
+    @property
+    def __class__(self): # isinstance checks of the parser
+        return self._cls
+
+def _parse_from_calc(folder, processes):
+    from aiida.backends.utils import load_dbenv, is_dbenv_loaded
+    if not is_dbenv_loaded():
+        load_dbenv()
+    from aiida_yambo.parsers.parsers import YamboParser
+    from aiida_yambo.calculations.gw import YamboCalculation
+    from aiida_quantumespresso.calculations.pw import PwCalculation
+    settings = {'PARSER_PROCESSES': processes} if processes else {}
+    structure = _Node(cell=(np.eye(3)*5.0).tolist())
+    pw_calc = _Node(PwCalculation, inp=_Node(structure=structure))
+    retrieved = _Node(get_abs_path=lambda: folder, get_folder_list=lambda: os.listdir(folder))
+    calc = _Node(YamboCalculation, pk=0, inp=_Node(
+                     settings=_Node(get_dict=lambda: settings),
+                     parameters=_Node(get_dict=lambda: {'ppa': True, 'gw0': True, 'HF_and_locXC': True}),
+                     parent_calc_folder=_Node(inp=_Node(remote_folder=pw_calc))),
+                 get_retrieved_node=lambda: retrieved,
+                 _get_retrieve_list=lambda: _retrieve_list)
+    YamboParser(calc).parse_from_calc()
+
+_stages = {'YamboFile': _yambofile, 'YamboFolder': _yambofolder, 'parse_from_calc': _parse_from_calc}
+
+def _measure(queue, stage, args, repeat):
+    """ Child process: best time of repeat runs of a stage and peak memory above the start
+    """
+    try:
+        baseline = _max_rss_mb()
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            _stages[stage](*args)
+            timings.append(time.time() - start)
+        queue.put({'seconds': min(timings), 'peak_memory_mb': _max_rss_mb() - baseline})
+    except Exception as e:
+        queue.put({'error': '{}: {}'.format(type(e).__name__, e)})
+
+def run_stage(stage, args, repeat):
+    """ Run a stage in a fresh process, returns its timing and peak memory
+    """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure, args=(queue, stage, args, repeat))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def _folder_size_mb(folder):
+    return sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))/1024.0/1024.0
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the yambo parser stages')
+    parser.add_argument('--kpoints', type=int, nargs='+', default=[10, 100], help='numbers of k-points')
+    parser.add_argument('--bands', type=int, nargs='+', default=[50], help='numbers of QP bands')
+    parser.add_argument('--spins', type=int, nargs='+', default=[1], help='numbers of spin channels (1 or 2)')
+    parser.add_argument('--ranks', type=int, nargs='+', default=[1], help='numbers of MPI rank logs')
+    parser.add_argument('--log-lines', type=int, default=100000, help='lines of each log')
+    parser.add_argument('--processes', type=int, default=4, help='workers of the parallel YamboFolder stage')
+    parser.add_argument('--repeat', type=int, default=3, help='best of N timings')
+    parser.add_argument('--no-parser', action='store_true', help='skip the parse_from_calc stage')
+    parser.add_argument('--output', default='parser_benchmark.json', help='JSON file with the results')
+    args = parser.parse_args()
+
+    results = []
+    workdir = tempfile.mkdtemp()
+    try:
+        for nk in args.kpoints:
+            for nb in args.bands:
+                for ns in args.spins:
+                    for nr in args.ranks:
+                        folder = os.path.join(workdir, 'k%d_b%d_s%d_r%d'%(nk, nb, ns, nr))
+                        files = generators.write_folder(folder, nk, nb, ns, nr, args.log_lines)
+                        size = {'kpoints': nk, 'bands': nb, 'spins': ns, 'ranks': nr,
+                                'log_lines': args.log_lines, 'folder_mb': _folder_size_mb(folder)}
+                        stages = [('YamboFile', (folder, name), name) for name in files]
+                        stages += [('YamboFolder', (folder, None), 'serial'),
+                                   ('YamboFolder', (folder, args.processes), '%d processes'%args.processes)]
+                        if not args.no_parser:
+                            stages += [('parse_from_calc', (folder, None), 'serial'),
+                                       ('parse_from_calc', (folder, args.processes), '%d processes'%args.processes)]
+                        for stage, stage_args, label in stages:
+                            result = dict(size, stage=stage, label=label)
+                            result.update(run_stage(stage, stage_args, args.repeat))
+                            results.append(result)
+                            print("{:>6} {:>6} {:>3} {:>4}  {:<16} {:<22} {}".format(nk, nb, ns, nr, stage, label,
+                                  result.get('error') or '{:9.3f} s {:9.1f} MB'.format(result['seconds'], result['peak_memory_mb'])))
+                        shutil.rmtree(folder)
+    finally:
+        shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as fl:
+        json.dump({'date': datetime.datetime.now().isoformat(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'machine': platform.machine(),
+                   'cpus': multiprocessing.cpu_count(),
+                   'results': results}, fl, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timing of YamboFile.parse_report on synthetic r-* reports of growing size.
+The parse time per MB should stay constant (linear scaling) from 1 MB to 500 MB.
+
+    python report_benchmark.py --sizes 1 10 100 500
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from aiida_yambo.parsers.ext_dep.yambofile import YamboFile
+from generators import write_report
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the r-* report parser')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100], help='report sizes in MB')
+    parser.add_argument('--repeat', type=int, default=3, help='best of N timings')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print("{:>8} {:>10} {:>10} {:>10}".format('MB', 'kpoints', 'seconds', 's/MB'))
+        for size in args.sizes:
+            nkpts = write_report(os.path.join(workdir, 'r-bench'), None, 40, size_mb=size)
+            timings = []
+            for _ in range(args.repeat):
+                start = time.time()
+                result = YamboFile('r-bench', folder=workdir)
+                timings.append(time.time()-start)
+            assert len(result.data) == nkpts
+            best = min(timings)
+            print("{:>8} {:>10} {:>10.3f} {:>10.4f}".format(size, nkpts, best, best/size))
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
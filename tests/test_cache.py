@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the cache of parsed files (aiida_yambo.parsers.cache)
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy
+from aiida_yambo.parsers.cache import ParseCache
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = ParseCache(os.path.join(self.folder, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, filename, text):
+        with open(os.path.join(self.folder, filename), 'w') as fl:
+            fl.write(text)
+
+    def entries(self):
+        return sorted(name for name in os.listdir(self.cache.folder))
+
+    def test_key(self):
+        self.write('r-a', 'report')
+        self.write('r-b', 'report')
+        key = self.cache.key('r-a', self.folder, '4')
+        self.assertEqual(key, self.cache.key('r-a', self.folder, '4'))
+        self.assertNotEqual(key, self.cache.key('r-b', self.folder, '4'))
+        self.assertNotEqual(key, self.cache.key('r-a', self.folder, '5'))
+        self.write('r-a', 'report, changed')
+        self.assertNotEqual(key, self.cache.key('r-a', self.folder, '4'))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get('missing'))
+        records = numpy.zeros(2, dtype=[('kpoint', numpy.int32), ('Eo', numpy.float64)])
+        records['Eo'] = [-1.0, 2.0]
+        state = {'type': 'output_gw', 'errors': ['error'], 'max_memory': None, 'data': records,
+                 'memory_timeline': (numpy.arange(3, dtype=numpy.int32), numpy.ones(3, dtype=numpy.float32)),
+                 'kpoints': {'1': [0.0, 0.0, 0.5]}}
+        self.cache.put('key', state)
+        cached = self.cache.get('key')
+        self.assertEqual(sorted(cached), sorted(state))
+        self.assertEqual(cached['type'], 'output_gw')
+        self.assertEqual(cached['errors'], ['error'])
+        self.assertIsNone(cached['max_memory'])
+        self.assertEqual(cached['kpoints'], {'1': [0.0, 0.0, 0.5]})
+        self.assertEqual(cached['data'].dtype, records.dtype)
+        self.assertTrue(numpy.array_equal(cached['data'], records))
+        self.assertEqual(cached['memory_timeline'][1].dtype, numpy.float32)
+        # no temporary file left behind
+        self.assertEqual(self.entries(), ['key.json', 'key.npz'])
+
+    def test_eviction(self):
+        for index, key in enumerate(('a', 'b', 'c')):
+            self.cache.put(key, {'data': numpy.zeros(100)})
+            for path in self.cache._paths(key):
+                os.utime(path, (1000 + index, 1000 + index))
+        entry = sum(os.path.getsize(path) for path in self.cache._paths('a'))
+        self.cache.get('a') # the least recently used is now b
+        self.cache.max_bytes = 2*entry
+        self.cache.evict()
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.cache.max_bytes = 0
+        self.cache.evict()
+        self.assertEqual(self.entries(), [])
+
+    def test_threads(self):
+        errors = []
+        def put(index):
+            try:
+                for _ in range(20):
+                    self.cache.put('key', {'data': numpy.full(10, index)})
+            except Exception as exception:
+                errors.append(exception)
+        threads = [threading.Thread(target=put, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(self.cache.get('key')['data'])), 1)
+        self.assertEqual(self.entries(), ['key.json', 'key.npz'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip of the reuse of finished calculations (aiida_yambo.calculations.fingerprint):
+fingerprint recorded on a calculation, looked up and reused by YamboRestartWf.
+Needs an AiiDA test profile.
+"""
+import unittest
+try:
+    from aiida.backends.testbase import AiidaTestCase
+except ImportError:
+    raise unittest.SkipTest("AiiDA is not installed")
+
+class TestCalculationReuse(AiidaTestCase):
+
+    def setUp(self):
+        from aiida.orm.code import Code
+        from aiida.orm.data.parameter import ParameterData
+        from aiida.orm.data.remote import RemoteData
+        self.code = Code(remote_computer_exec=(self.computer, '/bin/true'))
+        self.code.label = 'yambo'
+        self.code.set_input_plugin_name('yambo.yambo')
+        self.code.store()
+        self.precode = Code(remote_computer_exec=(self.computer, '/bin/true'))
+        self.precode.label = 'p2y'
+        self.precode.store()
+        self.parent_folder = RemoteData(computer=self.computer, remote_path='/tmp/aiida_yambo_parent')
+        self.parent_folder.store()
+        self.parameters = ParameterData(dict={'gw0': True, 'ppa': True, 'NGsBlkXp': 2, 'NGsBlkXp_units': 'Ry'})
+        self.settings = ParameterData(dict={'ADDITIONAL_RETRIEVE_LIST': [], 'PARSER_PROCESSES': 2})
+        self.precode_parameters = ParameterData(dict={'-a': 'x'})
+
+    def inputs(self, parameters=None):
+        from aiida_yambo.calculations.gw import YamboCalculation
+        inputs = YamboCalculation.process().get_inputs_template()
+        inputs.code = self.code
+        inputs.preprocessing_code = self.precode
+        inputs.precode_parameters = self.precode_parameters
+        inputs.parent_folder = self.parent_folder
+        inputs.parameters = parameters or self.parameters
+        inputs.settings = self.settings
+        return inputs
+
+    def recorded_calculation(self, state, parent_folder=None, settings=None, precode_parameters=True):
+        """ stored calculation, with a remote folder, and the fingerprint recorded as in
+            _prepare_for_submission; without parent with parent_folder False """
+        from aiida.common.links import LinkType
+        from aiida.orm.data.remote import RemoteData
+        from aiida_yambo.calculations.gw import YamboCalculation
+        from aiida_yambo.calculations.fingerprint import input_fingerprint, _fingerprint_extra
+        if parent_folder is None:
+            parent_folder = self.parent_folder
+        settings = settings or self.settings
+        calc = YamboCalculation(computer=self.computer,
+                                resources={'num_machines': 1, 'num_mpiprocs_per_machine': 1})
+        calc.use_code(self.code)
+        calc.use_preprocessing_code(self.precode)
+        if precode_parameters:
+            calc.use_precode_parameters(self.precode_parameters)
+        if parent_folder:
+            calc.use_parent_folder(parent_folder)
+        calc.use_parameters(self.parameters)
+        calc.use_settings(settings)
+        calc.store_all()
+        if parent_folder:
+            calc.set_extra(_fingerprint_extra, input_fingerprint(self.parameters.get_dict(),
+                           settings.get_dict(), self.code, parent_folder, self.precode,
+                           self.precode_parameters.get_dict() if precode_parameters else None))
+        calc._set_state(state)
+        remote_folder = RemoteData(computer=self.computer, remote_path='/tmp/aiida_yambo_{}'.format(calc.pk))
+        remote_folder.add_link_from(calc, label='remote_folder', link_type=LinkType.CREATE)
+        remote_folder.store()
+        return calc
+
+    def cached_calculation(self, inputs):
+        from aiida_yambo.workflows.yamborestart import YamboRestartWf
+        return YamboRestartWf.cached_calculation.__func__(None, inputs)
+
+    def test_round_trip(self):
+        from aiida.common.datastructures import calc_states
+        from aiida_yambo.calculations.fingerprint import find_cached_calculation, _fingerprint_extra
+        calc = self.recorded_calculation(calc_states.FINISHED)
+        self.assertEqual(find_cached_calculation(calc.get_extra(_fingerprint_extra)).pk, calc.pk)
+        self.assertEqual(self.cached_calculation(self.inputs()).pk, calc.pk)
+
+    def test_not_reused(self):
+        from aiida.common.datastructures import calc_states
+        from aiida.orm.data.parameter import ParameterData
+        self.recorded_calculation(calc_states.FAILED)
+        self.assertIsNone(self.cached_calculation(self.inputs()))
+        self.recorded_calculation(calc_states.FINISHED)
+        self.assertIsNone(self.cached_calculation(self.inputs(ParameterData(dict={'gw0': True}))))
+        self.settings = ParameterData(dict=dict(self.settings.get_dict(), REUSE_CALCULATIONS=False))
+        self.assertIsNone(self.cached_calculation(self.inputs()))
+
+    def test_workflow_cache_hit(self):
+        """ the steps of YamboRestartWf put the reused calculations in the context """
+        from aiida.common.datastructures import calc_states
+        from aiida.orm.data.base import Str
+        from aiida.orm.data.parameter import ParameterData
+        # a yambo parent, so that the workflow does not initialise, of an NSCF-like calculation
+        nscf = self.recorded_calculation(calc_states.FINISHED, parent_folder=False)
+        p2y = self.recorded_calculation(calc_states.FINISHED, parent_folder=nscf.out.remote_folder,
+                                        settings=ParameterData(dict={'INITIALISE': True}))
+        workflow_settings = ParameterData(dict={'PARSER_PROCESSES': 2})
+        first = self.recorded_calculation(calc_states.FINISHED, parent_folder=p2y.out.remote_folder,
+                                          settings=workflow_settings, precode_parameters=False)
+        restart_settings = ParameterData(dict={'PARSER_PROCESSES': 2, 'INITIALISE': False})
+        restart = self.recorded_calculation(calc_states.FINISHED, parent_folder=first.out.remote_folder,
+                                            settings=restart_settings, precode_parameters=False)
+
+        steps = _WorkflowSteps(precode=Str('p2y@' + self.computer.name), yambocode=Str('yambo@' + self.computer.name),
+                               calculation_set=ParameterData(dict={'resources': {'num_machines': 1,
+                                                                    'num_mpiprocs_per_machine': 1}}),
+                               settings=workflow_settings, parent_folder=p2y.out.remote_folder,
+                               parameters=self.parameters)
+        self.assertIsNone(steps.yambobegin())
+        self.assertEqual(steps.ctx.yambo.pk, first.pk)
+        self.assertEqual(steps.ctx.yambo_pks, [first.pk])
+        self.assertIsNone(steps.yambo_restart())
+        self.assertEqual(steps.ctx.yambo_restart.pk, restart.pk)
+        steps.interstep()
+        self.assertEqual([node.pk for node in steps.ctx.yambo_nodes], [restart.pk])
+
+class _WorkflowSteps(object):
+    """ the steps of YamboRestartWf on a plain object, without running the workchain """
+
+    def __init__(self, **inputs):
+        from aiida.common.extendeddicts import AttributeDict
+        self.inputs = AttributeDict(inputs)
+        self.ctx = AttributeDict()
+        self.reports = []
+
+    def report(self, message):
+        self.reports.append(message)
+
+def _workflow_steps():
+    from aiida_yambo.workflows.yamborestart import YamboRestartWf
+    for name in ('yambobegin', 'interstep', 'yambo_restart', 'run_yambo', 'cached_calculation'):
+        setattr(_WorkflowSteps, name, getattr(YamboRestartWf, name).__func__)
+_workflow_steps()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the container of the QP results (aiida_yambo.parsers.qpdataset)
+"""
+import unittest
+import numpy
+from aiida_yambo.parsers.qpdataset import QPDataset
+
+class _ArrayData(object):
+    """ stand-in of an unstored ArrayData node: arrays and attributes """
+
+    pk = None
+
+    def __init__(self):
+        self.arrays = {}
+        self.attributes = {}
+
+    def set_array(self, name, array):
+        self.arrays[name] = numpy.array(array)
+
+    def get_array(self, name):
+        return self.arrays[name]
+
+    def get_arraynames(self):
+        return list(self.arrays)
+
+    def _set_attr(self, key, value):
+        self.attributes[key] = value
+
+    def get_attr(self, key, default):
+        return self.attributes.get(key, default)
+
+def _dataset():
+    """ two k-points, bands 3 and 4, spin unpolarized """
+    return QPDataset([1, 1, 2, 2], [3, 4, 3, 4], Eo=[-1.0, 1.0, -1.5, 0.5],
+                     E_minus_Eo=[-0.25, 0.5, -0.25, 0.75], Z=[0.8, 0.8, 0.9, 0.9])
+
+class TestQPDataset(unittest.TestCase):
+
+    def test_row(self):
+        qp = _dataset()
+        self.assertEqual(qp.row(2, 3), 2)
+        self.assertEqual(qp.row(3, 3), -1)
+        self.assertEqual(qp.row(1, 5), -1)
+        self.assertEqual(qp.row(1, 3, 1), -1)
+        self.assertEqual(list(qp.row([1, 2, 2, 7], [4, 3, 4, 4])), [1, 2, 3, -1])
+
+    def test_get(self):
+        qp = _dataset()
+        self.assertEqual(qp.get('E', 1, 4), 1.5)
+        self.assertEqual(list(qp.get('Eo', [1, 2], 3)), [-1.0, -1.5])
+        self.assertRaises(KeyError, qp.get, 'E', 3, 3)
+
+    def test_gap(self):
+        qp = _dataset()
+        # E: k1 -1.25, 1.5  k2 -1.75, 1.25
+        self.assertAlmostEqual(qp.gap(3, 4), 1.25 - (-1.25))
+        self.assertAlmostEqual(qp.gap(3, 4, direct=True), 1.5 - (-1.25))
+        self.assertAlmostEqual(qp.gap(3, 4, name='Eo'), 0.5 - (-1.0))
+
+    def test_bandwidth(self):
+        qp = _dataset()
+        self.assertAlmostEqual(qp.bandwidth(3), 0.5)
+        self.assertAlmostEqual(qp.bandwidth(4), 0.25)
+
+    def test_transition(self):
+        qp = _dataset()
+        self.assertEqual(list(qp.transition(1, 3, 2, 4)), [1.25 - (-1.25)])
+        self.assertEqual(len(qp.transition(1, 3, 5, 4)), 0)
+        spin = QPDataset([1, 1, 1, 1], [3, 4, 3, 4], [0, 0, 1, 1], Eo=[0.0, 1.0, 0.5, 2.0],
+                         E_minus_Eo=[0.0, 0.0, 0.0, 0.0])
+        self.assertEqual(list(spin.transition(1, 3, 1, 4)), [1.0, 1.5])
+
+    def test_missing_states(self):
+        qp = _dataset()
+        self.assertEqual(qp.missing_states([(1, 2, 3, 4)]), 0)
+        self.assertEqual(qp.missing_states([(1, 1, 3, 4), (2, 3, 4, 5)]), 3)
+        self.assertEqual(qp.missing_states([]), 0)
+
+    def test_arraydata_round_trip(self):
+        qp = _dataset()
+        node = qp.to_arraydata(_ArrayData())
+        self.assertEqual(node.get_attr(QPDataset._layout_attribute, None), QPDataset._layout_version)
+        read = QPDataset.from_arraydata(node)
+        for name in ('kpoint', 'band', 'spin'):
+            self.assertTrue(numpy.array_equal(getattr(read, name), getattr(qp, name)))
+        self.assertEqual(sorted(read.observables), sorted(qp.observables))
+        for name in qp.observables:
+            self.assertTrue(numpy.array_equal(read[name], qp[name]))
+            self.assertEqual(read[name].dtype, qp[name].dtype)
+        self.assertEqual(read.row(2, 4), 3)
+
+    def test_single_precision(self):
+        node = _dataset().to_arraydata(_ArrayData(), single_precision=True)
+        read = QPDataset.from_arraydata(node)
+        self.assertEqual(read['Eo'].dtype, numpy.float32)
+        self.assertEqual(read.qp_table().dtype, numpy.int32)
+
+    def test_legacy_layout(self):
+        # ndb.* node stored before QPDataset: qp_table [ib, ik] without spin
+        node = _ArrayData()
+        node.set_array('qp_table', [[3, 1], [4, 1], [3, 2]])
+        node.set_array('Eo', [-1.0, 1.0, -1.5])
+        self.assertRaises(ValueError, QPDataset.from_arraydata, node)
+        read = QPDataset.from_arraydata(node, QPDataset._legacy_columns['array_ndb'])
+        self.assertEqual(list(read.kpoint), [1, 1, 2])
+        self.assertEqual(list(read.band), [3, 4, 3])
+        self.assertEqual(list(read.spin), [0, 0, 0])
+        node._set_attr(QPDataset._layout_attribute, 99)
+        self.assertRaises(ValueError, QPDataset.from_arraydata, node, (0, 1, 2))
+
+if __name__ == '__main__':
+    unittest.main()
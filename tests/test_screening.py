@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the screening compatibility (aiida_yambo.calculations.screening)
+"""
+import unittest
+from aiida_yambo.calculations.screening import screening_compatible, reuse_screening
+
+class TestScreeningCompatible(unittest.TestCase):
+
+    parent = {'gw0': True, 'ppa': True, 'NGsBlkXp': 2, 'NGsBlkXp_units': 'Ry', 'BndsRnXp': (1, 50),
+              'QPkrange': [(1, 1, 8, 9)], 'GbndRnge': (1, 50)}
+
+    def test_compatible(self):
+        parameters = dict(self.parent, BndsRnXp=[1, 50], GbndRnge=(1, 100), QPkrange=[(1, 2, 8, 9)])
+        self.assertTrue(screening_compatible(self.parent, parameters))
+
+    def test_screening_parameters(self):
+        self.assertFalse(screening_compatible(self.parent, dict(self.parent, NGsBlkXp=4)))
+        self.assertFalse(screening_compatible(self.parent, dict(self.parent, NGsBlkXp_units='mHa')))
+        self.assertFalse(screening_compatible(self.parent, dict(self.parent, BndsRnXp=(1, 60))))
+        self.assertFalse(screening_compatible(self.parent, dict(self.parent, FFTGvecs=10)))
+
+    def test_runlevels(self):
+        self.assertFalse(screening_compatible(self.parent, dict(self.parent, ppa=False, em1d=True)))
+        parent = dict(self.parent)
+        del parent['ppa']
+        self.assertFalse(screening_compatible(parent, parent))
+
+class TestReuseScreening(unittest.TestCase):
+
+    def test_default(self):
+        self.assertTrue(reuse_screening({}))
+        self.assertTrue(reuse_screening({'PARSER_PROCESSES': 2}))
+
+    def test_setting(self):
+        self.assertFalse(reuse_screening({'REUSE_SCREENING': False}))
+        self.assertFalse(reuse_screening({'reuse_screening': 0}))
+        self.assertTrue(reuse_screening({'REUSE_SCREENING': 1}))
+
+if __name__ == '__main__':
+    unittest.main()
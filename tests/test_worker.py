@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the parsing in worker processes (aiida_yambo.parsers.worker)
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from aiida_yambo.parsers.ext_dep.yambofile import YamboFile
+from aiida_yambo.parsers.ext_dep.yambofolder import YamboFolder
+from aiida_yambo.parsers.worker import ParseWorkerPool
+
+_log = """ <01s> P1: [M  0.250 Gb] Alloc X ( 0.238)
+ <02s> P1: [WARNING] Empty workload for CPU 1
+ <01m-05s> P1: [M  0.100 Gb] Free X ( 0.150)
+"""
+
+_report = """
+  *X* K [1] : 0.000000 0.000000 0.000000 ( cc) * Comp.ed 1 (iku) weight 0.0625
+
+  QP [eV] @ K [1] (iku): 0.000000  0.000000  0.000000
+
+  B=8 Eo= -0.43 E= -1.29 E-Eo= -0.86 Re(Z)=0.74 Im(Z)=-.8934E-3 nlXC=-13.42 lXC=-12.25 So= 0.0
+
+ [08] Game Over & Game summary
+"""
+
+class TestParseWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for filename, text in (('l-aiida_gw0', _log), ('r-aiida_gw0', _report)):
+            with open(os.path.join(self.folder, filename), 'w') as fl:
+                fl.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def tasks(self, budgets=None, max_warnings=None):
+        return [(filename, self.folder, True, None, None, budgets, max_warnings)
+                for filename in ('l-aiida_gw0', 'r-aiida_gw0')]
+
+    def test_workers(self):
+        pool = ParseWorkerPool(processes=2, timeout=60, min_size=0)
+        log, report = list(pool(self.tasks()))
+        self.assertEqual(pool.failures, [])
+        expected = YamboFile('l-aiida_gw0', folder=self.folder)
+        for name in ('type', 'warnings', 'max_memory', 'last_memory', 'last_memory_time', 'last_time'):
+            self.assertEqual(getattr(log, name), getattr(expected, name), name)
+        self.assertEqual(list(log.memory_timeline[0]), [1, 65])
+        self.assertEqual(report.data, YamboFile('r-aiida_gw0', folder=self.folder).data)
+        self.assertTrue(report.game_over)
+
+    def test_folder(self):
+        folder = YamboFolder(self.folder, executor=ParseWorkerPool(min_size=0))
+        self.assertEqual([y.filename for y in folder.yambofiles], ['l-aiida_gw0', 'r-aiida_gw0'])
+
+    def test_inline(self):
+        # files below min_size are parsed in the calling process
+        pool = ParseWorkerPool(timeout=1e-9, memory_limit=1)
+        self.assertEqual([y.type for y in pool(self.tasks())], ['log', 'report'])
+        self.assertEqual(pool.failures, [])
+
+    def test_timeout(self):
+        pool = ParseWorkerPool(processes=2, timeout=1e-3, min_size=0)
+        self.assertEqual(list(pool(self.tasks())), [None, None])
+        self.assertEqual([filename for filename, reason in pool.failures], ['l-aiida_gw0', 'r-aiida_gw0'])
+        self.assertTrue(all(reason.startswith('timeout') for filename, reason in pool.failures))
+
+    def test_memory_limit(self):
+        pool = ParseWorkerPool(memory_limit=1024*1024, min_size=0)
+        self.assertEqual(list(pool(self.tasks()[:1])), [None])
+        self.assertEqual(len(pool.failures), 1)
+        self.assertEqual(pool.failures[0], ('l-aiida_gw0', 'resident memory above 1.0 MB'))
+
+    def test_size_budgets(self):
+        # the budgets reach the workers
+        pool = ParseWorkerPool(min_size=0)
+        log, report = list(pool(self.tasks({'log': 64})))
+        self.assertEqual(log.truncated, {'size': len(_log), 'read': 64})
+        self.assertIsNone(report.truncated)
+
+    def test_max_warnings(self):
+        pool = ParseWorkerPool(min_size=0)
+        log = list(pool(self.tasks(max_warnings=0)[:1]))[0]
+        self.assertEqual((log.warnings, log.warnings_count), ([], 1))
+
+if __name__ == '__main__':
+    unittest.main()
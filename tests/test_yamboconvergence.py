@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Parent folder of the iterations of YamboConvergenceWorkflow with screening reuse
+(YamboConvergenceWorkflow.screening_parent). Needs an AiiDA test profile.
+"""
+import unittest
+try:
+    from aiida.backends.testbase import AiidaTestCase
+except ImportError:
+    raise unittest.SkipTest("AiiDA is not installed")
+
+class TestScreeningParent(AiidaTestCase):
+
+    def setUp(self):
+        from aiida.orm.code import Code
+        from aiida.orm.data.parameter import ParameterData
+        from aiida.orm.data.remote import RemoteData
+        self.code = Code(remote_computer_exec=(self.computer, '/bin/true'))
+        self.code.set_input_plugin_name('yambo.yambo')
+        self.code.store()
+        self.p2y_folder = RemoteData(computer=self.computer, remote_path='/tmp/aiida_yambo_p2y')
+        self.p2y_folder.store()
+        self.parameters = {'gw0': True, 'ppa': True, 'NGsBlkXp': 2, 'NGsBlkXp_units': 'Ry', 'BndsRnXp': (1, 50),
+                           'GbndRnge': (1, 50)}
+
+    def iteration(self, state, parameters):
+        """ stand-in of the YamboRestartWf of an iteration, with its calculation in the given state """
+        from aiida.common.links import LinkType
+        from aiida.orm.data.parameter import ParameterData
+        from aiida.orm.data.remote import RemoteData
+        from aiida.common.extendeddicts import AttributeDict
+        from aiida_yambo.calculations.gw import YamboCalculation
+        calc = YamboCalculation(computer=self.computer,
+                                resources={'num_machines': 1, 'num_mpiprocs_per_machine': 1})
+        calc.use_code(self.code)
+        calc.use_parent_folder(self.p2y_folder)
+        calc.use_parameters(ParameterData(dict=parameters))
+        calc.store_all()
+        calc._set_state(state)
+        remote_folder = RemoteData(computer=self.computer, remote_path='/tmp/aiida_yambo_{}'.format(calc.pk))
+        remote_folder.add_link_from(calc, label='remote_folder', link_type=LinkType.CREATE)
+        remote_folder.store()
+        return AttributeDict({'out': AttributeDict({'gw': ParameterData(dict={'yambo_pk': calc.pk})})}), calc
+
+    def screening_parent(self, settings, iterations, parameters):
+        from aiida.common.extendeddicts import AttributeDict
+        from aiida.orm.data.parameter import ParameterData
+        from aiida_yambo.workflows.yamboconvergence import YamboConvergenceWorkflow
+        workflow = AttributeDict({'inputs': AttributeDict({'settings': ParameterData(dict=settings)}),
+                                  'ctx': AttributeDict(p2y_parent_folder=self.p2y_folder, **iterations)})
+        return YamboConvergenceWorkflow.screening_parent.__func__(workflow, ParameterData(dict=parameters))
+
+    def test_reused_by_default(self):
+        from aiida.common.datastructures import calc_states
+        r0, calc = self.iteration(calc_states.FINISHED, self.parameters)
+        parameters = dict(self.parameters, GbndRnge=(1, 100)) # the screening is the same
+        self.assertEqual(self.screening_parent({}, {'r0': r0}, parameters).pk, calc.out.remote_folder.pk)
+        self.assertEqual(self.screening_parent({'REUSE_SCREENING': 1}, {'r0': r0}, parameters).pk,
+                         calc.out.remote_folder.pk)
+
+    def test_p2y_folder(self):
+        from aiida.common.datastructures import calc_states
+        r0, calc = self.iteration(calc_states.FINISHED, self.parameters)
+        r1, failed = self.iteration(calc_states.FAILED, self.parameters)
+        self.assertEqual(self.screening_parent({'REUSE_SCREENING': False}, {'r0': r0}, self.parameters).pk,
+                         self.p2y_folder.pk)
+        self.assertEqual(self.screening_parent({}, {'r0': r0}, dict(self.parameters, NGsBlkXp=4)).pk,
+                         self.p2y_folder.pk)
+        self.assertEqual(self.screening_parent({}, {'r1': r1}, self.parameters).pk, self.p2y_folder.pk)
+
+if __name__ == '__main__':
+    unittest.main()
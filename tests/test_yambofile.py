@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the yambo file parsers (aiida_yambo.parsers.ext_dep.yambofile).
+The expected values are the output of the regex parsers the scanners replaced.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from aiida_yambo.parsers.ext_dep.yambofile import YamboFile, YamboReportScanner, YamboLogScanner, scan_log_tail
+
+_report = """
+ [01] CPU structure, Files & I/O Directories
+ ===========================================
+
+  [WR./aiida//ndb.QP]--------------------------------------------------
+
+ [02] Game setup
+ ===============
+
+  *X* K [1] : 0.000000 0.000000 0.000000 ( cc) * Comp.ed 1 (iku) weight 0.0625
+  *X* K [2] : 0.000000 0.000000 0.250000 ( cc) * Comp.ed 1 (iku) weight 0.5000
+
+  Timing   [Min/Max/Average]: 01s/02s/01s
+
+ [05] Dynamic Dielectric Matrix (PPA)
+ ====================================
+
+  Timing   [Min/Max/Average]: 01m-02s/01m-05s/01m-03s
+
+ [06] Dyson equation: Newton solver
+ ==================================
+
+  QP [eV] @ K [1] (iku): 0.000000  0.000000  0.000000
+
+  B=8 Eo= -0.43 E= -1.29 E-Eo= -0.86 Re(Z)=0.74 Im(Z)=-.8934E-3 nlXC=-13.42 lXC=-12.25 So= 0.0
+
+  QP [eV] @ K [2] (iku): 0.000000  0.000000  0.250000
+
+  B=8 Eo= -1.30 E= -2.13 E-Eo= -0.83 Re(Z)=0.75 Im(Z)=-.9166E-3 nlXC=-13.21 lXC=-12.10 So= 0.0
+
+  Timing   [Min/Max/Average]: 02m-10s/02m-12s/02m-11s
+
+ [07] Timing Overview
+ ====================
+
+ Clock: global (MIN - MAX - AVERAGE)
+                             io_fragment :      0.0020s P2 [MEM=   0.000 Gb]      0.0040s P6 [MEM=   0.000 Gb]      0.0030s [MEM=   0.000 Gb] (  78 calls,   0.018 msec avg)
+
+ [08] Game Over & Game summary
+ =============================
+"""
+
+_report_stop = """
+ [01] CPU structure, Files & I/O Directories
+ ===========================================
+
+  *X* K [1] : 0.000000 0.000000 0.000000 ( cc) * Comp.ed 1 (iku) weight 0.0625
+
+ [ERROR] STOP signal received while in :[05] Dynamic Dielectric Matrix (PPA)
+ [ERROR] USER parallel structure does not fit the current run parameters
+
+  QP [eV] @ K [1] (iku): 0.000000  0.000000  0.000000
+
+  B=8 Eo= -0.43 E= -1.29 E-Eo= -0.86 Re(Z)=0.74 Im(Z)=-.8934E-3 nlXC=-13.42 lXC=-12.25 So= 0.0
+
+ [08] Game Over & Game summary
+"""
+
+_log = """ <---> P1: [01] CPU structure, Files & I/O Directories
+ <---> P1: [M  0.012 Gb] Alloc WF ( 0.010)
+ <01s> P1: [02] Game setup
+ <02s> P1: [WARNING] Empty workload for CPU 1
+ <03s> P1: [M  0.250 Gb] Alloc X ( 0.238)
+ <01m-04s> P1: [WARNING] Slow convergence
+ <01m-05s> P1: [M  0.100 Gb] Free X ( 0.150)
+ <01h-01m-06s> P1: [ERROR] Allocation of X failed
+P1: [ERROR]Impossible to define an appropriate parallel structure
+ <01h-01m-07s> P1: [06] Dyson equation: Newton solver
+"""
+
+def _long_log(nlines, memory_lines=None):
+    """ log of nlines time stamped lines, an error at the start and at the end, one in
+        the middle and a memory line every 10 lines (only in the first memory_lines if given) """
+    lines = [" <01s> P1: [ERROR] first error\n"]
+    for line in range(1, nlines-1):
+        stamp = " <%02dm-%02ds> P1: "%divmod(line, 60)
+        if line == nlines//2:
+            lines.append(stamp + "[ERROR] middle error\n")
+        elif line % 10 == 0 and (memory_lines is None or line < memory_lines):
+            lines.append(stamp + "[M  %.3f Gb] Alloc X ( 0.010)\n"%(line*1e-3))
+        else:
+            lines.append(stamp + "[06] Dyson equation: Newton solver\n")
+    lines.append(" <59m-59s> P1: [ERROR] last error\n")
+    return ''.join(lines)
+
+def _qp(bindex, dft_energy, qp_energy, qp_correction, z_factor, non_local_xc, local_xc, selfenergy_c):
+    return {'bindex': bindex, 'dft_energy': dft_energy, 'qp_energy': qp_energy, 'qp_correction': qp_correction,
+            'z_factor': z_factor, 'non_local_xc': non_local_xc, 'local_xc': local_xc, 'selfenergy_c': selfenergy_c}
+
+class _FolderTestCase(unittest.TestCase):
+    """ files written in a temporary folder """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, filename, text):
+        with open(os.path.join(self.folder, filename), 'w') as fl:
+            fl.write(text)
+        return filename
+
+    def parse(self, filename, text, **kwargs):
+        return YamboFile(self.write(filename, text), folder=self.folder, **kwargs)
+
+class TestReport(_FolderTestCase):
+
+    def test_report(self):
+        report = self.parse('r-aiida_gw0', _report)
+        self.assertEqual(report.type, 'report')
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.kpoints, {'1': [0.0, 0.0, 0.0], '2': [0.0, 0.0, 0.25]})
+        self.assertEqual(report.timing, ['01s', '01m-02s', '02m-10s'])
+        self.assertEqual(report.data, {'1': _qp([8.0], [-0.43], [-1.29], [-0.86], [0.74], [-13.42], [-12.25], [0.0]),
+                                       '2': _qp([8.0], [-1.3], [-2.13], [-0.83], [0.75], [-13.21], [-12.1], [0.0])})
+        self.assertTrue(report.game_over)
+        self.assertFalse(report.p2y_complete)
+        self.assertTrue(report.yambo_wrote)
+
+    def test_stop(self):
+        report = self.parse('r-aiida_gw0', _report_stop)
+        self.assertEqual(report.errors, ['STOP signal received while in :[05] Dynamic Dielectric Matrix (PPA)'])
+        self.assertEqual(report.kpoints, {'1': [0.0, 0.0, 0.0]})
+        self.assertEqual(report.data, {})
+        self.assertFalse(report.game_over)
+        self.assertIsNone(report.yambo_wrote)
+
+    def test_bands_of_a_block(self):
+        # all the B=.. lines of a block are read (the regex parser kept only the first one)
+        text = _report.replace("So= 0.0\n\n  QP [eV] @ K [2]",
+            "So= 0.0\n  B=9 Eo=  2.13 E=  2.66 E-Eo=  0.53 Re(Z)=0.77 Im(Z)=-.5467E-3 nlXC=-5.93 lXC=-11.26 So= 0.0\n"
+            "\n  QP [eV] @ K [2]")
+        report = self.parse('r-aiida_gw0', text)
+        self.assertEqual(report.data['1'], _qp([8.0, 9.0], [-0.43, 2.13], [-1.29, 2.66], [-0.86, 0.53], [0.74, 0.77],
+                                               [-13.42, -5.93], [-12.25, -11.26], [0.0, 0.0]))
+        self.assertEqual(report.data['2']['bindex'], [8.0])
+
+    def test_timing_profile(self):
+        report = self.parse('r-aiida_gw0', _report)
+        self.assertEqual(report.timing_profile, [('section', 'Game setup', 1, 1, 1, 2),
+                                                 ('section', 'Dynamic Dielectric Matrix (PPA)', 1, 62, 63, 65),
+                                                 ('section', 'Dyson equation: Newton solver', 1, 130, 131, 132),
+                                                 ('routine', 'io_fragment', 78, 0.002, 0.003, 0.004)])
+
+    def test_scanner_lines(self):
+        scanner = YamboReportScanner()
+        for line in _report.splitlines(True):
+            scanner.feed(line)
+        report = self.parse('r-aiida_gw0', _report)
+        self.assertEqual(scanner.data, report.data)
+        self.assertEqual(scanner.kpoints, report.kpoints)
+        self.assertEqual(scanner.timing, report.timing)
+
+class TestLog(_FolderTestCase):
+
+    def test_log(self):
+        log = self.parse('l-aiida_gw0_CPU_1', _log)
+        self.assertEqual(log.type, 'log')
+        self.assertEqual(log.errors, [' <01h-01m-06s> P1: [ERROR] Allocation of X failed\n',
+                                      'P1: [ERROR]Impossible to define an appropriate parallel structure\n'])
+        self.assertEqual(log.warnings, [' <02s> P1: [WARNING] Empty workload for CPU 1\n',
+                                        ' <01m-04s> P1: [WARNING] Slow convergence\n'])
+        self.assertEqual(log.warnings_count, 2)
+        self.assertEqual(log.max_memory, 0.25)
+        self.assertEqual(log.last_memory, 0.1)
+        self.assertEqual(log.last_memory_time, 65)
+        self.assertEqual(log.last_time, 3667)
+        self.assertTrue(log.para_error)
+        self.assertFalse(log.unphysical_input)
+
+    def test_unphysical_input(self):
+        log = self.parse('l-aiida_gw0', " <01s> P1: [M  0.500 Gb] Alloc X ( 0.238)\n"
+                                         "P1: [ERROR][NetCDF] NetCDF: NC_UNLIMITED in the wrong index\n")
+        self.assertEqual(log.errors, [])
+        self.assertTrue(log.unphysical_input)
+        self.assertFalse(log.para_error)
+        self.assertEqual((log.last_time, log.max_memory), (1, 0.5))
+
+    def test_memory_timeline(self):
+        log = self.parse('l-aiida_gw0_CPU_1', _log)
+        seconds, memory = log.memory_timeline
+        self.assertEqual(list(seconds), [0, 3, 65])
+        self.assertEqual([round(float(m), 3) for m in memory], [0.012, 0.25, 0.1])
+
+    def test_max_warnings(self):
+        scanner = YamboLogScanner(max_warnings=1)
+        for line in _log.splitlines(True):
+            scanner.feed(line)
+        self.assertEqual(scanner.warnings, [' <02s> P1: [WARNING] Empty workload for CPU 1\n'])
+        self.assertEqual(scanner.warnings_count, 2)
+
+class TestLogTail(_FolderTestCase):
+
+    def scan(self, text, **kwargs):
+        return scan_log_tail(os.path.join(self.folder, self.write('l-aiida_gw0', text)), **kwargs)
+
+    def test_whole_log(self):
+        scanner = self.scan(_log)
+        log = self.parse('l-aiida_gw0_CPU_1', _log)
+        for name in ('errors', 'warnings', 'max_memory', 'last_memory', 'last_memory_time', 'last_time',
+                     'para_error', 'unphysical_input'):
+            self.assertEqual(getattr(scanner, name), getattr(log, name), name)
+        self.assertFalse(scanner.partial)
+
+    def test_tail(self):
+        text = _long_log(1000)
+        log = self.parse('l-aiida_gw0_CPU_1', text)
+        scanner = self.scan(text, tail_bytes=4096, head_bytes=1024, block_size=256)
+        self.assertEqual(scanner.last_time, log.last_time)
+        self.assertEqual(scanner.last_memory, log.last_memory)
+        self.assertEqual(scanner.last_memory_time, log.last_memory_time)
+        self.assertFalse(scanner.partial)
+        # errors of the head and of the tail only
+        self.assertEqual(len(log.errors), 3)
+        self.assertEqual(scanner.errors, [log.errors[0], log.errors[2]])
+
+    def test_no_memory_in_tail(self):
+        text = _long_log(1000, memory_lines=100)
+        scanner = self.scan(text, tail_bytes=4096, head_bytes=1024, block_size=256)
+        self.assertEqual(scanner.last_time, 3599)
+        self.assertIsNone(scanner.last_memory)
+        self.assertIsNone(scanner.last_memory_time)
+        self.assertTrue(scanner.partial)
+        # the tail reaches the beginning: no memory line at all
+        scanner = self.scan(_long_log(20, memory_lines=0), tail_bytes=4096)
+        self.assertIsNone(scanner.last_memory)
+        self.assertFalse(scanner.partial)
+
+class TestSizeBudgets(_FolderTestCase):
+
+    def test_sampled_log(self):
+        text = _long_log(1000)
+        log = self.parse('l-aiida_gw0', text, size_budgets={'log': 4096})
+        self.assertEqual(log.truncated, {'size': len(text), 'read': 4096})
+        self.assertEqual([error.split()[-2] for error in log.errors], ['first', 'last'])
+        self.assertEqual(log.last_time, 3599)
+        self.assertEqual(log.last_memory, 0.99)
+
+    def test_whole_log(self):
+        text = _long_log(1000)
+        for budgets in ({'log': None}, {'log': len(text)}, None):
+            log = self.parse('l-aiida_gw0', text, size_budgets=budgets)
+            self.assertIsNone(log.truncated)
+            self.assertEqual(len(log.errors), 3)
+
+    def test_report_not_sampled(self):
+        report = self.parse('r-aiida_gw0', _report, size_budgets={'report': 64, 'log': 64})
+        self.assertIsNone(report.truncated)
+        self.assertEqual(sorted(report.data), ['1', '2'])
+
+    def test_max_warnings(self):
+        log = self.parse('l-aiida_gw0_CPU_1', _log, max_warnings=1)
+        self.assertEqual(len(log.warnings), 1)
+        self.assertEqual(log.warnings_count, 2)
+        self.assertEqual(len(self.parse('l-aiida_gw0_CPU_1', _log).warnings), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the yambo input writer (aiida_yambo.calculations.yamboinput)
+"""
+import unittest
+from aiida_yambo.calculations.yamboinput import yambo_input
+
+class TestYamboInput(unittest.TestCase):
+
+    def test_canonical_order(self):
+        parameters = {'ppa': True, 'gw0': True, 'rim_cut': False, 'NGsBlkXp': 2, 'NGsBlkXp_units': 'Ry',
+                      'BndsRnXp': (1, 50), 'Chimod': 'Hartree'}
+        text = yambo_input(parameters, header='#\n')
+        self.assertEqual(text, '#\ngw0\nppa\n% BndsRnXp\n 1 | 50 |\n%\nChimod = "Hartree"\nNGsBlkXp = 2 Ry\n')
+        self.assertEqual(text, yambo_input(dict(reversed(list(parameters.items()))), header='#\n'))
+
+    def test_qp_ranges(self):
+        text = yambo_input({'QPkrange': [(1, 1, 8, 9), (2, 3, 8, 9)]})
+        self.assertEqual(text, '% QPkrange\n 1 | 1 | 8 | 9 |\n 2 | 3 | 8 | 9 |\n%\n')
+
+    def test_default_roles(self):
+        text = yambo_input({'SE_CPU': [1, 2, 4]})
+        self.assertEqual(text, 'SE_ROLEs = "q qp b"\nSE_CPU = "1 2 4"\n')
+
+    def test_roles_cpu_pair(self):
+        # parallelization keys without default roles keep the ROLEs given in the parameters
+        text = yambo_input({'DIP_CPU': '1 2 4', 'DIP_ROLEs': 'k c v'})
+        self.assertEqual(text, 'DIP_ROLEs = "k c v"\nDIP_CPU = "1 2 4"\n')
+        text = yambo_input({'BS_CPU': [2, 2], 'BS_ROLEs': 'k eh'})
+        self.assertEqual(text, 'BS_ROLEs = "k eh"\nBS_CPU = "2 2"\n')
+
+    def test_roles_without_cpu(self):
+        self.assertEqual(yambo_input({'DIP_ROLEs': 'k c v'}), 'DIP_ROLEs = "k c v"\n')
+
+if __name__ == '__main__':
+    unittest.main()